@@ -0,0 +1,75 @@
+"""
+マイクロバッチ（短い時間に届いたリクエストをまとめて1回で処理する）
+作文の採点のように、1件ずつGeminiへ投げると指示文が毎回重複する処理に使う
+"""
+import asyncio
+from typing import Awaitable, Callable
+
+
+class MicroBatcher:
+    """
+    submit(item) した物を window 秒（または max_size 件たまるまで）待って
+    handler([item, ...]) にまとめて渡し、戻り値のリストを1件ずつ呼び出し元に返す
+    handler の戻り値に Exception が入っていたら、その1件だけエラーにする
+    イベントループの中だけで使う（ロック不要）
+    """
+
+    def __init__(self, handler: Callable[[list], Awaitable[list]], max_size: int = 10, window: float = 0.2):
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.window = window
+        self._pending = []  # (item, future)
+        self._timer = None
+        self._running = set()
+        self.stats = {"batches": 0, "items": 0, "largest": 0}
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        self.stats["largest"] = max(self.stats["largest"], len(batch))
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        # 結果が足りない分は待たせっぱなしにせずエラーにする
+        for _, future in batch[len(results):]:
+            if not future.done():
+                future.set_exception(RuntimeError("まとめ処理の結果が足りません"))
+
+    def snapshot(self) -> dict:
+        batches = self.stats["batches"]
+        return {**self.stats, "pending": len(self._pending),
+                "average": round(self.stats["items"] / batches, 2) if batches else 0}
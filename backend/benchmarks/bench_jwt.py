@@ -0,0 +1,81 @@
+"""
+JWT検証のベンチマーク
+get_current_user が毎リクエストやっているトークン検証を、やり方ごとに1回あたりの時間で比べる
+
+  - jose:       今までの python-jose の jwt.decode
+  - pyjwt:      PyJWT の jwt.decode（入っていれば）
+  - hmac:       標準ライブラリだけで HS256 の署名と exp を確認
+  - cache hit:  token_cache.TokenCache に入っている時（sha256 + 辞書引き）
+
+使い方（backend/ で）: python benchmarks/bench_jwt.py [回数]
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jose import jwt as jose_jwt  # noqa: E402
+from token_cache import TokenCache  # noqa: E402
+
+SECRET_KEY = "benchmark-secret-key"
+ALGORITHM = "HS256"
+
+
+def b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def hmac_decode(token: str) -> dict:
+    """HS256専用の最小限の検証（比較用。本番では使わない）"""
+    header_b64, payload_b64, signature_b64 = token.split(".")
+    expected = hmac.new(SECRET_KEY.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, b64decode(signature_b64)):
+        raise ValueError("signature")
+    payload = json.loads(b64decode(payload_b64))
+    if payload["exp"] <= time.time():
+        raise ValueError("expired")
+    return payload
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    now = datetime.utcnow()
+    token = jose_jwt.encode(
+        {"sub": "student-0001", "exp": now + timedelta(days=7), "iat": now},
+        SECRET_KEY, algorithm=ALGORITHM,
+    )
+
+    cache = TokenCache(10000)
+    cache.put(token, jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]))
+
+    cases = [
+        ("jose", lambda: jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])),
+        ("hmac", lambda: hmac_decode(token)),
+        ("cache hit", lambda: cache.get(token)),
+    ]
+    try:
+        import jwt as pyjwt
+        cases.insert(1, ("pyjwt", lambda: pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])))
+    except ImportError:
+        print("（PyJWT は入っていないのでスキップ）")
+
+    for name, fn in cases:
+        assert fn()["sub"] == "student-0001"
+
+    print(f"🔑 JWT検証 {number}回ずつ（3回の最速）")
+    baseline = None
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+        baseline = baseline or best
+        print(f"  {name:<10} {best:8.2f} µs/回  (jose比 x{baseline / best:.1f})")
+
+
+if __name__ == "__main__":
+    main()
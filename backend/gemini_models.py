@@ -0,0 +1,100 @@
+"""
+Geminiモデルの一覧（起動を遅くしないための遅延取得 + ディスクキャッシュ）
+list_models() はネットワーク越しで遅く、失敗もするので import 時には呼ばない。
+起動時はディスクのキャッシュ（古くても使う）か GEMINI_MODEL だけを見て、
+一覧の取り直しは起動後にバックグラウンドで行う
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "")  # 指定したらモデル一覧を取りに行かずにこれを使う
+GEMINI_MODELS_CACHE = os.getenv("GEMINI_MODELS_CACHE", "gemini_models.json")
+GEMINI_MODELS_TTL = int(os.getenv("GEMINI_MODELS_TTL", "86400"))  # 一覧を取り直すまでの秒数
+FALLBACK_MODELS = ["gemini-pro"]  # 一覧がまだ無い・取れない時に使うモデル
+
+
+class ModelCatalog:
+    """
+    lister(): generateContent が使えるモデル名のリストを返す関数（genai.list_models をラップ）
+    names() は手元にある一覧をすぐ返す。refresh() が実際に取りに行く（同期・遅い）
+    """
+
+    def __init__(self, lister: Callable[[], list], cache_path: str = GEMINI_MODELS_CACHE,
+                 ttl: int = GEMINI_MODELS_TTL, override: str = GEMINI_MODEL):
+        self.lister = lister
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.override = override.strip()
+        self._names: Optional[list] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"source": None, "refreshes": 0, "failures": 0, "last_refresh_ms": 0.0}
+        if self.override:
+            self._names = [self.override]
+            self.stats["source"] = "override"
+        else:
+            self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            names = [name for name in data.get("models", []) if isinstance(name, str) and name]
+        except (OSError, ValueError, AttributeError):
+            return
+        if names:
+            self._names = names
+            self._fetched_at = float(data.get("fetched_at") or 0)
+            self.stats["source"] = "cache"
+
+    def _save_cache(self, names: list):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": self._fetched_at, "models": names}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ モデル一覧のキャッシュ保存に失敗: {e}", flush=True)
+
+    def names(self) -> list:
+        """今わかっているモデル名（まだ何も無ければ FALLBACK_MODELS）"""
+        return list(self._names or FALLBACK_MODELS)
+
+    def needs_refresh(self) -> bool:
+        if self.override:
+            return False
+        return self._names is None or time.time() - self._fetched_at > self.ttl
+
+    def seconds_until_stale(self) -> float:
+        return max(0.0, self._fetched_at + self.ttl - time.time())
+
+    def refresh(self) -> list:
+        """モデル一覧を取り直してキャッシュに書く。失敗したら今の一覧のまま（例外は投げない）"""
+        if self.override:
+            return self.names()
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                names = [name for name in self.lister() if name]
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"⚠️ モデル一覧の取得に失敗（今の一覧のまま）: {e}", flush=True)
+                return self.names()
+            if not names:
+                self.stats["failures"] += 1
+                print("⚠️ generateContent が使えるモデルが見つからへん（今の一覧のまま）", flush=True)
+                return self.names()
+            self._names = names
+            self._fetched_at = time.time()
+            self._save_cache(names)
+            self.stats["source"] = "api"
+            self.stats["refreshes"] += 1
+            self.stats["last_refresh_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            print(f"📋 モデル一覧を更新: {names[:5]} ({self.stats['last_refresh_ms']}ms)", flush=True)
+            return list(names)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "models": self.names()[:10], "stale": self.needs_refresh()}
@@ -0,0 +1,442 @@
+"""
+ローカル保存用のSQLiteストレージ（Supabaseが使えない時のフォールバック）
+以前は database.json / grammar.json / users.json を毎回まるごと読み書きしていたが、
+データが増えても速いようにインデックス付きのSQLite（WALモード）に置き換えた
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+LOCAL_DB_FILE = os.getenv("LOCAL_DB_FILE", "local.db")
+
+USER_FIELDS = ("password_hash", "is_admin", "language", "created_at", "webauthn_credentials")
+# 復習スケジュール用に words へ後から足した列（古いDBには起動時に追加する）
+REVIEW_COLUMNS = {"ease": "REAL DEFAULT 2.5", "interval_days": "INTEGER DEFAULT 0", "reps": "INTEGER DEFAULT 0", "next_due": "TEXT"}
+# API から選べる列（fields= の射影はこの中だけ）
+TABLE_COLUMNS = {
+    "words": ("id", "user_id", "lesson", "word", "pinyin", "meaning", "correct_count", "miss_count", "last_reviewed",
+              "ease", "interval_days", "reps", "next_due"),
+    "grammar": ("id", "user_id", "lesson", "title", "description", "example_cn", "example_jp"),
+}
+
+
+class SQLiteBackedStore:
+    """SQLiteファイルを使うストアの共通部分（スレッドごとの接続管理）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッドをまたげないのでスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+def _lesson_value(lesson):
+    """JSON時代は文字列のレッスン番号も混ざっていたので、数字にできるものは数字にそろえる"""
+    try:
+        return int(lesson)
+    except (TypeError, ValueError):
+        return lesson
+
+
+class LocalDB(SQLiteBackedStore):
+    """users / words / grammar をSQLiteに保存する"""
+
+    def __init__(self, path: str = LOCAL_DB_FILE):
+        super().__init__(path)
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                student_id TEXT PRIMARY KEY,
+                password_hash TEXT DEFAULT '',
+                is_admin INTEGER DEFAULT 0,
+                language TEXT DEFAULT 'chinese',
+                created_at TEXT DEFAULT '',
+                webauthn_credentials TEXT DEFAULT '[]'
+            );
+            CREATE TABLE IF NOT EXISTS words (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                lesson INTEGER NOT NULL,
+                word TEXT NOT NULL,
+                pinyin TEXT,
+                meaning TEXT,
+                correct_count INTEGER DEFAULT 0,
+                miss_count INTEGER DEFAULT 0,
+                last_reviewed TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_words_user_lesson ON words(user_id, lesson);
+            CREATE TABLE IF NOT EXISTS grammar (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                lesson INTEGER NOT NULL,
+                title TEXT,
+                description TEXT,
+                example_cn TEXT,
+                example_jp TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_grammar_user_lesson ON grammar(user_id, lesson);
+            CREATE TABLE IF NOT EXISTS lesson_index (
+                user_id TEXT NOT NULL,
+                lesson INTEGER NOT NULL,
+                word_count INTEGER DEFAULT 0,
+                grammar_count INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, lesson)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(words)")}
+        for column, definition in REVIEW_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE words ADD COLUMN {column} {definition}")
+        # 「次に復習する単語」を1回のインデックス検索で取れるように
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_words_user_due ON words(user_id, next_due)")
+        conn.commit()
+        if not self._get_meta("lesson_index_built"):
+            self.rebuild_lesson_index()
+
+    # ---------- JSONからの移行 ----------
+
+    def migrate_from_json(self, words_file: str, grammar_file: str, users_file: str):
+        """
+        既存の database.json / grammar.json / users.json を1回だけ取り込む
+        取り込んだファイルは .migrated を付けて残しておく
+        """
+        for table, path in (("words", words_file), ("grammar", grammar_file), ("users", users_file)):
+            if not os.path.exists(path) or self._get_meta(f"migrated_{table}"):
+                continue
+
+            conn = self._conn()
+            rows = None
+            with conn:
+                # 複数のワーカーが同時に起動しても1回だけ取り込むよう、書き込みロックを取ってから見直す
+                conn.execute("BEGIN IMMEDIATE")
+                if self._get_meta(f"migrated_{table}"):
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        rows = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"⚠️ {path} の移行をスキップ: {e}")
+                    continue
+                if table == "words":
+                    conn.executemany(
+                        """INSERT INTO words (user_id, lesson, word, pinyin, meaning, correct_count, miss_count, last_reviewed)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(
+                            row.get("user_id", ""), _lesson_value(row.get("lesson")), row.get("word", ""),
+                            row.get("pinyin", ""), row.get("meaning", ""), row.get("correct_count", 0),
+                            row.get("miss_count", 0), row.get("last_reviewed"),
+                        ) for row in rows],
+                    )
+                elif table == "grammar":
+                    conn.executemany(
+                        """INSERT INTO grammar (user_id, lesson, title, description, example_cn, example_jp)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        [(
+                            row.get("user_id", ""), _lesson_value(row.get("lesson")), row.get("title", "無題"),
+                            row.get("description", ""), row.get("example_cn", ""), row.get("example_jp", ""),
+                        ) for row in rows],
+                    )
+                else:
+                    self._upsert_users(conn, rows)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, '1')", (f"migrated_{table}",))
+            try:
+                os.replace(path, path + ".migrated")
+            except FileNotFoundError:
+                pass  # 別のワーカーがもう名前を変えた
+            print(f"📦 {path} から {len(rows)}件をSQLite ({self.path}) に移行したで！")
+            if table != "users":
+                self.rebuild_lesson_index()
+
+    def rebuild_lesson_index(self):
+        """words / grammar からレッスンごとの件数を数え直す（初回と移行の後だけ）"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM lesson_index")
+            conn.execute("""
+                INSERT INTO lesson_index (user_id, lesson, word_count, grammar_count)
+                SELECT user_id, lesson, SUM(word_count), SUM(grammar_count) FROM (
+                    SELECT user_id, lesson, COUNT(*) AS word_count, 0 AS grammar_count FROM words GROUP BY user_id, lesson
+                    UNION ALL
+                    SELECT user_id, lesson, 0, COUNT(*) FROM grammar GROUP BY user_id, lesson
+                ) GROUP BY user_id, lesson
+            """)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('lesson_index_built', '1')")
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # ---------- ユーザー ----------
+
+    @staticmethod
+    def _user_from_row(row) -> dict:
+        student_id, password_hash, is_admin, language, created_at, credentials = row
+        return {
+            "student_id": student_id,
+            "password_hash": password_hash or "",
+            "is_admin": bool(is_admin),
+            "language": language or "chinese",
+            "created_at": created_at or "",
+            "webauthn_credentials": json.loads(credentials) if credentials else [],
+        }
+
+    @staticmethod
+    def _upsert_users(conn: sqlite3.Connection, users: list):
+        conn.executemany(
+            """INSERT INTO users (student_id, password_hash, is_admin, language, created_at, webauthn_credentials)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(student_id) DO UPDATE SET
+                   password_hash = excluded.password_hash,
+                   is_admin = excluded.is_admin,
+                   language = excluded.language,
+                   created_at = excluded.created_at,
+                   webauthn_credentials = excluded.webauthn_credentials""",
+            [(
+                user["student_id"], user.get("password_hash", ""), int(bool(user.get("is_admin", False))),
+                user.get("language", "chinese"), user.get("created_at", ""),
+                json.dumps(user.get("webauthn_credentials", []), ensure_ascii=False),
+            ) for user in users],
+        )
+
+    def load_users(self) -> list:
+        rows = self._conn().execute(
+            "SELECT student_id, password_hash, is_admin, language, created_at, webauthn_credentials FROM users"
+        ).fetchall()
+        return [self._user_from_row(row) for row in rows]
+
+    def get_user(self, student_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            """SELECT student_id, password_hash, is_admin, language, created_at, webauthn_credentials
+               FROM users WHERE student_id = ?""",
+            (student_id,),
+        ).fetchone()
+        return self._user_from_row(row) if row else None
+
+    def get_users(self, student_ids: list) -> list:
+        """複数の学生IDをまとめて検索（SQLiteの変数の上限を超えんよう500件ずつ）"""
+        rows = []
+        for start in range(0, len(student_ids), 500):
+            chunk = list(student_ids[start:start + 500])
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self._conn().execute(
+                f"""SELECT student_id, password_hash, is_admin, language, created_at, webauthn_credentials
+                    FROM users WHERE student_id IN ({placeholders})""",
+                chunk,
+            ).fetchall())
+        return [self._user_from_row(row) for row in rows]
+
+    def count_users(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def insert_user(self, user: dict) -> bool:
+        """新規登録（既にいればFalse）"""
+        conn = self._conn()
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT INTO users (student_id, password_hash, is_admin, language, created_at, webauthn_credentials)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (
+                        user["student_id"], user.get("password_hash", ""), int(bool(user.get("is_admin", False))),
+                        user.get("language", "chinese"), user.get("created_at", ""),
+                        json.dumps(user.get("webauthn_credentials", []), ensure_ascii=False),
+                    ),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def upsert_users(self, users: list):
+        conn = self._conn()
+        with conn:
+            self._upsert_users(conn, users)
+
+    def update_user(self, student_id: str, fields: dict):
+        fields = {key: value for key, value in fields.items() if key in USER_FIELDS}
+        if not fields:
+            return
+        if "is_admin" in fields:
+            fields["is_admin"] = int(bool(fields["is_admin"]))
+        if "webauthn_credentials" in fields:
+            fields["webauthn_credentials"] = json.dumps(fields["webauthn_credentials"], ensure_ascii=False)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        conn = self._conn()
+        with conn:
+            conn.execute(f"UPDATE users SET {assignments} WHERE student_id = ?", (*fields.values(), student_id))
+
+    def delete_user(self, student_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM users WHERE student_id = ?", (student_id,))
+
+    # ---------- 単語・文法 ----------
+
+    @staticmethod
+    def _bump_lesson_index(conn: sqlite3.Connection, user_id: str, lesson: int, words: int = 0, grammar: int = 0):
+        conn.execute(
+            """INSERT INTO lesson_index (user_id, lesson, word_count, grammar_count) VALUES (?, ?, ?, ?)
+               ON CONFLICT(user_id, lesson) DO UPDATE SET
+                   word_count = word_count + excluded.word_count,
+                   grammar_count = grammar_count + excluded.grammar_count""",
+            (user_id, _lesson_value(lesson), words, grammar),
+        )
+
+    def insert_words(self, user_id: str, lesson: int, words: list):
+        """単語をまとめて1トランザクションで追加（レッスン一覧の件数も一緒に更新）"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                """INSERT INTO words (user_id, lesson, word, pinyin, meaning, correct_count, miss_count, last_reviewed)
+                   VALUES (?, ?, ?, ?, ?, 0, 0, NULL)""",
+                [(user_id, lesson, word.get("word", ""), word.get("pinyin", ""), word.get("meaning", "")) for word in words],
+            )
+            self._bump_lesson_index(conn, user_id, lesson, words=len(words))
+
+    def insert_grammar(self, user_id: str, lesson: int, items: list):
+        """文法をまとめて1トランザクションで追加（レッスン一覧の件数も一緒に更新）"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                """INSERT INTO grammar (user_id, lesson, title, description, example_cn, example_jp)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [(
+                    user_id, lesson, item.get("title", "無題"), item.get("description", ""),
+                    item.get("example_cn", ""), item.get("example_jp", ""),
+                ) for item in items],
+            )
+            self._bump_lesson_index(conn, user_id, lesson, grammar=len(items))
+
+    def _select(self, table: str, user_id: str, lesson=None) -> list:
+        conn = self._conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            if lesson is None:
+                rows = conn.execute(f"SELECT * FROM {table} WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT * FROM {table} WHERE user_id = ? AND lesson = ? ORDER BY id",
+                    (user_id, _lesson_value(lesson)),
+                ).fetchall()
+        finally:
+            conn.row_factory = None
+        return [dict(row) for row in rows]
+
+    def query_items(self, table: str, user_id: str, lessons: Optional[list] = None, fields: Optional[list] = None,
+                    after_id: Optional[int] = None, limit: Optional[int] = None, random_order: bool = False) -> list:
+        """
+        words / grammar を条件付きで取得
+        lessons: 複数レッスンで絞り込み / fields: 返す列 / after_id + limit: idの続きから1ページ分
+        random_order: ランダムに並べる（limit と合わせて抜き取り）
+        """
+        columns = TABLE_COLUMNS[table]
+        selected = [field for field in (fields or columns) if field in columns]
+        sql = f"SELECT {', '.join(selected)} FROM {table} WHERE user_id = ?"
+        params = [user_id]
+        if lessons:
+            sql += f" AND lesson IN ({','.join('?' * len(lessons))})"
+            params.extend(_lesson_value(lesson) for lesson in lessons)
+        if after_id is not None:
+            sql += " AND id > ?"
+            params.append(after_id)
+        sql += " ORDER BY RANDOM()" if random_order else " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self._conn().execute(sql, params).fetchall()
+        return [dict(zip(selected, row)) for row in rows]
+
+    def get_words(self, user_id: str, lesson=None) -> list:
+        return self._select("words", user_id, lesson)
+
+    def get_grammar(self, user_id: str, lesson=None) -> list:
+        return self._select("grammar", user_id, lesson)
+
+    def get_lessons(self, table: str, user_id: str) -> list:
+        """words / grammar のどちらかに入っているレッスン番号（重複なし）"""
+        rows = self._conn().execute(
+            f"SELECT DISTINCT lesson FROM {table} WHERE user_id = ? ORDER BY lesson",
+            (user_id,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_lesson_index(self, user_id: str) -> list:
+        """レッスン番号と単語・文法の件数（lesson_indexテーブルを1回引くだけ）"""
+        rows = self._conn().execute(
+            "SELECT lesson, word_count, grammar_count FROM lesson_index WHERE user_id = ? ORDER BY lesson",
+            (user_id,),
+        ).fetchall()
+        return [{"lesson": lesson, "word_count": words, "grammar_count": grammar} for lesson, words, grammar in rows]
+
+    # ---------- 復習スケジュール ----------
+
+    def get_words_by_ids(self, user_id: str, word_ids: list) -> list:
+        """本人の単語だけをidでまとめて取得"""
+        columns = TABLE_COLUMNS["words"]
+        rows = []
+        for start in range(0, len(word_ids), 500):
+            chunk = list(word_ids[start:start + 500])
+            rows.extend(self._conn().execute(
+                f"SELECT {', '.join(columns)} FROM words WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                [user_id, *chunk],
+            ).fetchall())
+        return [dict(zip(columns, row)) for row in rows]
+
+    def update_review_states(self, user_id: str, rows: list):
+        """復習結果をまとめて1トランザクションで書き込む"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                """UPDATE words SET ease = ?, interval_days = ?, reps = ?, next_due = ?,
+                       correct_count = ?, miss_count = ?, last_reviewed = ?
+                   WHERE id = ? AND user_id = ?""",
+                [(
+                    row["ease"], row["interval_days"], row["reps"], row["next_due"],
+                    row["correct_count"], row["miss_count"], row["last_reviewed"], row["id"], user_id,
+                ) for row in rows],
+            )
+
+    def get_vocabulary(self) -> dict:
+        """全ユーザーの単語 -> 登録数（単語分割の辞書用）"""
+        rows = self._conn().execute("SELECT word, COUNT(*) FROM words GROUP BY word").fetchall()
+        return {word: count for word, count in rows}
+
+    def get_due_words(self, user_id: str, now: str, limit: int, lessons: Optional[list] = None,
+                      include_new: bool = True) -> list:
+        """
+        復習の期限が来た単語を期限の古い順に limit 件（(user_id, next_due) のインデックスを範囲検索）
+        足りなければ、まだ一度も復習していない単語（next_due が NULL）で埋める
+        """
+        columns = TABLE_COLUMNS["words"]
+        lesson_sql, lesson_params = "", []
+        if lessons:
+            lesson_sql = f" AND lesson IN ({','.join('?' * len(lessons))})"
+            lesson_params = [_lesson_value(lesson) for lesson in lessons]
+        conn = self._conn()
+        rows = conn.execute(
+            f"""SELECT {', '.join(columns)} FROM words
+                WHERE user_id = ? AND next_due IS NOT NULL AND next_due <= ?{lesson_sql}
+                ORDER BY next_due LIMIT ?""",
+            [user_id, now, *lesson_params, limit],
+        ).fetchall()
+        if include_new and len(rows) < limit:
+            rows += conn.execute(
+                f"""SELECT {', '.join(columns)} FROM words
+                    WHERE user_id = ? AND next_due IS NULL{lesson_sql}
+                    ORDER BY id LIMIT ?""",
+                [user_id, *lesson_params, limit - len(rows)],
+            ).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
@@ -1,6 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Header
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import google.generativeai as genai
 import os
@@ -14,11 +14,42 @@ from typing import Optional
 from pydantic import BaseModel
 from PIL import Image
 import io
+import time
+import hashlib
+import unicodedata
+import uuid
+import random
+import re
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import secrets
+import csv
 from supabase import create_client, Client
+from workers import preprocess_handwriting, prepare_textbook_page, split_pdf_pages, hash_passwords, verify_password_hash
+from scheduler import apply_reviews, format_due, outcome_quality, parse_due
+from review_buffer import ReviewWriteBuffer, REVIEW_JOURNAL_FILE
+from questions import QUESTION_TYPES, QuestionCache, build_questions, shuffled_for_session
+from segmenter import Segmenter, SEGMENT_DICT_CACHE
+from sorting import score_sorting_answer
+from batching import MicroBatcher
+from token_cache import TokenCache
+from gemini_models import ModelCatalog
+from model_router import (
+    ModelRouter, parse_task_tiers, split_names,
+    GEMINI_TASK_TIERS, GEMINI_FAST_MODELS, GEMINI_QUALITY_MODELS, GEMINI_FAILOVER_ATTEMPTS,
+)
+from local_db import LocalDB, LOCAL_DB_FILE
+from prescore import DEFAULT_LANGUAGE, local_prescore_stats, normalize_answer, prescore_handwriting, prescore_writing
+from result_store import create_result_store
+from score_cache import (
+    PerceptualHashIndex, ScoreCache, SCORE_CACHE_DB, WRITING_CACHE_MAX, WRITING_CACHE_TTL,
+    HANDWRITING_HASH_CACHE, HANDWRITING_HASH_DISTANCE, HANDWRITING_HASH_MAX_ANSWERS, HANDWRITING_HASH_PER_ANSWER,
+)
+from repositories import CachedUserRepo, create_repositories, repo_stats_snapshot
 
 # FutureWarningを抑制（Supabaseライブラリなどからの警告を無視）
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -38,23 +69,54 @@ if SUPABASE_URL and SUPABASE_KEY:
         print("✅ Supabase接続成功")
     except Exception as e:
         print(f"⚠️ Supabase接続エラー: {e}")
-        print("💡 ローカルJSONモードで動作します")
+        print("💡 ローカルSQLiteモードで動作します")
 else:
     print("⚠️ SUPABASE_URL/SUPABASE_KEYが設定されていません")
-    print("💡 ローカルJSONモードで動作します")
+    print("💡 ローカルSQLiteモードで動作します")
 
-# データベースファイルの場所（フォールバック用）
+# 旧JSONファイルの場所（起動時に1回だけSQLiteへ移行する）
 DB_FILE = "database.json"
 GRAMMAR_DB_FILE = "grammar.json"  # 文法用のファイル
 USERS_FILE = "users.json"  # ユーザー情報
 
+# ストレージの選択（auto / supabase / sqlite / memory）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto").lower()
+
+# ローカル保存（フォールバック用、SQLite WALモード）
+local_db: Optional[LocalDB] = None
+if STORAGE_BACKEND != "memory":
+    local_db = LocalDB(LOCAL_DB_FILE)
+    local_db.migrate_from_json(DB_FILE, GRAMMAR_DB_FILE, USERS_FILE)
+
+# データアクセスは全部ここを通す（Supabase → SQLiteのフォールバックや計測もリポジトリ側でやる）
+USER_UPSERT_CHUNK = int(os.getenv("USER_UPSERT_CHUNK", "500"))  # ユーザーをまとめて保存する時の1リクエストの人数
+# DBアクセスは専用のスレッドプールで動かす（Starletteの既定のスレッドプールやイベントループを塞がない）
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+repos = create_repositories(STORAGE_BACKEND, supabase, local_db, chunk_size=USER_UPSERT_CHUNK, executor=db_executor)
+words_repo, grammar_repo, lessons_repo = repos.words, repos.grammar, repos.lessons
+
+# ユーザーは管理者チェックのたびに引くので、短時間だけプロセス内で覚えておく
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "30"))  # 秒。0でキャッシュなし
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "1000"))
+users_repo = CachedUserRepo(repos.users, USER_CACHE_TTL, USER_CACHE_MAX) if USER_CACHE_TTL > 0 else repos.users
+
 # 認証設定
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))  # JWT署名用の秘密鍵
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7日間
+# 1にするとトークンに is_admin / language を入れて、管理者チェックや /api/auth/me でDBを見んようにする
+# （権限を変えても、そのユーザーが再ログインするまでトークンの値が使われる）
+JWT_USER_CLAIMS = os.getenv("JWT_USER_CLAIMS", "0") == "1"
+# 検証済みトークンを覚えておく数（ポーリングのたびに署名を検証しない）。0でキャッシュなし
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "10000"))
+token_cache = TokenCache(TOKEN_CACHE_MAX)
 
 # パスワードハッシュ化（bcryptの72バイト制限を避けるため、pbkdf2_sha256を使用）
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# 計算はCPUプロセスプールで行う（workers.hash_passwords / verify_password_hash）
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "0"))  # 0ならpasslibの既定値。変えるとログイン時に作り直す
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+password_hash_semaphore = asyncio.Semaphore(max(1, PASSWORD_HASH_CONCURRENCY))
 
 # JWT認証
 security = HTTPBearer()
@@ -66,26 +128,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # ページ分けの続きの位置をフロントから読めるようにする
 )
 
 # ==================== 認証関連の関数 ====================
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """パスワード検証"""
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    """
+    パスワード検証。戻り値は (合っているか, 作り直したハッシュ or None)
+    ハッシュの回数が PASSWORD_HASH_ROUNDS と違えば、合っていた時に新しいハッシュも返す
+    """
     if not hashed_password:
-        return not plain_password or len(plain_password) == 0  # パスワードが任意の場合は空文字列でもOK
+        return not plain_password or len(plain_password) == 0, None  # パスワードが任意の場合は空文字列でもOK
     if not plain_password or len(plain_password) == 0:
-        return not hashed_password or len(hashed_password) == 0  # 入力が空の場合、ハッシュも空ならOK
+        return False, None  # 入力が空でハッシュがある場合はNG
     # pbkdf2_sha256は72バイト制限がないので、そのまま検証
-    return pwd_context.verify(plain_password, hashed_password)
+    async with password_hash_semaphore:
+        return tuple(await run_cpu_task(verify_password_hash, plain_password, hashed_password, PASSWORD_HASH_ROUNDS))
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """パスワードハッシュ化"""
     # 空文字列の場合はハッシュ化せずに空文字列を返す
     if not password or len(password.strip()) == 0:
         return ""  # パスワードが任意の場合は空文字列（ハッシュ化しない）
-    # pbkdf2_sha256は72バイト制限がないので、そのままハッシュ化
-    return pwd_context.hash(password)
+    async with password_hash_semaphore:
+        return (await run_cpu_task(hash_passwords, [password], PASSWORD_HASH_ROUNDS))[0]
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """JWTトークン生成"""
@@ -94,133 +161,80 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})  # iat はユーザー削除時の取り消しに使う
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """現在のユーザーを取得（JWT認証）"""
-    token = credentials.credentials
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        student_id: str = payload.get("sub")
-        if student_id is None:
+def token_claims(user: dict) -> dict:
+    """アクセストークンに入れる中身（JWT_USER_CLAIMS=1なら権限と言語も入れる）"""
+    claims = {"sub": user["student_id"]}
+    if JWT_USER_CLAIMS:
+        claims["is_admin"] = bool(user.get("is_admin", False))
+        claims["language"] = user.get("language", "chinese")
+    return claims
+
+def decode_token(token: str) -> dict:
+    """JWTトークンを検証して中身を返す（一度検証したトークンは token_cache から返す）"""
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise HTTPException(status_code=401, detail="認証情報が無効です")
+        if payload.get("sub") is None:
             raise HTTPException(status_code=401, detail="認証情報が無効です")
-        return student_id
-    except JWTError:
+        token_cache.put(token, payload)
+    if token_cache.is_revoked(payload):
         raise HTTPException(status_code=401, detail="認証情報が無効です")
+    return payload
 
-def get_current_admin(current_user: str = Depends(get_current_user)):
-    """現在のユーザーがadminかどうかを確認"""
-    user = get_user_by_student_id(current_user)
-    if not user:
-        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
-    if not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="管理者権限が必要です")
-    return current_user
+async def run_db(fn, *args):
+    """DBに触る同期関数を db_executor で動かす"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, fn, *args)
+
+# 依存関数は async にしておく（同期だと毎リクエスト既定のスレッドプールを1本使う）
+async def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """現在のトークンの中身を取得（JWT認証）"""
+    return decode_token(credentials.credentials)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """現在のユーザーを取得（JWT認証）"""
+    return get_user_from_token(credentials.credentials)
+
+def get_user_from_token(token: str) -> str:
+    """JWTトークンから学生IDを取り出す（EventSourceはヘッダーを送れへんのでクエリ用にも使う）"""
+    return decode_token(token)["sub"]
 
 def load_users():
-    """ユーザー情報を読み込む（Supabase優先、フォールバックはJSON）"""
-    if supabase:
-        try:
-            response = supabase.table("users").select("*").execute()
-            data = response.data if response.data else []
-            print(f"✅ Supabaseから {len(data)}人のユーザーを取得", flush=True)
-            return data
-        except Exception as e:
-            print(f"⚠️ Supabase読み込みエラー: {e}", flush=True)
-            traceback.print_exc()
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    if not os.path.exists(USERS_FILE):
-        return []
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+    """ユーザー情報を読み込む（Supabase優先、フォールバックはSQLite）"""
+    users = users_repo.list_all()
+    print(f"✅ {len(users)}人のユーザーを取得", flush=True)
+    return users
 
 def save_users(users: list):
-    """ユーザー情報を保存（Supabase優先、フォールバックはJSON）"""
-    if supabase:
-        try:
-            # Supabaseの場合は全件削除してから再挿入（簡易実装）
-            # 本番ではupsertを使うべき
-            for user in users:
-                # student_idで既存をチェック
-                existing = supabase.table("users").select("*").eq("student_id", user["student_id"]).execute()
-                if existing.data:
-                    # 更新
-                    supabase.table("users").update({
-                        "password_hash": user.get("password_hash", ""),
-                        "is_admin": user.get("is_admin", False),
-                        "language": user.get("language", "chinese"),
-                        "created_at": user.get("created_at", ""),
-                        "webauthn_credentials": user.get("webauthn_credentials", [])
-                    }).eq("student_id", user["student_id"]).execute()
-                else:
-                    # 新規挿入
-                    supabase.table("users").insert({
-                        "student_id": user["student_id"],
-                        "password_hash": user.get("password_hash", ""),
-                        "is_admin": user.get("is_admin", False),
-                        "language": user.get("language", "chinese"),
-                        "created_at": user.get("created_at", ""),
-                        "webauthn_credentials": user.get("webauthn_credentials", [])
-                    }).execute()
-            print("💾 Supabaseにユーザーを保存したで！")
-            return
-        except Exception as e:
-            print(f"⚠️ Supabase保存エラー: {e}")
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    """ユーザー情報を保存（Supabase優先、フォールバックはSQLite）。変更があったユーザーだけまとめて書く"""
+    result = users_repo.save_changed(users)
+    print(f"💾 ユーザーを保存したで！ 新規{result['created']}人 / 更新{result['updated']}人 / 変更なし{result['unchanged']}人")
+    return result
 
 def get_user_by_student_id(student_id: str):
-    """学生IDでユーザーを検索（Supabase優先、フォールバックはJSON）"""
-    if supabase:
-        try:
-            response = supabase.table("users").select("*").eq("student_id", student_id).execute()
-            if response.data and len(response.data) > 0:
-                print(f"✅ ユーザー検索成功: {student_id}", flush=True)
-                return response.data[0]
-            print(f"⚠️ ユーザーが見つかりません: {student_id}", flush=True)
-            return None
-        except Exception as e:
-            print(f"⚠️ Supabase検索エラー: {e}", flush=True)
-            traceback.print_exc()
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    users = load_users()
-    for user in users:
-        if user.get("student_id") == student_id:
-            return user
-    return None
+    """学生IDでユーザーを検索（Supabase優先、フォールバックはSQLite）"""
+    user = users_repo.get(student_id)
+    if user:
+        print(f"✅ ユーザー検索成功: {student_id}", flush=True)
+    else:
+        print(f"⚠️ ユーザーが見つかりません: {student_id}", flush=True)
+    return user
 
 def is_first_user():
     """最初のユーザーかどうかチェック"""
-    if supabase:
-        try:
-            response = supabase.table("users").select("id", count="exact").execute()
-            return response.count == 0 if hasattr(response, 'count') else len(response.data) == 0
-        except Exception as e:
-            print(f"⚠️ Supabaseチェックエラー: {e}")
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    users = load_users()
-    return len(users) == 0
+    return users_repo.count() == 0
 
 # ==================== 認証API ====================
 
+ALLOWED_LANGUAGES = ["chinese", "english", "german", "spanish"]  # 登録できる言語
+
 class RegisterRequest(BaseModel):
     student_id: str
     password: Optional[str] = None
@@ -232,41 +246,34 @@ class LoginRequest(BaseModel):
 
 @app.post("/api/auth/register")
 async def register(request: RegisterRequest):
-    """ユーザー登録（Supabase専用）"""
-    if not supabase:
-        raise HTTPException(status_code=500, detail="Supabaseが設定されていません")
-    
-    # 1. 重複チェック (Supabaseに問い合わせ)
+    """ユーザー登録"""
+    # 1. 重複チェック
     try:
-        existing = supabase.table("users").select("student_id").eq("student_id", request.student_id).execute()
-        if existing.data and len(existing.data) > 0:
-            raise HTTPException(status_code=400, detail="そのIDはもう使われとるで！")
-    except HTTPException:
-        raise
+        existing = await users_repo.aget(request.student_id)
     except Exception as e:
-        print(f"⚠️ Supabase重複チェックエラー: {e}")
+        print(f"⚠️ 重複チェックエラー: {e}")
         raise HTTPException(status_code=500, detail="ユーザー確認中にエラーが発生しました")
+    if existing:
+        raise HTTPException(status_code=400, detail="そのIDはもう使われとるで！")
     
     # 2. パスワードハッシュ化（空文字列の場合は空文字列を返す）
     password_hash = ""
     if request.password and len(request.password.strip()) > 0:
-        password_hash = get_password_hash(request.password)
+        password_hash = await get_password_hash(request.password)
     
     # 3. 言語の検証（許可された言語のみ）
-    allowed_languages = ["chinese", "english", "german", "spanish"]
     language = request.language.lower() if request.language else "chinese"
-    if language not in allowed_languages:
+    if language not in ALLOWED_LANGUAGES:
         language = "chinese"  # 無効な場合はデフォルト
     
-    # 4. 最初のユーザーかチェック（Supabaseから取得）
+    # 4. 最初のユーザーかチェック
     try:
-        all_users = supabase.table("users").select("student_id").execute()
-        is_admin = len(all_users.data) == 0  # 最初のユーザーがadmin
+        is_admin = await users_repo.acount() == 0  # 最初のユーザーがadmin
     except Exception as e:
-        print(f"⚠️ Supabaseユーザー数取得エラー: {e}")
+        print(f"⚠️ ユーザー数取得エラー: {e}")
         is_admin = False  # エラー時はFalse
     
-    # 5. Supabaseに保存
+    # 5. 保存
     new_user = {
         "student_id": request.student_id,
         "password_hash": password_hash,
@@ -277,17 +284,17 @@ async def register(request: RegisterRequest):
     }
     
     try:
-        supabase.table("users").insert(new_user).execute()
-        print(f"💾 Supabaseにユーザーを登録したで！: {request.student_id}")
+        await users_repo.ainsert(new_user)
+        print(f"💾 ユーザーを登録したで！: {request.student_id}")
     except Exception as e:
-        print(f"⚠️ Supabase登録エラー: {e}")
+        print(f"⚠️ ユーザー登録エラー: {e}")
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail="Supabaseへの保存に失敗したわ...")
+        raise HTTPException(status_code=500, detail="ユーザーの保存に失敗したわ...")
     
     # 6. アクセストークン生成
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": request.student_id}, expires_delta=access_token_expires
+        data=token_claims(new_user), expires_delta=access_token_expires
     )
     
     return {
@@ -299,32 +306,33 @@ async def register(request: RegisterRequest):
 
 @app.post("/api/auth/login")
 async def login(request: LoginRequest):
-    """ログイン（学生ID + パスワード、Supabase専用）"""
-    if not supabase:
-        raise HTTPException(status_code=500, detail="Supabaseが設定されていません")
-    
-    # 1. Supabaseからユーザーを探す
+    """ログイン（学生ID + パスワード）"""
+    # 1. ユーザーを探す
     try:
-        response = supabase.table("users").select("*").eq("student_id", request.student_id).execute()
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=401, detail="そんなユーザーおらんで")
-        
-        user_data = response.data[0]  # リストの1番目を取得
-    except HTTPException:
-        raise
+        user_data = await users_repo.aget(request.student_id)
     except Exception as e:
-        print(f"⚠️ Supabaseログイン検索エラー: {e}")
+        print(f"⚠️ ログイン検索エラー: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="ユーザー検索中にエラーが発生しました")
+    if not user_data:
+        raise HTTPException(status_code=401, detail="そんなユーザーおらんで")
     
     # 2. パスワード確認
-    if not verify_password(request.password or "", user_data.get("password_hash", "")):
+    valid, new_hash = await verify_password(request.password or "", user_data.get("password_hash", ""))
+    if not valid:
         raise HTTPException(status_code=401, detail="パスワードちゃうで")
+    if new_hash:
+        # ハッシュの設定（回数）が変わっていたら、パスワードがわかる今のうちに作り直す
+        try:
+            await users_repo.aupdate(request.student_id, {"password_hash": new_hash})
+            print(f"🔐 パスワードハッシュを更新: {request.student_id}", flush=True)
+        except Exception as e:
+            print(f"⚠️ パスワードハッシュの更新に失敗（ログインは続行）: {e}", flush=True)
     
     # 3. トークン発行
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": request.student_id}, expires_delta=access_token_expires
+        data=token_claims(user_data), expires_delta=access_token_expires
     )
     
     return {
@@ -335,9 +343,16 @@ async def login(request: LoginRequest):
     }
 
 @app.get("/api/auth/me")
-async def get_current_user_info(current_user: str = Depends(get_current_user)):
-    """現在のユーザー情報を取得"""
-    user = get_user_by_student_id(current_user)
+async def get_current_user_info(payload: dict = Depends(get_token_payload)):
+    """現在のユーザー情報を取得（トークンに権限と言語が入っていればDBは見ない）"""
+    current_user = payload["sub"]
+    if JWT_USER_CLAIMS and "is_admin" in payload and "language" in payload:
+        return {
+            "student_id": current_user,
+            "is_admin": payload["is_admin"],
+            "language": payload["language"]
+        }
+    user = await users_repo.aget(current_user)
     if not user:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     
@@ -347,9 +362,14 @@ async def get_current_user_info(current_user: str = Depends(get_current_user)):
         "language": user.get("language", "chinese")  # 言語情報も返す
     }
 
-def get_current_admin(current_user: str = Depends(get_current_user)):
-    """現在のユーザーがadminかどうかを確認"""
-    user = get_user_by_student_id(current_user)
+async def get_current_admin(payload: dict = Depends(get_token_payload)):
+    """現在のユーザーがadminかどうかを確認（トークンに権限が入っていればDBは見ない）"""
+    current_user = payload["sub"]
+    if JWT_USER_CLAIMS and "is_admin" in payload:
+        if not payload["is_admin"]:
+            raise HTTPException(status_code=403, detail="管理者権限が必要です")
+        return current_user
+    user = await users_repo.aget(current_user)
     if not user:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     if not user.get("is_admin", False):
@@ -362,7 +382,7 @@ def get_current_admin(current_user: str = Depends(get_current_user)):
 async def get_all_users(admin_user: str = Depends(get_current_admin)):
     """全ユーザー一覧を取得（管理者のみ）"""
     print(f"👥 ユーザー一覧取得開始: Admin={admin_user}", flush=True)
-    users = load_users()
+    users = await users_repo.alist_all()
     # パスワードハッシュは返さない
     user_list = []
     for user in users:
@@ -385,8 +405,8 @@ async def update_user(
     request: UpdateUserRequest,
     admin_user: str = Depends(get_current_admin)
 ):
-    """ユーザー情報を更新（管理者のみ、Supabase優先、フォールバックはJSON）"""
-    target_user = get_user_by_student_id(target_student_id)
+    """ユーザー情報を更新（管理者のみ、Supabase優先、フォールバックはSQLite）"""
+    target_user = await users_repo.aget(target_student_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     
@@ -394,29 +414,12 @@ async def update_user(
     if target_student_id == admin_user and request.is_admin == False:
         raise HTTPException(status_code=400, detail="自分自身の管理者権限を削除することはできません")
     
-    if supabase:
-        try:
-            update_data = {}
-            if request.is_admin is not None:
-                update_data["is_admin"] = request.is_admin
-            
-            if update_data:
-                supabase.table("users").update(update_data).eq("student_id", target_student_id).execute()
-            return {"message": "ユーザー情報を更新しました", "student_id": target_student_id}
-        except Exception as e:
-            print(f"⚠️ Supabase更新エラー: {e}")
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    users = load_users()
-    for user in users:
-        if user["student_id"] == target_student_id:
-            if request.is_admin is not None:
-                user["is_admin"] = request.is_admin
-            break
+    update_data = {}
+    if request.is_admin is not None:
+        update_data["is_admin"] = request.is_admin
     
-    save_users(users)
+    if update_data:
+        await users_repo.aupdate(target_student_id, update_data)
     return {"message": "ユーザー情報を更新しました", "student_id": target_student_id}
 
 @app.delete("/api/admin/users/{target_student_id}")
@@ -424,80 +427,420 @@ async def delete_user(
     target_student_id: str,
     admin_user: str = Depends(get_current_admin)
 ):
-    """ユーザーを削除（管理者のみ、Supabase優先、フォールバックはJSON）"""
+    """ユーザーを削除（管理者のみ、Supabase優先、フォールバックはSQLite）"""
     # 自分自身を削除することはできない
     if target_student_id == admin_user:
         raise HTTPException(status_code=400, detail="自分自身を削除することはできません")
     
-    target_user = get_user_by_student_id(target_student_id)
+    target_user = await users_repo.aget(target_student_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     
-    if supabase:
-        try:
-            supabase.table("users").delete().eq("student_id", target_student_id).execute()
-            return {"message": "ユーザーを削除しました", "student_id": target_student_id}
-        except Exception as e:
-            print(f"⚠️ Supabase削除エラー: {e}")
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    users = load_users()
-    users = [user for user in users if user["student_id"] != target_student_id]
-    save_users(users)
+    await users_repo.adelete(target_student_id)
+    # 削除した人のトークンはこのワーカーでは即無効（他のワーカーには伝わらへん）
+    token_cache.revoke_subject(target_student_id)
     
     return {"message": "ユーザーを削除しました", "student_id": target_student_id}
 
+ROSTER_IMPORT_MAX = int(os.getenv("ROSTER_IMPORT_MAX", "2000"))  # CSV一括登録1回あたりの最大人数
+TRUE_VALUES = ("1", "true", "yes", "y", "はい", "○")
+
+def parse_roster_csv(text: str) -> tuple:
+    """
+    名簿CSVを読む（1行目はヘッダー、student_id 列は必須）
+    任意の列: password / language / is_admin
+    戻り値: (行のリスト, エラーのリスト)
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    fields = [(name or "").strip().lower() for name in (reader.fieldnames or [])]
+    if "student_id" not in fields:
+        raise HTTPException(status_code=400, detail="CSVの1行目に student_id の列が必要です")
+    reader.fieldnames = fields
+
+    rows, errors, seen = [], [], set()
+    for line, record in enumerate(reader, start=2):
+        student_id = (record.get("student_id") or "").strip()
+        if not student_id:
+            if any((value or "").strip() for value in record.values() if isinstance(value, str)):
+                errors.append({"line": line, "error": "student_id が空です"})
+            continue
+        if student_id in seen:
+            errors.append({"line": line, "student_id": student_id, "error": "同じIDがCSV内で重複しています"})
+            continue
+        language = (record.get("language") or "").strip().lower() or None
+        if language and language not in ALLOWED_LANGUAGES:
+            errors.append({"line": line, "student_id": student_id, "error": f"対応していない言語です: {language}"})
+            continue
+        is_admin = (record.get("is_admin") or "").strip().lower()
+        seen.add(student_id)
+        rows.append({
+            "student_id": student_id,
+            "password": record.get("password") or "",
+            "language": language,
+            "is_admin": (is_admin in TRUE_VALUES) if is_admin else None,
+        })
+    return rows, errors
+
+async def hash_roster_passwords(rows: list) -> list:
+    """名簿のパスワードをまとめてハッシュ化（時間がかかるので、分けて複数のプロセスで同時に計算する）"""
+    passwords = [row["password"] for row in rows]
+    chunk_size = max(1, -(-len(passwords) // max(1, PASSWORD_HASH_CONCURRENCY)))
+
+    async def hash_chunk(chunk: list) -> list:
+        async with password_hash_semaphore:
+            return await run_cpu_task(hash_passwords, chunk, PASSWORD_HASH_ROUNDS)
+
+    chunks = await asyncio.gather(*(
+        hash_chunk(passwords[start:start + chunk_size]) for start in range(0, len(passwords), chunk_size)
+    ))
+    return [password_hash for chunk in chunks for password_hash in chunk]
+
+@app.post("/api/admin/users/import")
+async def import_users(
+    file: UploadFile = File(...),
+    overwrite: bool = Form(False),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    名簿CSVからユーザーをまとめて登録（管理者のみ）
+    既にいるユーザーは overwrite=true の時だけCSVにある項目を上書き、それ以外はスキップ
+    保存は変更があったユーザーだけをまとめて1回（大人数ならチャンクに分けて）書き込む
+    """
+    contents = await file.read()
+    try:
+        text = contents.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = contents.decode("cp932", errors="replace")  # Excelで保存したShift_JISのCSV
+    rows, errors = parse_roster_csv(text)
+    if len(rows) > ROSTER_IMPORT_MAX:
+        raise HTTPException(status_code=400, detail=f"一度に登録できるのは{ROSTER_IMPORT_MAX}人までです")
+    print(f"📋 名簿CSVの取り込み開始: Admin={admin_user}, {len(rows)}人", flush=True)
+
+    existing = {user["student_id"]: user for user in await users_repo.aget_many([row["student_id"] for row in rows])}
+    skipped = []
+    targets = []
+    for row in rows:
+        if row["student_id"] in existing and not overwrite:
+            skipped.append(row["student_id"])
+        elif row["student_id"] == admin_user and row["is_admin"] is False:
+            errors.append({"student_id": row["student_id"], "error": "自分自身の管理者権限を削除することはできません"})
+        else:
+            targets.append(row)
+
+    password_hashes = await hash_roster_passwords(targets)
+
+    now = datetime.utcnow().isoformat()
+    users = []
+    for row, password_hash in zip(targets, password_hashes):
+        user = dict(existing.get(row["student_id"]) or {
+            "student_id": row["student_id"],
+            "password_hash": "",
+            "is_admin": False,
+            "language": "chinese",
+            "created_at": now,
+            "webauthn_credentials": []
+        })
+        # CSVに書いてある項目だけ反映（既存ユーザーの空欄は今の値のまま）
+        if password_hash or row["student_id"] not in existing:
+            user["password_hash"] = password_hash
+        if row["language"]:
+            user["language"] = row["language"]
+        if row["is_admin"] is not None:
+            user["is_admin"] = row["is_admin"]
+        users.append(user)
+
+    result = {"created": 0, "updated": 0, "unchanged": 0}
+    if users:
+        try:
+            result = await users_repo.asave_changed(users)
+        except Exception as e:
+            print(f"⚠️ 名簿の保存エラー: {e}", flush=True)
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail="ユーザーの保存に失敗したわ...")
+    print(f"✅ 名簿CSVの取り込み完了: {result}, スキップ{len(skipped)}人, エラー{len(errors)}件", flush=True)
+    return {**result, "skipped": skipped, "errors": errors}
+
 # Gemini API設定
+# モデル一覧（list_models）は import 時には取りに行かない。GEMINI_MODEL か前回のキャッシュで
+# すぐ起動して、一覧の取り直しは起動後にバックグラウンドで行う（gemini_models.ModelCatalog）
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+model = None
+vision_model = None
+
+
+def list_gemini_models() -> list:
+    """generateContent が使えるモデル名の一覧（ネットワーク越し・遅い）"""
+    return [
+        m.name.replace("models/", "")
+        for m in genai.list_models()
+        if 'generateContent' in m.supported_generation_methods
+    ]
+
+
+gemini_model_instances = {}  # モデル名 -> GenerativeModel
+
+
+def gemini_model(model_name: str):
+    """モデル名から GenerativeModel を作る（1回作ったら使い回す。作成自体は通信しない）"""
+    instance = gemini_model_instances.get(model_name)
+    if instance is None:
+        instance = gemini_model_instances[model_name] = genai.GenerativeModel(model_name)
+    return instance
+
+
+def use_gemini_model(model_name: str):
+    """既定のモデル（model / vision_model）を切り替える。タスクごとの振り分けは model_router"""
+    global model, vision_model
+    if getattr(model, "model_name", "").replace("models/", "") == model_name:
+        return
+    try:
+        model = vision_model = gemini_model(model_name)
+        print(f"✅ Geminiモデル: {model_name}", flush=True)
+    except Exception as e:
+        print(f"⚠️ {model_name} でエラー: {str(e)[:100]}", flush=True)
+
+
+model_catalog = ModelCatalog(list_gemini_models)
+# タスクの種類 -> ティア（fast / quality）-> モデル。ティアのモデルを指定しなければ一覧から名前で選ぶ
+model_router = ModelRouter(
+    model_catalog.names,
+    parse_task_tiers(GEMINI_TASK_TIERS),
+    {"fast": split_names(GEMINI_FAST_MODELS), "quality": split_names(GEMINI_QUALITY_MODELS)},
+)
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
-    
-    # 利用可能なモデルをリストアップ
-    print("🔍 利用可能なGeminiモデルを確認中...")
-    available_model_names = []
+    use_gemini_model(model_catalog.names()[0])
+    if model_catalog.needs_refresh():
+        print(f"🔍 モデル一覧は起動後に確認します（それまでは {model_catalog.names()[0]}）", flush=True)
+else:
+    print("⚠️ 警告: GEMINI_API_KEY が読み込めてへんで！ .envを確認してな！")
+
+
+# ==================== Gemini呼び出し用ワーカープール ====================
+# generate_content は同期APIなので、イベントループを止めないよう専用スレッドプールで実行する
+GEMINI_MAX_WORKERS = int(os.getenv("GEMINI_MAX_WORKERS", "8"))  # 同時にGeminiへ投げる最大数
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "64"))  # 実行中+待機中の上限（超えたら503）
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))  # 1回の処理のタイムアウト（秒。別モデルでの取り直しも含めて）
+
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_WORKERS, thread_name_prefix="gemini")
+gemini_inflight = 0  # 予約済み + 実行中のGemini呼び出し数
+writing_queued = 0  # まとめ採点を待っている + 採点中の作文の数（1バッチで1枠しか使わないので別に数える）
+gemini_inflight_lock = threading.Lock()
+gemini_stats = {"submitted": 0, "rejected": 0, "timeouts": 0}
+
+# create_task したタスクがGCで消えへんように参照を持っとく
+background_tasks = set()
+
+
+def spawn_background(coro):
+    """Fire-and-Forgetのタスクを起動（参照を保持してGCを防ぐ）"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def reject_gemini_overload():
+    """キューが満杯の時の503（呼び出し側で gemini_inflight_lock を持っていること）"""
+    gemini_stats["rejected"] += 1
+    print(f"🚦 Geminiキューが満杯: {gemini_inflight}+作文{writing_queued}/{GEMINI_MAX_QUEUE}", flush=True)
+    raise HTTPException(
+        status_code=503,
+        detail="採点サーバーが混み合ってるで！ちょっと待ってからもう一回送ってな",
+        headers={"Retry-After": "5"},
+    )
+
+
+def acquire_gemini_slot(count_queued: bool = True):
+    """
+    Geminiキューに1枠予約する。満杯なら503を返す
+    count_queued=True なら、まとめ採点待ちの作文も混み具合に数える（受付の時）
+    call_gemini の中では False（受付済みの作文のバッチが自分の予約で弾かれないように）
+    """
+    global gemini_inflight
+    with gemini_inflight_lock:
+        if gemini_inflight + (writing_queued if count_queued else 0) >= GEMINI_MAX_QUEUE:
+            reject_gemini_overload()
+        gemini_inflight += 1
+
+
+def reserve_writing_slots(count: int):
+    """Geminiに回す作文 count 件分の枠をまとめて予約する。入りきらなければ1件も受け付けずに503"""
+    global writing_queued
+    if count <= 0:
+        return
+    with gemini_inflight_lock:
+        if gemini_inflight + writing_queued + count > GEMINI_MAX_QUEUE:
+            reject_gemini_overload()
+        writing_queued += count
+
+
+def release_writing_slot():
+    global writing_queued
+    with gemini_inflight_lock:
+        writing_queued = max(0, writing_queued - 1)
+
+
+def release_gemini_slot(*_):
+    """予約した枠を返却（スレッドの完了コールバックからも呼ばれる）"""
+    global gemini_inflight
+    with gemini_inflight_lock:
+        gemini_inflight = max(0, gemini_inflight - 1)
+
+
+async def call_gemini(target_model, contents, timeout: Optional[float] = None, slot_reserved: bool = False):
+    """
+    Geminiの generate_content を専用スレッドプールで実行する
+    slot_reserved=True の場合は acquire_gemini_slot() で予約済みの枠を使う
+    枠はタイムアウト後もスレッドが実際に終わるまで返却しない（過負荷の実数を数えるため）
+    """
+    if target_model is None:
+        if slot_reserved:
+            release_gemini_slot()
+        raise Exception("Geminiモデルが初期化されてへん！APIキーを確認してくれ！")
+    if not slot_reserved:
+        acquire_gemini_slot(count_queued=False)
+
     try:
-        available_models = genai.list_models()
-        print("📋 利用可能なモデル一覧:")
-        for m in available_models:
-            if 'generateContent' in m.supported_generation_methods:
-                model_name = m.name.replace("models/", "")
-                print(f"  - {model_name}")
-                available_model_names.append(model_name)
-    except Exception as e:
-        print(f"⚠️ モデル一覧の取得に失敗: {e}")
-    
-    # モデル名を修正: v1beta APIで使えるモデルを試す
-    model = None
-    vision_model = None
-    # まずリストアップしたモデルを試し、その後フォールバック
-    model_names = available_model_names if available_model_names else ["gemini-pro"]
-    
-    print(f"🧪 試行するモデル名: {model_names[:5]}...")  # 最初の5つだけ表示
-    
-    for model_name in model_names:
+        future = gemini_executor.submit(target_model.generate_content, contents)
+    except Exception:
+        release_gemini_slot()
+        raise
+    future.add_done_callback(release_gemini_slot)
+    gemini_stats["submitted"] += 1
+
+    timeout = timeout or GEMINI_TIMEOUT
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+    except asyncio.TimeoutError:
+        gemini_stats["timeouts"] += 1
+        raise Exception(f"Gemini APIの呼び出しがタイムアウトしました（{timeout:.0f}秒）")
+
+
+async def call_gemini_for(task: str, contents, timeout: Optional[float] = None, slot_reserved: bool = False):
+    """
+    タスクの種類（handwriting / writing / textbook-word / textbook-grammar）に合ったモデルで call_gemini する
+    エラーやタイムアウトなら次の候補のモデルで取り直す（最大 GEMINI_FAILOVER_ATTEMPTS 個）
+    timeout は取り直しも含めた全体の時間（フロントの待ち時間を超えて粘らない）
+    """
+    if model is None:
+        return await call_gemini(None, contents, timeout, slot_reserved)
+    names = model_router.candidates(task)[:max(1, GEMINI_FAILOVER_ATTEMPTS)]
+    deadline = time.monotonic() + (timeout or GEMINI_TIMEOUT)
+    last_error = None
+    for attempt, name in enumerate(names):
+        remaining = deadline - time.monotonic()
+        if attempt and remaining < 1.0:
+            break  # 取り直す時間が残ってへん（最後のエラーを返す）
+        start = time.perf_counter()
         try:
-            print(f"🔄 {model_name} を試行中...")
-            test_model = genai.GenerativeModel(model_name)
-            model = test_model
-            vision_model = test_model
-            print(f"✅ Geminiモデル初期化成功: {model_name}")
-            break
+            response = await call_gemini(gemini_model(name), contents, remaining, slot_reserved and attempt == 0)
+        except HTTPException:
+            raise  # 混雑の503はどのモデルでも同じなので取り直さない
         except Exception as e:
-            error_msg = str(e)
-            if "404" not in error_msg and "not found" not in error_msg.lower():
-                # 404以外のエラーは無視（モデルは存在するが他の問題）
-                print(f"⚠️ {model_name} でエラー: {error_msg[:100]}")
+            model_router.record_failure(name)
+            last_error = e
+            print(f"⚠️ {name} で失敗（{task}）: {str(e)[:100]}", flush=True)
             continue
-    
-    if model is None:
-        print("❌ エラー: 利用可能なGeminiモデルが見つかりませんでした")
-        print("💡 ヒント: APIキーが正しいか、google-generativeaiライブラリを最新版に更新してください")
-else:
-    print("⚠️ 警告: GEMINI_API_KEY が読み込めてへんで！ .envを確認してな！")
-    model = None
-    vision_model = None
+        model_router.record_success(name, time.perf_counter() - start)
+        return response
+    if last_error is None:
+        if slot_reserved:
+            release_gemini_slot()
+        raise Exception(f"{task} に使えるGeminiモデルがありません")
+    raise last_error
+
+
+# ==================== Geminiモデル一覧の更新 ====================
+model_refresh_task: Optional[asyncio.Task] = None
+
+
+async def refresh_gemini_models():
+    """モデル一覧を取り直して、一番目のモデルに切り替える（list_models は同期なのでスレッドで）"""
+    loop = asyncio.get_running_loop()
+    names = await loop.run_in_executor(None, model_catalog.refresh)
+    use_gemini_model(names[0])
+
+
+async def model_refresh_loop():
+    """起動直後（一覧が古い・無い時）と、その後は GEMINI_MODELS_TTL ごとに一覧を取り直す"""
+    while True:
+        if model_catalog.needs_refresh():
+            try:
+                await refresh_gemini_models()
+            except Exception as e:
+                print(f"⚠️ モデル一覧の更新エラー: {e}", flush=True)
+        # 失敗した時も1分は空ける
+        await asyncio.sleep(max(60.0, model_catalog.seconds_until_stale()))
+
+
+@app.on_event("startup")
+async def start_model_refresh():
+    global model_refresh_task
+    if GEMINI_API_KEY and not model_catalog.override:
+        model_refresh_task = asyncio.create_task(model_refresh_loop())
+
+
+@app.on_event("shutdown")
+def stop_model_refresh():
+    if model_refresh_task is not None:
+        model_refresh_task.cancel()
+
+
+# ==================== CPU処理用プロセスプール ====================
+# 画像のデコードや縮小はGILを握るので、別プロセスで並列に実行する
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0ならスレッドで実行
+HANDWRITING_MAX_SIDE = int(os.getenv("HANDWRITING_MAX_SIDE", "512"))  # Geminiに送る手書き画像の最大辺（px）
+HANDWRITING_BINARIZE = os.getenv("HANDWRITING_BINARIZE", "1") != "0"  # 白黒2値にして送る
+
+cpu_process_pool: Optional[ProcessPoolExecutor] = None
+image_pipeline_stats = {"count": 0, "bytes_in": 0, "bytes_out": 0, "total_ms": {}}
+
+
+def get_cpu_process_pool() -> Optional[ProcessPoolExecutor]:
+    """プロセスプールを必要になった時に作る（起動を遅くしないため）"""
+    global cpu_process_pool
+    if CPU_WORKERS <= 0:
+        return None
+    if cpu_process_pool is None:
+        # forkだとGemini用スレッドなどを抱えたまま複製されるので spawn で作る
+        cpu_process_pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        print(f"⚙️ CPUプロセスプール起動: {CPU_WORKERS}プロセス", flush=True)
+    return cpu_process_pool
+
+
+async def run_cpu_task(fn, *args):
+    """CPU負荷の高い処理をプロセスプールで実行（使えない時はスレッドで実行）"""
+    global cpu_process_pool
+    loop = asyncio.get_running_loop()
+    pool = get_cpu_process_pool()
+    if pool is not None:
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            print("⚠️ CPUプロセスプールが壊れたので作り直します", flush=True)
+            cpu_process_pool = None
+    return await loop.run_in_executor(None, fn, *args)
+
+
+def record_image_timings(prepared: dict):
+    """画像前処理のステップ別時間を集計"""
+    image_pipeline_stats["count"] += 1
+    image_pipeline_stats["bytes_in"] += prepared["bytes_in"]
+    image_pipeline_stats["bytes_out"] += prepared["bytes_out"]
+    for step, ms in prepared["timings"].items():
+        image_pipeline_stats["total_ms"][step] = image_pipeline_stats["total_ms"].get(step, 0) + ms
+
+
+@app.on_event("shutdown")
+def shutdown_pools():
+    """終了時にワーカーを片付ける"""
+    gemini_executor.shutdown(wait=False, cancel_futures=True)
+    db_executor.shutdown(wait=False)
+    if cpu_process_pool is not None:
+        cpu_process_pool.shutdown(wait=False, cancel_futures=True)
 
 
 # データモデル
@@ -505,18 +848,21 @@ class HandwritingSubmission(BaseModel):
     image_data: str  # base64エンコードされた画像
     question_id: str
     expected_answer: str
+    skip_cache: bool = False  # Trueなら似た画像のキャッシュを使わず必ずGeminiで採点
 
 
 class SortingSubmission(BaseModel):
     words: list[str]
     question_id: str
     expected_order: list[str]
+    language: Optional[str] = None  # 学習中の言語（表記ゆれの吸収の仕方が変わる）。無ければ中国語
 
 
 class WritingSubmission(BaseModel):
     text: str
     question_id: str
     expected_answer: Optional[str] = None
+    language: Optional[str] = None  # 学習中の言語。無ければユーザーの登録言語
 
 
 class TextbookImage(BaseModel):
@@ -524,8 +870,154 @@ class TextbookImage(BaseModel):
     page_number: Optional[int] = None
 
 
-# 非同期採点結果を保存する簡易ストレージ（本番ではDBを使用）
-scoring_results = {}
+# ==================== 採点結果ストア ====================
+# 非同期採点結果の保存先（実装は result_store.py、SCORING_RESULT_BACKEND で memory / sqlite を選ぶ）
+scoring_results = create_result_store()
+
+
+def new_task_id(kind: str, question_id: str) -> str:
+    """全ワーカーで一意なタスクIDを発行"""
+    return f"{kind}_{question_id}_{uuid.uuid4().hex}"
+
+
+# ==================== 採点結果のプッシュ配信 ====================
+# 1秒ごとのポーリングをやめて、採点が終わった瞬間にSSEで送る
+SCORE_STREAM_HEARTBEAT = 15  # SSEの生存確認を送る間隔（秒）
+SCORE_LONGPOLL_MAX_WAIT = 30  # ロングポーリングの最大待ち時間（秒）
+SHARED_STORE_POLL_INTERVAL = 1.0  # 共有ストア使用時に他ワーカーの結果を確認する間隔（秒）
+TERMINAL_STATUSES = ("completed", "error")
+
+
+class ScoreEventHub:
+    """ユーザーごとのSSE購読者と、タスクごとのロングポーリング待ちを管理"""
+
+    def __init__(self):
+        self._subscribers = {}  # user_id -> set(asyncio.Queue)
+        self._waiters = {}  # task_id -> set(asyncio.Future)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=256)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: Optional[str], result: dict):
+        if user_id:
+            for queue in list(self._subscribers.get(user_id, ())):
+                try:
+                    queue.put_nowait(result)
+                except asyncio.QueueFull:
+                    # 読まれてへん接続は諦める（クライアントはロングポーリングで拾う）
+                    pass
+        for waiter in self._waiters.pop(result.get("task_id"), ()):
+            if not waiter.done():
+                waiter.set_result(result)
+
+    async def wait_for(self, task_id: str, timeout: float) -> Optional[dict]:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(task_id, set()).add(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[task_id]
+
+
+score_events = ScoreEventHub()
+
+
+# SQLiteの結果ストアは書き込みのたびにcommitするので、読み書きは全部 run_db でDB用スレッドに回す
+async def start_task(task_id: str, question_id: str, user_id: str):
+    """処理中のタスクを登録（他のワーカーからも存在がわかるように）"""
+    await run_db(scoring_results.put, task_id, {
+        "task_id": task_id,
+        "question_id": question_id,
+        "user_id": user_id,
+        "status": "processing"
+    })
+
+
+async def finish_task(task_id: str, user_id: str, result: dict):
+    """採点結果を保存して、待っているクライアントにプッシュ"""
+    result["user_id"] = user_id
+    await run_db(scoring_results.put, task_id, result)
+    score_events.publish(user_id, result)
+
+
+# ==================== 作文採点キャッシュ ====================
+# クラス全員が同じ問題に同じ答えを書くことが多いので、同じ内容ならGeminiを呼ばずに返す（本体は score_cache.py）
+WRITING_PROMPT_VERSION = "v1"  # プロンプトを変えたらここを上げる（古いキャッシュを無効化）
+
+
+try:
+    writing_cache = ScoreCache(SCORE_CACHE_DB, "writing_cache", WRITING_CACHE_MAX, WRITING_CACHE_TTL)
+except Exception as e:
+    print(f"⚠️ 作文キャッシュの初期化に失敗（キャッシュなしで動作）: {e}")
+    writing_cache = None
+
+
+def normalize_for_cache(text: Optional[str]) -> str:
+    """全角半角・空白の違いでキャッシュを外さないように正規化"""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def writing_cache_key(text: str, expected_answer: Optional[str], model_name: str) -> str:
+    """(プロンプト版, 正規化した回答, 期待回答, モデル名) のハッシュ"""
+    raw = "\x1f".join([
+        WRITING_PROMPT_VERSION,
+        normalize_for_cache(text),
+        normalize_for_cache(expected_answer),
+        model_name,
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==================== 手書き画像の知覚ハッシュキャッシュ ====================
+# 見た目がほぼ同じ手書き画像（同じ正解に対して）は、前回の採点結果を使い回す
+handwriting_hash_index = PerceptualHashIndex(
+    HANDWRITING_HASH_MAX_ANSWERS, HANDWRITING_HASH_PER_ANSWER, HANDWRITING_HASH_DISTANCE
+) if HANDWRITING_HASH_CACHE else None
+
+
+@app.get("/api/admin/stats")
+async def get_performance_stats(admin_user: str = Depends(get_current_admin)):
+    """採点まわりとデータアクセスの統計（キャッシュのヒット率やGeminiキュー、DB呼び出しの所要時間、管理者のみ）"""
+    return {
+        "gemini": {**gemini_stats, "inflight": gemini_inflight, "writing_queued": writing_queued, "max_queue": GEMINI_MAX_QUEUE},
+        "scoring_results": await run_db(len, scoring_results),
+        "writing_cache": await run_db(writing_cache.snapshot) if writing_cache else None,
+        "writing_batches": writing_batcher.snapshot(),
+        "handwriting_hash_cache": handwriting_hash_index.snapshot() if handwriting_hash_index else None,
+        "local_prescore": local_prescore_stats,
+        "storage": {"backend": words_repo.backend, "calls": repo_stats_snapshot()},
+        "user_cache": users_repo.snapshot() if isinstance(users_repo, CachedUserRepo) else None,
+        "token_cache": token_cache.snapshot(),
+        "gemini_models": {**model_catalog.snapshot(), "current": getattr(model, "model_name", None)},
+        "model_routing": model_router.snapshot(),
+        "review_buffer": review_buffer.snapshot() if review_buffer is not None else None,
+        "question_cache": question_cache.snapshot(),
+        "segmenter": segmenter.snapshot(),
+        "image_pipeline": {
+            **image_pipeline_stats,
+            "avg_ms": {
+                step: round(total / image_pipeline_stats["count"], 2)
+                for step, total in image_pipeline_stats["total_ms"].items()
+            },
+        },
+    }
 
 
 @app.get("/")
@@ -533,41 +1025,45 @@ async def root():
     return {"message": "AI Language Tutor API", "status": "running"}
 
 
+HANDWRITING_VERDICT = re.compile(r"正誤判定[^\n]*?(不正解|正解)")  # 「正誤判定: 正解」「**正誤判定**: [不正解]」など
+
+
+def parse_handwriting_verdict(recognized_text: Optional[str]) -> Optional[bool]:
+    """Geminiの「正誤判定: 正解/不正解」を is_correct にする。読み取れなければ None（復習には数えない）"""
+    match = HANDWRITING_VERDICT.search(recognized_text or "")
+    if match is None:
+        return None
+    return match.group(1) == "正解"
+
+
+def handwriting_result(recognized_text: str) -> dict:
+    """Geminiの応答から結果を作る（判定が読み取れた時だけ is_correct を付ける）"""
+    result = {"recognized_text": recognized_text}
+    is_correct = parse_handwriting_verdict(recognized_text)
+    if is_correct is not None:
+        result["is_correct"] = is_correct
+    return result
+
+
 @app.post("/api/score/handwriting")
-async def score_handwriting(submission: HandwritingSubmission):
+async def score_handwriting(
+    submission: HandwritingSubmission,
+    current_user: str = Depends(get_current_user)  # 認証必須（結果の配信先を決めるため）
+):
     """
     手書き回答を採点（非同期処理）
     """
     try:
-        import base64
-        from io import BytesIO
-        from PIL import Image
-        
-        # base64デコード
-        image_bytes = base64.b64decode(submission.image_data.split(",")[-1])
-        image = Image.open(BytesIO(image_bytes))
-        
-        # ★★★ 透明部分を白にする魔法のコード ★★★
-        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
-            # 白いキャンバスを作る
-            background = Image.new("RGB", image.size, (255, 255, 255))
-            # 元の画像（文字）を上に乗せる（透明部分は背景の白が出る）
-            if image.mode != 'RGBA':
-                image = image.convert('RGBA')
-            
-            # アルファチャンネルをマスクに使って合成
-            if image.mode == 'RGBA':
-                background.paste(image, mask=image.split()[3])  # アルファチャンネルをマスクに使う
-            else:
-                background.paste(image)
-            image = background  # これで「白背景に黒文字」の画像になった！
-        
-        # モードがRGBAやLAのままの場合はRGBに変換
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        print(f"✅ 画像処理完了: {image.mode} モード、サイズ: {image.size}", flush=True)
-        # ★★★ 追加ここまで ★★★
+        # デコード・白背景合成・縮小・2値化はプロセスプールで（イベントループを止めない）
+        prepared = await run_cpu_task(
+            preprocess_handwriting, submission.image_data, HANDWRITING_MAX_SIDE, HANDWRITING_BINARIZE
+        )
+        record_image_timings(prepared)
+        print(
+            f"✅ 画像処理完了: {prepared['original_size']} -> {prepared['size']}, "
+            f"{prepared['bytes_in']}B -> {prepared['bytes_out']}B, {prepared['timings']}ms",
+            flush=True,
+        )
         
         # Gemini Visionで採点
         prompt = f"""
@@ -580,83 +1076,162 @@ async def score_handwriting(submission: HandwritingSubmission):
         """
         
         # 非同期で実行（Fire-and-Forget）
-        task_id = f"handwriting_{submission.question_id}_{len(scoring_results)}"
+        task_id = new_task_id("handwriting", submission.question_id)
+        
+        # 白紙などローカルで判定できるものはその場で返す
+        local_result = prescore_handwriting(prepared, submission.expected_answer)
+        if local_result is not None:
+            result = {
+                "task_id": task_id,
+                "question_id": submission.question_id,
+                **local_result,
+                "status": "completed"
+            }
+            await finish_task(task_id, current_user, result)
+            return result
+        
+        # 見た目がほぼ同じ画像を同じ正解で採点済みなら、その結果を使い回す
+        answer_key = f"{model_router.cache_name('handwriting')}\x1f{submission.expected_answer}"
+        image_hash = prepared["dhash"]
+        if handwriting_hash_index and not submission.skip_cache:
+            cached = handwriting_hash_index.lookup(answer_key, image_hash) if image_hash is not None else None
+            if cached is not None:
+                result = {
+                    "task_id": task_id,
+                    "question_id": submission.question_id,
+                    **cached,
+                    "status": "completed",
+                    "cached": True
+                }
+                await finish_task(task_id, current_user, result)
+                return result
+        
+        acquire_gemini_slot()  # 混雑時はここで503
+        try:
+            await start_task(task_id, submission.question_id, current_user)
+        except Exception:
+            release_gemini_slot()
+            raise
         
         async def async_score():
             try:
-                response = vision_model.generate_content([prompt, image])
+                image_part = {"mime_type": "image/png", "data": prepared["png"]}
+                response = await call_gemini_for("handwriting", [prompt, image_part], slot_reserved=True)
+                graded = handwriting_result(response.text)
                 result = {
                     "task_id": task_id,
                     "question_id": submission.question_id,
-                    "recognized_text": response.text,
+                    **graded,
                     "status": "completed"
                 }
-                scoring_results[task_id] = result
+                if handwriting_hash_index and image_hash is not None:
+                    handwriting_hash_index.store(answer_key, image_hash, graded)
+                await finish_task(task_id, current_user, result)
             except Exception as e:
-                scoring_results[task_id] = {
+                await finish_task(task_id, current_user, {
                     "task_id": task_id,
                     "question_id": submission.question_id,
                     "error": str(e),
                     "status": "error"
-                }
+                })
         
-        asyncio.create_task(async_score())
+        spawn_background(async_score())
         
         return {"task_id": task_id, "status": "processing"}
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"🔥 手書き採点エラー: {str(e)}", flush=True)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+SORTING_MAX_BATCH = int(os.getenv("SORTING_MAX_BATCH", "500"))  # /api/score/sorting/batch に1回で送れる回答の数
+
+class SortingBatchSubmission(BaseModel):
+    answers: list[SortingSubmission]
+
+
+def grade_sorting(submission: SortingSubmission) -> dict:
+    """並べ替えを部分点付きで採点（LLMなし）。句読点・全角半角（中国語なら繁体字も）の違いは同じ単語として扱う"""
+    language = submission.language or DEFAULT_LANGUAGE
+    result = score_sorting_answer(
+        submission.words, submission.expected_order, lambda token: normalize_answer(token, language)
+    )
+    feedback = ""
+    if not result["is_correct"]:
+        feedback = f"正しい順序: {' → '.join(submission.expected_order)}"
+        if result["score"] > 0:
+            feedback += f"（{result['lis_length']}/{len(submission.expected_order)}語は正しい順番やで）"
+    return {
+        "question_id": submission.question_id,
+        "user_order": submission.words,
+        "expected_order": submission.expected_order,
+        "feedback": feedback,
+        **result,
+    }
+
+
 @app.post("/api/score/sorting")
 async def score_sorting(submission: SortingSubmission):
     """
-    並べ替え問題を採点
+    並べ替え問題を採点（部分点と1語ずつの判定付き）
     """
     try:
-        user_order = submission.words
-        expected_order = submission.expected_order
-        
-        is_correct = user_order == expected_order
-        
-        feedback = ""
-        if not is_correct:
-            feedback = f"正しい順序: {' → '.join(expected_order)}"
-        
-        return {
-            "question_id": submission.question_id,
-            "is_correct": is_correct,
-            "user_order": user_order,
-            "expected_order": expected_order,
-            "feedback": feedback
-        }
-    
+        return grade_sorting(submission)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/score/writing")
-async def score_writing(submission: WritingSubmission):
+@app.post("/api/score/sorting/batch")
+async def score_sorting_batch(batch: SortingBatchSubmission):
     """
-    作文をGeminiで添削（非同期処理）
+    1セッション分の並べ替え回答をまとめて採点（電波が悪くても1往復で済むように）
     """
+    if len(batch.answers) > SORTING_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"一度に送れる回答は{SORTING_MAX_BATCH}件までです")
     try:
-        prompt = f"""
-        以下の中国語の作文を添削してください。
-        
-        学生の回答:
-        {submission.text}
-        
-        {f"期待される回答の参考: {submission.expected_answer}" if submission.expected_answer else ""}
-        
+        results = [grade_sorting(submission) for submission in batch.answers]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": results,
+        "correct": sum(1 for result in results if result["is_correct"]),
+        "total": len(results),
+        "average_score": round(sum(result["score"] for result in results) / len(results), 1) if results else 0,
+    }
+
+
+# ==================== 作文採点（まとめてGeminiへ） ====================
+# 授業中は同じタイミングで作文がたくさん届くので、短い時間に届いた分を1つのプロンプトにまとめる
+WRITING_BATCH_SIZE = int(os.getenv("WRITING_BATCH_SIZE", "10"))  # 1回のGemini呼び出しに入れる作文の数（1ならまとめない）
+WRITING_BATCH_WINDOW = float(os.getenv("WRITING_BATCH_WINDOW", "0.3"))  # まとめるために待つ秒数
+WRITING_BATCH_MAX = int(os.getenv("WRITING_BATCH_MAX", "100"))  # /api/score/writing/batch に1回で送れる作文の数
+
+WRITING_CRITERIA = """
         以下の観点で評価してください:
         1. 文法の正確性
         2. 語彙の適切性
         3. より自然な表現の提案
         4. 総合的なフィードバック
+"""
+
+
+class WritingBatchSubmission(BaseModel):
+    answers: list[WritingSubmission]
+
+
+def writing_prompt(text: str, expected_answer: Optional[str]) -> str:
+    """作文1件分のプロンプト"""
+    return f"""
+        以下の中国語の作文を添削してください。
+        
+        学生の回答:
+        {text}
         
+        {f"期待される回答の参考: {expected_answer}" if expected_answer else ""}
+        {WRITING_CRITERIA}
         JSON形式で返答してください:
         {{
             "grammar_score": 0-100,
@@ -665,184 +1240,421 @@ async def score_writing(submission: WritingSubmission):
             "feedback": "総合的なコメント"
         }}
         """
-        
-        task_id = f"writing_{submission.question_id}_{len(scoring_results)}"
-        
-        async def async_score():
-            try:
-                response = model.generate_content(prompt)
-                result_text = response.text
-                
-                # JSON抽出を試行
-                try:
-                    import re
-                    json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-                    if json_match:
-                        result_json = json.loads(json_match.group())
-                    else:
-                        result_json = {"raw_feedback": result_text}
-                except:
-                    result_json = {"raw_feedback": result_text}
-                
-                scoring_results[task_id] = {
-                    "task_id": task_id,
-                    "question_id": submission.question_id,
-                    "result": result_json,
-                    "status": "completed"
-                }
-            except Exception as e:
-                scoring_results[task_id] = {
-                    "task_id": task_id,
-                    "question_id": submission.question_id,
-                    "error": str(e),
-                    "status": "error"
-                }
-        
-        asyncio.create_task(async_score())
-        
-        return {"task_id": task_id, "status": "processing"}
-    
+
+
+def writing_batch_prompt(answers: list) -> str:
+    """作文複数件を1つにまとめたプロンプト（指示文は1回だけ）"""
+    listing = "\n".join(
+        f"[{number}] 学生の回答: {text}" + (f"\n    期待される回答の参考: {expected}" if expected else "")
+        for number, (text, expected) in enumerate(answers, start=1)
+    )
+    return f"""
+        以下の中国語の作文 {len(answers)}件 を1件ずつ添削してください。
+        {WRITING_CRITERIA}
+        JSON配列だけで返答してください（1件につき1要素、index は回答の番号）:
+        [
+            {{
+                "index": 1,
+                "grammar_score": 0-100,
+                "vocabulary_score": 0-100,
+                "suggestions": ["提案1", "提案2"],
+                "feedback": "総合的なコメント"
+            }}
+        ]
+
+        回答一覧:
+{listing}
+        """
+
+
+def parse_writing_result(result_text: str) -> dict:
+    """1件分の応答からJSONを取り出す（取れなければ生のテキストを返す）"""
+    try:
+        json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+    except Exception:
+        pass
+    return {"raw_feedback": result_text}
+
+
+def parse_writing_batch(result_text: str, count: int) -> list:
+    """まとめた応答（JSON配列）を回答の順番に並べ直す。欠けた分は None"""
+    results = [None] * count
+    json_match = re.search(r'\[.*\]', result_text or "", re.DOTALL)
+    if not json_match:
+        return results
+    try:
+        items = json.loads(json_match.group())
+    except json.JSONDecodeError:
+        return results
+    if not isinstance(items, list):
+        return results
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.pop("index", None)
+        slot = index - 1 if isinstance(index, int) and 1 <= index <= count else position
+        if slot < count and results[slot] is None:
+            results[slot] = item
+    return results
+
+
+async def score_writing_with_gemini(text: str, expected_answer: Optional[str]) -> dict:
+    response = await call_gemini_for("writing", writing_prompt(text, expected_answer))
+    return parse_writing_result(response.text)
+
+
+async def grade_writing_batch(jobs: list) -> list:
+    """
+    MicroBatcher から呼ばれる。jobs: [(text, expected_answer, cache_key), ...]
+    同じ回答は1つにまとめ、1回のGemini呼び出しで採点してから元の順番に配り直す
+    配列から欠けた分だけ1件ずつ採点し直す
+    """
+    unique = {}
+    for text, expected_answer, cache_key in jobs:
+        unique.setdefault(cache_key, (text, expected_answer))
+    keys = list(unique)
+
+    if len(keys) == 1:
+        graded = [await score_writing_with_gemini(*unique[keys[0]])]
+    else:
+        response = await call_gemini_for("writing", writing_batch_prompt([unique[key] for key in keys]))
+        graded = parse_writing_batch(response.text, len(keys))
+        missing = [i for i, result in enumerate(graded) if result is None]
+        if missing:
+            print(f"⚠️ まとめ採点の結果が{len(missing)}件欠けてたので1件ずつ採点し直します", flush=True)
+            retried = await asyncio.gather(
+                *(score_writing_with_gemini(*unique[keys[i]]) for i in missing), return_exceptions=True
+            )
+            for i, result in zip(missing, retried):
+                graded[i] = result
+    print(f"✍️ 作文をまとめて採点: {len(jobs)}件（Gemini向け {len(keys)}件）", flush=True)
+
+    by_key = dict(zip(keys, graded))
+    if writing_cache:
+        for key, result in by_key.items():
+            if not isinstance(result, Exception):
+                await run_db(writing_cache.put, key, result)
+    return [by_key[cache_key] for _, _, cache_key in jobs]
+
+
+writing_batcher = MicroBatcher(grade_writing_batch, WRITING_BATCH_SIZE, WRITING_BATCH_WINDOW)
+
+
+async def user_language(current_user: str) -> str:
+    """ユーザーの登録言語（事前採点の正規化に使う。引けなければ中国語）"""
+    try:
+        user = await users_repo.aget(current_user)
+    except Exception as e:
+        print(f"⚠️ ユーザーの言語を取得できへん: {e}", flush=True)
+        return DEFAULT_LANGUAGE
+    return (user or {}).get("language") or DEFAULT_LANGUAGE
+
+
+async def instant_writing_result(submission: WritingSubmission, current_user: str, language: str) -> tuple:
+    """
+    事前採点・キャッシュで済む作文はその場で完了にする
+    戻り値: (完了した結果 or None, Geminiに回す時のキャッシュキー)
+    """
+    task_id = new_task_id("writing", submission.question_id)
+
+    # 正解と一致（表記ゆれ含む）ならLLMを呼ばずにその場で採点
+    local_result = prescore_writing(submission.text, submission.expected_answer, language)
+    if local_result is not None:
+        result = {
+            "task_id": task_id,
+            "question_id": submission.question_id,
+            "result": local_result,
+            "status": "completed"
+        }
+        await finish_task(task_id, current_user, result)
+        return result, None
+
+    # 同じ回答を最近採点済みならGeminiを呼ばずに即返す
+    cache_key = writing_cache_key(
+        submission.text, submission.expected_answer, model_router.cache_name("writing")
+    )
+    cached = await run_db(writing_cache.get, cache_key) if writing_cache else None
+    if cached is not None:
+        result = {
+            "task_id": task_id,
+            "question_id": submission.question_id,
+            "result": cached,
+            "status": "completed",
+            "cached": True
+        }
+        await finish_task(task_id, current_user, result)
+        return result, None
+    return None, cache_key
+
+
+async def queue_writing(submission: WritingSubmission, current_user: str, cache_key: str) -> dict:
+    """
+    reserve_writing_slots で予約済みの作文1件をまとめ採点に回してタスクIDを返す
+    枠は採点が終わったら（失敗しても）返す
+    """
+    task_id = new_task_id("writing", submission.question_id)
+    try:
+        await start_task(task_id, submission.question_id, current_user)
+    except Exception:
+        release_writing_slot()
+        raise
+
+    async def async_score():
+        try:
+            result_json = await writing_batcher.submit((submission.text, submission.expected_answer, cache_key))
+            await finish_task(task_id, current_user, {
+                "task_id": task_id,
+                "question_id": submission.question_id,
+                "result": result_json,
+                "status": "completed"
+            })
+        except Exception as e:
+            await finish_task(task_id, current_user, {
+                "task_id": task_id,
+                "question_id": submission.question_id,
+                "error": e.detail if isinstance(e, HTTPException) else str(e),
+                "status": "error"
+            })
+        finally:
+            release_writing_slot()
+
+    spawn_background(async_score())
+    return {"task_id": task_id, "question_id": submission.question_id, "status": "processing"}
+
+
+@app.post("/api/score/writing")
+async def score_writing(
+    submission: WritingSubmission,
+    current_user: str = Depends(get_current_user)  # 認証必須（結果の配信先を決めるため）
+):
+    """
+    作文をGeminiで添削（非同期処理）
+    同じ時間帯に届いた他の作文とまとめて1回のGemini呼び出しで採点する
+    """
+    try:
+        language = submission.language or await user_language(current_user)
+        result, cache_key = await instant_writing_result(submission, current_user, language)
+        if result is not None:
+            return result
+        reserve_writing_slots(1)  # 混雑時はここで503
+        return await queue_writing(submission, current_user, cache_key)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/score/writing/batch")
+async def score_writing_batch(
+    batch: WritingBatchSubmission,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    1セッション分の作文をまとめて受け付ける
+    結果は1件ずつタスクIDで返る（SSE / ロングポーリングで受け取る。事前採点・キャッシュで済んだ分はその場で completed）
+    Geminiに回す分の枠が足りなければ、1件も受け付けずに503
+    """
+    if len(batch.answers) > WRITING_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"一度に送れる作文は{WRITING_BATCH_MAX}件までです")
+    try:
+        language = None
+        if any(submission.language is None for submission in batch.answers):
+            language = await user_language(current_user)
+        prepared = await asyncio.gather(*(
+            instant_writing_result(submission, current_user, submission.language or language)
+            for submission in batch.answers
+        ))
+        reserve_writing_slots(sum(1 for result, _ in prepared if result is None))
+        return {"results": [
+            result if result is not None else await queue_writing(submission, current_user, cache_key)
+            for submission, (result, cache_key) in zip(batch.answers, prepared)
+        ]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/score/result/{task_id}")
-async def get_score_result(task_id: str):
+async def get_score_result(
+    task_id: str,
+    wait: float = 0,  # >0 ならロングポーリング（結果が出るまで最大wait秒待つ）
+    current_user: str = Depends(get_current_user)
+):
     """
-    採点結果を取得
+    採点結果を取得（SSEが使えない時のフォールバック）
     """
-    if task_id not in scoring_results:
+    wait = min(max(wait, 0), SCORE_LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    
+    while True:
+        result = await run_db(scoring_results.get, task_id)
+        if result is not None and result.get("user_id") not in (None, current_user):
+            # 他人のタスクは存在しないことにする
+            return {"status": "not_found"}
+        if (result is not None and result.get("status") in TERMINAL_STATUSES) or wait <= 0:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # 同じワーカーで終わればすぐ起こされる。共有ストアなら他ワーカーの分も定期的に確認
+        timeout = min(remaining, SHARED_STORE_POLL_INTERVAL) if scoring_results.shared else remaining
+        pushed = await score_events.wait_for(task_id, timeout)
+        if pushed is not None:
+            result = pushed
+            break
+    
+    if result is None:
         return {"status": "not_found"}
     
-    return scoring_results[task_id]
+    return result
 
 
-# --- 🛠️ 保存用の関数（ここが追加ポイント） ---
-def save_to_supabase(new_words, lesson_num, user_id: str):
+def format_sse(event: str, data: dict) -> str:
+    """Server-Sent Events形式の1メッセージを作る"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_event_name(result: dict) -> str:
+    """終わったタスクは result、途中経過（教科書ジョブの進捗など）は progress"""
+    return "result" if result.get("status") in TERMINAL_STATUSES else "progress"
+
+
+@app.get("/api/score/stream")
+async def stream_score_results(request: Request, token: str):
     """
-    解析した単語データをSupabaseに保存（ユーザーID付き）
-    フォールバック: ローカルJSON
+    ログイン中ユーザーの採点結果をSSEでプッシュ配信
+    EventSourceはヘッダーを付けられへんので、トークンはクエリで受け取る
     """
-    if not supabase:
-        print("⚠️ Supabaseが設定されていません。ローカルJSONに保存します。")
-        # フォールバック処理に進む
-    else:
-        data_to_insert = []
-        for word in new_words:
-            data_to_insert.append({
-                "user_id": user_id,
-                "lesson": lesson_num,
-                "word": word.get("word", ""),
-                "pinyin": word.get("pinyin", ""),
-                "meaning": word.get("meaning", ""),
-                "correct_count": 0,
-                "miss_count": 0,
-                "last_reviewed": None
-            })
-        
-        if data_to_insert:
-            try:
-                response = supabase.table("words").insert(data_to_insert).execute()
-                print(f"✅ User {user_id} の単語 {len(new_words)}個をSupabaseに保存したで！")
-                return
-            except Exception as e:
-                print(f"❌ Supabase保存エラー: {e}")
-                traceback.print_exc()
-                print("💡 ローカルJSONにフォールバックします")
-                # フォールバック: JSON
-                pass
+    current_user = get_user_from_token(token)
+    print(f"📡 採点ストリーム接続: User={current_user}", flush=True)
     
-    # フォールバック: ローカルJSON
-    if not os.path.exists(DB_FILE):
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-    
-    with open(DB_FILE, "r", encoding="utf-8") as f:
+    async def event_generator():
+        queue = score_events.subscribe(current_user)
+        last_seen = time.time()
+        last_heartbeat = time.monotonic()
         try:
-            current_data = json.load(f)
-        except json.JSONDecodeError:
-            current_data = []
-
-    start_id = len(current_data) + 1
-    for i, word in enumerate(new_words):
-        word_entry = {
-            "id": start_id + i,
-            "user_id": user_id,
-            "lesson": lesson_num,
-            "word": word.get("word", ""),
-            "pinyin": word.get("pinyin", ""),
-            "meaning": word.get("meaning", ""),
-            "correct_count": 0,
-            "miss_count": 0,
-            "last_reviewed": None
-        }
-        current_data.append(word_entry)
-
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(current_data, f, ensure_ascii=False, indent=2)
+            yield format_sse("ready", {"user_id": current_user})
+            while True:
+                if await request.is_disconnected():
+                    break
+                interval = SHARED_STORE_POLL_INTERVAL if scoring_results.shared else SCORE_STREAM_HEARTBEAT
+                try:
+                    result = await asyncio.wait_for(queue.get(), timeout=interval)
+                    yield format_sse(sse_event_name(result), result)
+                except asyncio.TimeoutError:
+                    pass
+                
+                if scoring_results.shared:
+                    # 他のワーカーで終わった採点も拾う（自ワーカー分は再送になるがクライアント側で重複は無視）
+                    for stored, updated_at in await run_db(scoring_results.updated_since, current_user, last_seen):
+                        last_seen = max(last_seen, updated_at)
+                        yield format_sse(sse_event_name(stored), stored)
+                
+                if time.monotonic() - last_heartbeat >= SCORE_STREAM_HEARTBEAT:
+                    last_heartbeat = time.monotonic()
+                    yield ": ping\n\n"
+        finally:
+            score_events.unsubscribe(current_user, queue)
+            print(f"📡 採点ストリーム切断: User={current_user}", flush=True)
     
-    print(f"💾 {len(new_words)}個の単語を database.json に保存したで！（ユーザー: {user_id}）")
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- 🛠️ 保存用の関数（ここが追加ポイント） ---
+def save_to_supabase(new_words, lesson_num, user_id: str):
+    """
+    解析した単語データをSupabaseに保存（ユーザーID付き）
+    フォールバック: ローカルSQLite
+    """
+    if new_words:
+        words_repo.insert_many(user_id, lesson_num, new_words)
+        segmenter.add_words([word.get("word") for word in new_words])
+        refresh_questions(user_id, lesson_num)
+    print(f"✅ User {user_id} の単語 {len(new_words)}個を保存したで！")
 
 
 def save_grammar_to_supabase(new_grammar, lesson_num, user_id: str):
     """
     解析した文法データをSupabaseに保存（ユーザーID付き）
-    フォールバック: ローカルJSON
+    フォールバック: ローカルSQLite
     """
-    if not supabase:
-        print("⚠️ Supabaseが設定されていません。ローカルJSONに保存します。")
-        # フォールバック処理に進む
-    else:
-        data_to_insert = []
-        for item in new_grammar:
-            data_to_insert.append({
-                "user_id": user_id,
-                "lesson": lesson_num,
-                "title": item.get("title", "無題"),
-                "description": item.get("description", ""),
-                "example_cn": item.get("example_cn", ""),
-                "example_jp": item.get("example_jp", "")
-            })
-        
-        if data_to_insert:
-            try:
-                response = supabase.table("grammar").insert(data_to_insert).execute()
-                print(f"✅ User {user_id} の文法 {len(new_grammar)}個をSupabaseに保存したで！")
-                return
-            except Exception as e:
-                print(f"❌ Supabase保存エラー(文法): {e}")
-                traceback.print_exc()
-                print("💡 ローカルJSONにフォールバックします")
-                # フォールバック: JSON
-                pass
+    if new_grammar:
+        grammar_repo.insert_many(user_id, lesson_num, new_grammar)
+        refresh_questions(user_id, lesson_num)
+    print(f"✅ User {user_id} の文法 {len(new_grammar)}個を保存したで！")
+
+
+# ==================== 教科書の解析 ====================
+TEXTBOOK_PROMPTS = {
+    "word": """
+            この画像から「新しい単語（生詞）」を抽出して。
+            以下のJSONリスト形式だけで返して。
+            [{"word": "単語", "pinyin": "ピンイン", "meaning": "意味"}]
+            """,
+    "grammar": """
+            この画像から「文法解説（Grammar）」を抽出して。
+            以下のJSONリスト形式だけで返して。
+            [
+                {
+                    "title": "文法項目名（例: 是構文）",
+                    "description": "解説文",
+                    "example_cn": "例文(中国語)",
+                    "example_jp": "例文(日本語)"
+                }
+            ]
+            """,
+}
+TEXTBOOK_GEMINI_TIMEOUT = 60.0
+
+
+async def parse_textbook_page(page: dict, type: str) -> list:
+    """
+    縮小済みの教科書ページ（workers.prepare_textbook_page の戻り値）をGeminiで解析してJSONリストにする
+    """
+    prompt = TEXTBOOK_PROMPTS["word"] if type == "word" else TEXTBOOK_PROMPTS["grammar"]
+    image_part = {"mime_type": page["mime_type"], "data": page["data"]}
+    try:
+        # 専用プールで実行（タイムアウト60秒、混雑時は503）
+        response = await call_gemini_for(f"textbook-{type}", [prompt, image_part], timeout=TEXTBOOK_GEMINI_TIMEOUT)
+        print("✅ Geminiから応答あり", flush=True)
+    except HTTPException:
+        raise
+    except Exception as gemini_error:
+        error_msg = str(gemini_error)
+        print(f"❌ Gemini APIエラー: {error_msg}", flush=True)
+        raise Exception(f"Gemini API呼び出しエラー: {error_msg}")
     
-    # フォールバック: ローカルJSON
-    if not os.path.exists(GRAMMAR_DB_FILE):
-        with open(GRAMMAR_DB_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    # レスポンスの確認
+    if not hasattr(response, 'text') or not response.text:
+        raise Exception("Geminiからの応答が空や！")
     
-    with open(GRAMMAR_DB_FILE, "r", encoding="utf-8") as f:
-        try:
-            current_data = json.load(f)
-        except json.JSONDecodeError:
-            current_data = []
-
-    start_id = len(current_data) + 1
-    for i, item in enumerate(new_grammar):
-        entry = {
-            "id": start_id + i,
-            "user_id": user_id,
-            "lesson": lesson_num,
-            "title": item.get("title", "無題"),
-            "description": item.get("description", ""),
-            "example_cn": item.get("example_cn", ""),
-            "example_jp": item.get("example_jp", "")
-        }
-        current_data.append(entry)
+    # JSONのクリーニング（Geminiが ```json とか付けるのを防ぐ）
+    text_data = response.text.strip()
+    print(f"📝 Geminiの生レスポンス（最初の100文字）: {text_data[:100]}", flush=True)
+    text_data = text_data.replace("```json", "").replace("```", "").strip()
+    
+    try:
+        return json.loads(text_data)
+    except json.JSONDecodeError as json_error:
+        print(f"⚠️ JSON解析エラー: {str(json_error)}", flush=True)
+        print(f"⚠️ パースしようとしたテキスト: {text_data[:200]}", flush=True)
+        raise Exception(f"JSONの解析に失敗: {str(json_error)}. レスポンス: {text_data[:200]}")
+
 
-    with open(GRAMMAR_DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(current_data, f, ensure_ascii=False, indent=2)
-    print(f"💾 文法 {len(new_grammar)}個を grammar.json に保存したで！（ユーザー: {user_id}）")
+def save_textbook_items(json_data: list, lesson: int, type: str, user_id: str) -> str:
+    """解析結果をタイプに応じて保存し、メッセージを返す"""
+    if type == 'word':
+        save_to_supabase(json_data, lesson, user_id)
+        return f"単語 {len(json_data)}個を保存完了！"
+    save_grammar_to_supabase(json_data, lesson, user_id)
+    return f"文法 {len(json_data)}個を保存完了！"
 
 
 @app.post("/api/upload-textbook")
@@ -867,94 +1679,22 @@ async def upload_textbook(
         if vision_model is None:
             raise Exception("Geminiモデルが初期化されてへん！APIキーを確認してくれ！")
 
-        # 2. 画像の読み込みとリサイズ（大きすぎる画像は処理が遅いため）
+        # 2. 画像の読み込みとリサイズ（大きすぎる画像は処理が遅いため、プロセスプールで）
         print("📷 画像を読み込み中...", flush=True)
         contents = await file.read()
         if not contents:
             raise Exception("画像ファイルが空や！")
         
-        try:
-            image = Image.open(io.BytesIO(contents))
-            original_size = image.size
-            print(f"✅ 画像読み込み成功: {image.format}, サイズ: {original_size}", flush=True)
-            
-            # 画像が大きすぎる場合はリサイズ（最大1920x1080）
-            max_width, max_height = 1920, 1080
-            if image.size[0] > max_width or image.size[1] > max_height:
-                print(f"📐 画像をリサイズ中: {original_size} -> ", end="", flush=True)
-                image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-                print(f"{image.size}", flush=True)
-        except Exception as img_error:
-            raise Exception(f"画像の読み込みに失敗: {str(img_error)}")
-
-        # 3. Geminiへの命令（タイプによって命令を変える！）
-        if type == 'word':
-            prompt = """
-            この画像から「新しい単語（生詞）」を抽出して。
-            以下のJSONリスト形式だけで返して。
-            [{"word": "単語", "pinyin": "ピンイン", "meaning": "意味"}]
-            """
-        else:  # grammar
-            prompt = """
-            この画像から「文法解説（Grammar）」を抽出して。
-            以下のJSONリスト形式だけで返して。
-            [
-                {
-                    "title": "文法項目名（例: 是構文）",
-                    "description": "解説文",
-                    "example_cn": "例文(中国語)",
-                    "example_jp": "例文(日本語)"
-                }
-            ]
-            """
-        
+        page = await run_cpu_task(prepare_textbook_page, contents)
+        print(f"✅ 画像読み込み成功: {page['format']}, サイズ: {page['original_size']} -> {page['size']}", flush=True)
+
+        # 3. Geminiに解析してもらう（タイプによって命令を変える！）
         print(f"🤖 Gemini ({type}) に解析依頼中...", flush=True)
-        try:
-            # タイムアウト設定（60秒）
-            async def call_gemini():
-                # 同期的なAPI呼び出しを非同期で実行
-                loop = asyncio.get_event_loop()
-                return await loop.run_in_executor(
-                    None, 
-                    lambda: vision_model.generate_content([prompt, image])
-                )
-            
-            try:
-                response = await asyncio.wait_for(call_gemini(), timeout=60.0)
-                print("✅ Geminiから応答あり", flush=True)
-            except asyncio.TimeoutError:
-                raise Exception("Gemini APIの呼び出しがタイムアウトしました（60秒）。画像が大きすぎる可能性があります。")
-        except Exception as gemini_error:
-            error_msg = str(gemini_error)
-            print(f"❌ Gemini APIエラー: {error_msg}", flush=True)
-            raise Exception(f"Gemini API呼び出しエラー: {error_msg}")
-        
-        # 4. レスポンスの確認
-        if not hasattr(response, 'text') or not response.text:
-            raise Exception("Geminiからの応答が空や！")
-        
-        # 5. JSONのクリーニング（Geminiが ```json とか付けるのを防ぐ）
-        text_data = response.text.strip()
-        print(f"📝 Geminiの生レスポンス（最初の100文字）: {text_data[:100]}", flush=True)
-        
-        # JSONクリーニング
-        text_data = text_data.replace("```json", "").replace("```", "").strip()
-        
-        try:
-            json_data = json.loads(text_data)
-            print(f"✨ {len(json_data)}個のデータを検出！", flush=True)
-        except json.JSONDecodeError as json_error:
-            print(f"⚠️ JSON解析エラー: {str(json_error)}", flush=True)
-            print(f"⚠️ パースしようとしたテキスト: {text_data[:200]}", flush=True)
-            raise Exception(f"JSONの解析に失敗: {str(json_error)}. レスポンス: {text_data[:200]}")
+        json_data = await parse_textbook_page(page, type)
+        print(f"✨ {len(json_data)}個のデータを検出！", flush=True)
 
         # ★★★ タイプによって保存先を変える！ ★★★
-        if type == 'word':
-            save_to_supabase(json_data, lesson, current_user)
-            message = f"単語 {len(json_data)}個を保存完了！"
-        else:
-            save_grammar_to_supabase(json_data, lesson, current_user)
-            message = f"文法 {len(json_data)}個を保存完了！"
+        message = await run_db(save_textbook_items, json_data, lesson, type, current_user)
 
         return {
             "status": "success",
@@ -964,12 +1704,14 @@ async def upload_textbook(
             "type": type
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         # ここでエラーの正体を暴く！！！
         # 標準エラー出力にも出力して、確実に表示されるようにする
         error_msg = f"\n{'='*60}\n🔥 蛆エラー発生 🔥\n{'='*60}\n"
         error_msg += f"エラー内容: {str(e)}\n"
-        error_msg += f"エラータイプ: {type(e).__name__}\n"
+        error_msg += f"エラータイプ: {e.__class__.__name__}\n"  # 引数の type が組み込みの type を隠してる
         error_msg += f"\n詳細な場所:\n"
         
         # 両方の出力先に書き込む
@@ -986,192 +1728,495 @@ async def upload_textbook(
         raise HTTPException(status_code=500, detail=f"サーバー内部エラー: {str(e)}")
 
 
-# --- 🛠️ ここを追加！データを読み出す機能 ---
-@app.get("/api/words")
-def get_words(
-    lesson: Optional[int] = None,
-    current_user: str = Depends(get_current_user)  # 認証必須
+# ==================== 教科書の一括アップロード（ジョブ方式） ====================
+# 複数ページの画像やPDFをまとめて受け取り、すぐにジョブIDを返して裏で並列に解析する
+TEXTBOOK_PAGE_CONCURRENCY = int(os.getenv("TEXTBOOK_PAGE_CONCURRENCY", "4"))  # 同時に解析するページ数
+TEXTBOOK_MAX_PAGES = int(os.getenv("TEXTBOOK_MAX_PAGES", "60"))  # 1ジョブの最大ページ数
+TEXTBOOK_PDF_DPI = int(os.getenv("TEXTBOOK_PDF_DPI", "150"))  # PDFを画像にする解像度
+TEXTBOOK_OVERLOAD_RETRIES = 5  # Geminiが混雑（503）してる時に待ってやり直す回数
+TEXTBOOK_OVERLOAD_BACKOFF = 2.0  # やり直すまでの待ち時間（秒）。回数ごとに 2, 4, 6... と伸ばす
+
+
+async def publish_job(job: dict):
+    """ジョブの状態をSSEで配信して保存"""
+    snapshot = {**job, "pages": [dict(page) for page in job["pages"]]}
+    # 配信は先にその場で（ページの並列処理で保存の順番が前後しても、進捗の通知は順番どおり）
+    score_events.publish(job["user_id"], snapshot)
+    await run_db(scoring_results.put, job["job_id"], snapshot)
+
+
+async def process_textbook_page(job: dict, index: int, contents: bytes, semaphore: asyncio.Semaphore):
+    """ジョブの1ページを解析して保存"""
+    page_state = job["pages"][index]
+    async with semaphore:
+        page_state["status"] = "processing"
+        await publish_job(job)
+        try:
+            page = await run_cpu_task(prepare_textbook_page, contents)
+            for attempt in range(TEXTBOOK_OVERLOAD_RETRIES + 1):
+                try:
+                    json_data = await parse_textbook_page(page, job["type"])
+                    break
+                except HTTPException as e:
+                    # 混雑してるだけなら少し待ってやり直す
+                    if e.status_code != 503 or attempt == TEXTBOOK_OVERLOAD_RETRIES:
+                        raise Exception(e.detail)
+                    await asyncio.sleep(TEXTBOOK_OVERLOAD_BACKOFF * (attempt + 1))
+            await run_db(save_textbook_items, json_data, job["lesson"], job["type"], job["user_id"])
+            page_state.update({"status": "completed", "items": len(json_data)})
+            job["saved_items"] += len(json_data)
+            print(f"📄 ジョブ {job['job_id']}: {index + 1}ページ目 {len(json_data)}個保存", flush=True)
+        except Exception as e:
+            page_state.update({"status": "error", "error": str(e)})
+            job["failed_pages"] += 1
+            print(f"❌ ジョブ {job['job_id']}: {index + 1}ページ目でエラー: {e}", flush=True)
+        finally:
+            job["done_pages"] += 1
+            await publish_job(job)
+
+
+async def run_textbook_job(job: dict, pages: list):
+    """全ページを並列数を絞って解析"""
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(TEXTBOOK_PAGE_CONCURRENCY)
+    await asyncio.gather(*(
+        process_textbook_page(job, index, contents, semaphore) for index, contents in enumerate(pages)
+    ))
+    job["status"] = "error" if job["failed_pages"] == job["total_pages"] else "completed"
+    job["elapsed_seconds"] = round(time.monotonic() - started, 1)
+    job["message"] = f"{job['total_pages']}ページ中{job['total_pages'] - job['failed_pages']}ページを解析、{job['saved_items']}個を保存したで！"
+    await publish_job(job)
+    print(f"✅ ジョブ完了 {job['job_id']}: {job['message']} ({job['elapsed_seconds']}秒)", flush=True)
+
+
+def is_pdf(file: UploadFile, contents: bytes) -> bool:
+    return contents[:5] == b"%PDF-" or (file.content_type or "") == "application/pdf"
+
+
+@app.post("/api/upload-textbook/jobs")
+async def create_textbook_job(
+    files: list[UploadFile] = File(...),
+    lesson: int = Form(...),
+    type: str = Form("word"),  # 'word' か 'grammar'
+    current_user: str = Depends(get_current_user)
 ):
     """
-    保存された単語データを取得（Supabase優先、フォールバックはJSON）
-    lessonパラメータが指定されれば、そのレッスンの単語のみを返す
+    複数ページの教科書画像（またはPDF）を受け取り、ジョブIDをすぐ返す
+    進捗は GET /api/upload-textbook/jobs/{job_id} か SSE（/api/score/stream の progress イベント）で確認
     """
-    print(f"📖 単語データ取得開始: User={current_user}, Lesson={lesson}", flush=True)
-    
-    if supabase:
-        try:
-            query = supabase.table("words").select("*").eq("user_id", current_user)
-            if lesson is not None:
-                query = query.eq("lesson", lesson)
-            response = query.execute()
-            data = response.data if response.data else []
-            print(f"✅ Supabaseから {len(data)}個の単語を取得", flush=True)
-            return data
-        except Exception as e:
-            print(f"⚠️ Supabase読み込みエラー: {e}", flush=True)
-            traceback.print_exc()
-            # フォールバック: JSON
-            pass
+    if type not in ("word", "grammar"):
+        raise HTTPException(status_code=400, detail="type は 'word' か 'grammar' にしてな")
+    if vision_model is None:
+        raise HTTPException(status_code=500, detail="Geminiモデルが初期化されてへん！APIキーを確認してくれ！")
     
-    # フォールバック: ローカルJSON
-    if not os.path.exists(DB_FILE):
-        return []
+    pages = []
+    for file in files:
+        contents = await file.read()
+        if not contents:
+            continue
+        if is_pdf(file, contents):
+            try:
+                pages.extend(await run_cpu_task(split_pdf_pages, contents, TEXTBOOK_PDF_DPI))
+            except ImportError:
+                raise HTTPException(status_code=400, detail="PDFを読むには pypdfium2 が必要や（pip install pypdfium2）。画像で送ってな")
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"PDFの読み込みに失敗: {e}")
+        else:
+            pages.append(contents)
     
-    with open(DB_FILE, "r", encoding="utf-8") as f:
-        try:
-            words = json.load(f)
-        except json.JSONDecodeError:
-            return []
+    if not pages:
+        raise HTTPException(status_code=400, detail="画像ファイルが空や！")
+    if len(pages) > TEXTBOOK_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"1回にアップロードできるのは{TEXTBOOK_MAX_PAGES}ページまでや")
     
-    # ユーザーIDでフィルタリング
-    user_words = [w for w in words if w.get("user_id") == current_user]
+    job_id = new_task_id("textbook", str(lesson))
+    job = {
+        "task_id": job_id,
+        "job_id": job_id,
+        "user_id": current_user,
+        "lesson": lesson,
+        "type": type,
+        "status": "processing",
+        "total_pages": len(pages),
+        "done_pages": 0,
+        "failed_pages": 0,
+        "saved_items": 0,
+        "pages": [{"page": index + 1, "status": "queued"} for index in range(len(pages))]
+    }
+    await publish_job(job)
+    spawn_background(run_textbook_job(job, pages))
+    print(f"\n📚 教科書ジョブ開始: {job_id} User={current_user}, Lesson={lesson}, Type={type}, {len(pages)}ページ", flush=True)
     
-    # レッスン番号で絞り込む（指定があれば）
+    return {"job_id": job_id, "status": "processing", "total_pages": len(pages)}
+
+
+@app.get("/api/upload-textbook/jobs/{job_id}")
+async def get_textbook_job(
+    job_id: str,
+    wait: float = 0,  # >0 なら次に進捗が更新されるまで最大wait秒待つ
+    current_user: str = Depends(get_current_user)
+):
+    """教科書ジョブの進捗（ページごとの状態）を取得"""
+    job = await run_db(scoring_results.get, job_id)
+    if job is None or job.get("user_id") != current_user:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    if wait > 0 and job.get("status") not in TERMINAL_STATUSES:
+        updated = await score_events.wait_for(job_id, min(wait, SCORE_LONGPOLL_MAX_WAIT))
+        if updated is not None:
+            job = updated
+        else:
+            job = await run_db(scoring_results.get, job_id) or job
+    return job
+
+
+# --- 🛠️ ここを追加！データを読み出す機能 ---
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))  # limit / sample の上限
+
+def parse_csv_param(value: Optional[str]) -> list:
+    """"1,2,3" のようなクエリを分ける"""
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+async def fetch_lesson_items(
+    repo,
+    response: Response,
+    current_user: str,
+    lesson: Optional[int],
+    lessons: Optional[str],
+    fields: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+    sample: Optional[int],
+) -> list:
+    """
+    /api/words と /api/grammar の共通処理
+    lesson / lessons=1,2,3: レッスンで絞り込み
+    fields=word,pinyin: 返す列を選ぶ（idは必ず付く）
+    limit + cursor: id順にページ分け（続きがあれば X-Next-Cursor ヘッダーに次のcursor）
+    sample=10: ランダムに10件だけ
+    何も指定しなければ今まで通り全部返す
+    """
+    try:
+        lesson_list = [int(value) for value in parse_csv_param(lessons)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="lessons は数字をカンマ区切りで指定してな")
     if lesson is not None:
-        filtered_words = [w for w in user_words if str(w.get("lesson")) == str(lesson)]
-        return filtered_words
-    
-    return user_words
+        lesson_list.append(lesson)
+
+    field_list = parse_csv_param(fields)
+    unknown = [field for field in field_list if field not in repo.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"指定できない列です: {', '.join(unknown)}")
+    if field_list and "id" not in field_list:
+        field_list.insert(0, "id")
+
+    for name, value in (("limit", limit), ("sample", sample)):
+        if value is not None and not 1 <= value <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"{name} は1〜{MAX_PAGE_SIZE}で指定してな")
+
+    if sample is not None:
+        return await repo.asample(current_user, sample, lesson_list or None, field_list or None)
+
+    after_id = None
+    if cursor:
+        try:
+            after_id = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor が正しくありません")
+    if limit is None and after_id is None and not field_list and len(lesson_list) <= 1:
+        # 今まで通りの呼び方（レッスン1つ or 全部）
+        return await repo.alist(current_user, lesson_list[0] if lesson_list else None)
+
+    page_size = limit or MAX_PAGE_SIZE
+    rows = await repo.aquery(current_user, lesson_list or None, field_list or None, after_id, page_size + 1)
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return rows
+
+@app.get("/api/words")
+async def get_words(
+    response: Response,
+    lesson: Optional[int] = None,
+    lessons: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sample: Optional[int] = None,
+    current_user: str = Depends(get_current_user)  # 認証必須
+):
+    """
+    保存された単語データを取得（Supabase優先、フォールバックはSQLite）
+    lessonパラメータが指定されれば、そのレッスンの単語のみを返す
+    絞り込み・列の指定・ページ分け・ランダム抽出は fetch_lesson_items を参照
+    """
+    print(f"📖 単語データ取得開始: User={current_user}, Lesson={lesson or lessons}, Limit={limit}, Sample={sample}", flush=True)
+    data = await fetch_lesson_items(words_repo, response, current_user, lesson, lessons, fields, limit, cursor, sample)
+    print(f"✅ {len(data)}個の単語を取得", flush=True)
+    return data
 
 
 # ★追加：文法データを取得するAPI
 @app.get("/api/grammar")
-def get_grammar(
+async def get_grammar(
+    response: Response,
     lesson: Optional[int] = None,
+    lessons: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sample: Optional[int] = None,
     current_user: str = Depends(get_current_user)  # 認証必須
 ):
     """
-    保存された文法データを取得（Supabase優先、フォールバックはJSON）
+    保存された文法データを取得（Supabase優先、フォールバックはSQLite）
     lessonパラメータが指定されれば、そのレッスンの文法のみを返す
+    絞り込み・列の指定・ページ分け・ランダム抽出は fetch_lesson_items を参照
     """
-    print(f"📖 文法データ取得開始: User={current_user}, Lesson={lesson}", flush=True)
-    
-    if supabase:
-        try:
-            query = supabase.table("grammar").select("*").eq("user_id", current_user)
-            if lesson is not None:
-                query = query.eq("lesson", lesson)
-            response = query.execute()
-            data = response.data if response.data else []
-            print(f"✅ Supabaseから {len(data)}個の文法を取得", flush=True)
-            return data
-        except Exception as e:
-            print(f"⚠️ Supabase読み込みエラー: {e}", flush=True)
-            traceback.print_exc()
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    if not os.path.exists(GRAMMAR_DB_FILE):
-        return []
-    
-    with open(GRAMMAR_DB_FILE, "r", encoding="utf-8") as f:
-        try:
-            grammar_list = json.load(f)
-        except json.JSONDecodeError:
-            return []
-    
-    # ユーザーIDでフィルタリング（個人データのみ）
-    user_grammar = [g for g in grammar_list if g.get("user_id") == current_user]
-    
-    if lesson is not None:
-        # レッスン番号でフィルタリング（文字列と数字の不一致を防ぐため、全部文字列にして比較）
-        filtered = [g for g in user_grammar if str(g.get("lesson")) == str(lesson)]
-        return filtered
-    
-    return user_grammar
+    print(f"📖 文法データ取得開始: User={current_user}, Lesson={lesson or lessons}, Limit={limit}, Sample={sample}", flush=True)
+    data = await fetch_lesson_items(grammar_repo, response, current_user, lesson, lessons, fields, limit, cursor, sample)
+    print(f"✅ {len(data)}個の文法を取得", flush=True)
+    return data
 
 
 # ★追加：アップロードされたレッスン番号のリストを取得
 @app.get("/api/lessons")
-def get_lessons(current_user: str = Depends(get_current_user)):  # 認証必須
+async def get_lessons(
+    with_counts: bool = False,
+    current_user: str = Depends(get_current_user)  # 認証必須
+):
     """
-    アップロードされたレッスン番号のリストを取得（Supabase優先、フォールバックはJSON）
+    アップロードされたレッスン番号のリストを取得（Supabase優先、フォールバックはSQLite）
+    レッスン一覧の表（lesson_index）を1回引くだけ。with_counts=true なら単語・文法の件数も返す
     """
     print(f"📚 レッスン番号取得開始: User={current_user}", flush=True)
-    lessons = set()
-    
-    if supabase:
+    try:
+        index = await lessons_repo.alist(current_user)
+    except Exception as e:
+        # lesson_index がまだ無い時は、words / grammar からレッスン番号だけ集める（件数なし）
+        print(f"⚠️ lesson_index 読み込みエラー: {e}（words / grammar から集めます）", flush=True)
+        word_lessons, grammar_lessons = await asyncio.gather(
+            words_repo.alessons(current_user), grammar_repo.alessons(current_user)
+        )
+        lessons = set(word_lessons) | set(grammar_lessons)
+        index = [{"lesson": lesson, "word_count": None, "grammar_count": None} for lesson in sorted(lessons)]
+    print(f"✅ レッスン番号取得完了: {[entry['lesson'] for entry in index]}", flush=True)
+    if with_counts:
+        return index
+    return [entry["lesson"] for entry in index]
+
+
+# ==================== 復習スケジュール（SM-2） ====================
+REVIEW_MAX_BATCH = int(os.getenv("REVIEW_MAX_BATCH", "500"))  # 1回で送れる回答の数
+
+class ReviewOutcome(BaseModel):
+    word_id: int
+    quality: Optional[int] = None  # 0〜5（SM-2の出来）。無ければ correct から決める
+    correct: Optional[bool] = None
+
+class ReviewSubmission(BaseModel):
+    results: list[ReviewOutcome]
+
+REVIEW_BUFFER = os.getenv("REVIEW_BUFFER", "1") != "0"  # 0 なら受け取ったその場で保存する
+REVIEW_FLUSH_SIZE = int(os.getenv("REVIEW_FLUSH_SIZE", "200"))  # これだけ貯まったらすぐ書く
+REVIEW_FLUSH_INTERVAL = float(os.getenv("REVIEW_FLUSH_INTERVAL", "5"))  # 貯まってなくても何秒ごとに書くか
+
+def write_review_outcomes(user_id: str, outcomes: list) -> tuple:
+    """
+    1人分の回答をSM-2に通して、単語の行を1回のまとめ更新で保存する
+    outcomes: [(word_id, quality, answered_at), ...]  戻り値: (更新した行, 見つからなかった回答の数)
+    """
+    cards = {card["id"]: card for card in words_repo.get_by_ids(user_id, {outcome[0] for outcome in outcomes})}
+    updated = apply_reviews(cards, [(word_id, quality, parse_due(at)) for word_id, quality, at in outcomes], datetime.utcnow())
+    if updated:
+        words_repo.update_review_states(user_id, updated)
+    ignored = sum(1 for outcome in outcomes if outcome[0] not in cards)
+    print(f"🧠 復習結果を保存: User={user_id}, {len(updated)}語 (無視{ignored}件)", flush=True)
+    return updated, ignored
+
+review_buffer = ReviewWriteBuffer(REVIEW_JOURNAL_FILE, write_review_outcomes) if REVIEW_BUFFER else None
+review_flush_task: Optional[asyncio.Task] = None
+
+async def flush_review_buffer(user_id: Optional[str] = None) -> dict:
+    return await run_db(review_buffer.flush, user_id)
+
+async def review_flush_loop():
+    """REVIEW_FLUSH_INTERVAL 秒ごとにジャーナルをDBへ書き出す（他のワーカーが残した分も拾う）"""
+    while True:
+        await asyncio.sleep(REVIEW_FLUSH_INTERVAL)
         try:
-            # wordsテーブルからレッスン番号を取得
-            words_response = supabase.table("words").select("lesson").eq("user_id", current_user).execute()
-            if words_response.data:
-                for word in words_response.data:
-                    if "lesson" in word:
-                        lessons.add(word["lesson"])
-            
-            # grammarテーブルからレッスン番号を取得
-            grammar_response = supabase.table("grammar").select("lesson").eq("user_id", current_user).execute()
-            if grammar_response.data:
-                for grammar in grammar_response.data:
-                    if "lesson" in grammar:
-                        lessons.add(grammar["lesson"])
-            
-            result = sorted(list(lessons))
-            print(f"✅ レッスン番号取得完了: {result}", flush=True)
-            return result
+            await flush_review_buffer()
         except Exception as e:
-            print(f"⚠️ Supabase読み込みエラー: {e}", flush=True)
-            traceback.print_exc()
-            # フォールバック: JSON
-            pass
-    
-    # フォールバック: ローカルJSON
-    # database.jsonからレッスン番号を取得（ユーザー固有）
-    if os.path.exists(DB_FILE):
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            try:
-                words = json.load(f)
-                for word in words:
-                    if word.get("user_id") == current_user and "lesson" in word:
-                        lessons.add(word["lesson"])
-            except json.JSONDecodeError:
-                pass
-    
-    # grammar.jsonからレッスン番号を取得（ユーザー固有）
-    if os.path.exists(GRAMMAR_DB_FILE):
-        with open(GRAMMAR_DB_FILE, "r", encoding="utf-8") as f:
-            try:
-                grammar_list = json.load(f)
-                for grammar in grammar_list:
-                    if grammar.get("user_id") == current_user and "lesson" in grammar:
-                        lessons.add(grammar["lesson"])
-            except json.JSONDecodeError:
-                pass
-    
-    # ソートして返す
-    return sorted(list(lessons))
+            print(f"⚠️ 復習結果の書き出しエラー: {e}", flush=True)
+
+@app.on_event("startup")
+async def start_review_buffer():
+    """前回保存しきれなかった回答をジャーナルから書き戻してから、定期書き出しを始める"""
+    global review_flush_task
+    if review_buffer is None:
+        return
+    try:
+        result = await flush_review_buffer()
+        if result["outcomes"]:
+            print(f"♻️ ジャーナルに残っていた復習結果 {result['outcomes']}件 を保存しました", flush=True)
+    except Exception as e:
+        print(f"⚠️ ジャーナルの復旧エラー（次の書き出しでやり直し）: {e}", flush=True)
+    review_flush_task = asyncio.create_task(review_flush_loop())
+
+@app.on_event("shutdown")
+def stop_review_buffer():
+    """終了前に貯まっている分を書き出す（失敗してもジャーナルに残るので次の起動で書く）"""
+    if review_buffer is None:
+        return
+    if review_flush_task is not None:
+        review_flush_task.cancel()
+    try:
+        review_buffer.flush()
+    except Exception as e:
+        print(f"⚠️ 終了時の復習結果書き出しエラー: {e}", flush=True)
+
+@app.post("/api/review")
+async def submit_review(
+    submission: ReviewSubmission,
+    flush: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    1セッション分の回答結果をまとめて受け取る
+    ジャーナルに書いたらすぐ返し、DBへの保存は件数か時間でまとめて行う（同じ単語の回答は1行の更新にまとまる）
+    flush=true ならその場で保存して結果を返す
+    """
+    if not submission.results:
+        return {"queued": 0, "pending": 0}
+    if len(submission.results) > REVIEW_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"一度に送れる回答は{REVIEW_MAX_BATCH}件までです")
+
+    answered_at = format_due(datetime.utcnow())
+    outcomes = [(result.word_id, outcome_quality(result.quality, result.correct), answered_at) for result in submission.results]
+    if review_buffer is None:
+        try:
+            updated, ignored = await run_db(write_review_outcomes, current_user, outcomes)
+        except Exception as e:
+            print(f"⚠️ 復習結果の保存エラー: {e}", flush=True)
+            raise HTTPException(status_code=503, detail="復習結果の保存に失敗したわ...もう一回送ってな")
+        return {"queued": 0, "pending": 0, "updated": len(updated), "ignored": ignored}
+
+    pending = await run_db(review_buffer.append, current_user, outcomes)
+    if flush:
+        result = await flush_review_buffer(current_user)
+        return {"queued": len(outcomes), "pending": 0, "flushed": result}
+    if pending >= REVIEW_FLUSH_SIZE:
+        spawn_background(flush_review_buffer())
+    return {"queued": len(outcomes), "pending": pending}
+
+@app.get("/api/review/due")
+async def get_due_reviews(
+    limit: int = 20,
+    lessons: Optional[str] = None,
+    include_new: bool = True,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    今復習すべき単語を期限の古い順に limit 件（足りなければ未学習の単語で埋める）
+    (user_id, next_due) のインデックスを範囲検索するだけなので、単語が何万あっても速い
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit は1〜{MAX_PAGE_SIZE}で指定してな")
+    try:
+        lesson_list = [int(value) for value in parse_csv_param(lessons)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="lessons は数字をカンマ区切りで指定してな")
+    if review_buffer is not None and await run_db(review_buffer.has_pending, current_user):
+        # まだ書いてない回答があると、今答えたばかりの単語がまた出てくるので先に書く
+        await flush_review_buffer(current_user)
+    data = await words_repo.adue(current_user, format_due(datetime.utcnow()), limit, lesson_list or None, include_new)
+    print(f"🧠 復習する単語: User={current_user}, {len(data)}個", flush=True)
+    return data
+
+
+# ==================== 単語分割 ====================
+SEGMENT_MAX_BATCH = int(os.getenv("SEGMENT_MAX_BATCH", "5000"))  # /api/segment に1回で送れる文の数
+# 辞書は最初に使う時に読み込む（全ユーザーの単語 + 内蔵語彙）
+segmenter = Segmenter(SEGMENT_DICT_CACHE, words_repo.vocabulary)
+
+class SegmentRequest(BaseModel):
+    sentences: list[str]
+    keep_punctuation: bool = False  # True なら句読点も1つずつ残す（つなげると元の文に戻る）
+
+@app.post("/api/segment")
+async def segment_sentences(
+    request: SegmentRequest,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    中国語の文をまとめて単語に分ける（並べ替え問題用）
+    最初の1回は辞書を作るために全員の単語をDBから読むので、db_executor で動かす
+    """
+    if len(request.sentences) > SEGMENT_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"一度に送れる文は{SEGMENT_MAX_BATCH}件までです")
+    tokens = await run_db(segmenter.segment_many, request.sentences, request.keep_punctuation)
+    return {"tokens": tokens}
+
+
+# ==================== 問題の自動生成 ====================
+QUESTION_CACHE_MAX = int(os.getenv("QUESTION_CACHE_MAX", "256"))  # 覚えておく (ユーザー, レッスン) の数
+question_cache = QuestionCache(QUESTION_CACHE_MAX)
+
+def question_fingerprint(user_id: str, lesson: Optional[int]):
+    """
+    レッスンの単語数・文法数（lesson_index を1回引くだけ）
+    別のワーカーでアップロードされても、件数が変わればキャッシュを作り直せる
+    """
+    try:
+        index = lessons_repo.list(user_id)
+    except Exception as e:
+        print(f"⚠️ lesson_index 読み込みエラー: {e}（アップロード時の破棄だけに頼ります）", flush=True)
+        return None
+    return tuple(
+        (entry["lesson"], entry["word_count"], entry["grammar_count"])
+        for entry in index if lesson is None or entry["lesson"] == lesson
+    )
 
+def load_questions(user_id: str, lesson: Optional[int]) -> list:
+    """生成済みの問題を返す（無ければ単語・文法を読んで作る）"""
+    return question_cache.get(
+        user_id, lesson, question_fingerprint(user_id, lesson),
+        lambda: build_questions(words_repo.list(user_id, lesson), grammar_repo.list(user_id, lesson), segmenter.segment),
+    )
+
+def refresh_questions(user_id: str, lesson: int):
+    """アップロード直後に古い問題を捨てて作り直しておく（次の学習開始がキャッシュから出せるように）"""
+    question_cache.invalidate(user_id, lesson)
+    try:
+        load_questions(user_id, lesson)
+    except Exception as e:
+        print(f"⚠️ 問題の事前生成エラー（次に開いた時に作ります）: {e}", flush=True)
 
 @app.get("/api/questions")
-async def get_questions():
+async def get_questions(
+    lesson: Optional[int] = None,
+    types: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: str = Depends(get_current_user)
+):
     """
-    問題一覧を取得（現在はモックデータ）
+    保存済みの単語・文法から作った問題を返す
+    types: handwriting / sorting / writing をカンマ区切りで絞り込み
+    limit: ランダムに選ぶ問題数（無ければ全部）
     """
-    # 本番ではDBから取得
-    return {
-        "questions": [
-            {
-                "id": "1",
-                "type": "handwriting",
-                "question": "「你好」を手書きで書いてください",
-                "expected_answer": "你好"
-            },
-            {
-                "id": "2",
-                "type": "sorting",
-                "question": "以下の単語を正しい順序に並べ替えてください",
-                "words": ["我", "是", "学生"],
-                "expected_order": ["我", "是", "学生"]
-            },
-            {
-                "id": "3",
-                "type": "writing",
-                "question": "「私は学生です」を中国語で書いてください",
-                "expected_answer": "我是学生"
-            }
-        ]
-    }
+    type_list = parse_csv_param(types)
+    unknown = [t for t in type_list if t not in QUESTION_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"types に使えるのは {', '.join(QUESTION_TYPES)} だけです")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit は1〜{MAX_PAGE_SIZE}で指定してな")
+
+    questions = await run_db(load_questions, current_user, lesson)
+    if type_list:
+        questions = [q for q in questions if q["type"] in type_list]
+    if limit is not None and limit < len(questions):
+        questions = random.sample(questions, limit)
+    print(f"📝 問題を取得: User={current_user}, Lesson={lesson}, {len(questions)}問", flush=True)
+    return {"questions": [shuffled_for_session(q) for q in questions]}
 
 
 if __name__ == "__main__":
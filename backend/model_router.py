@@ -0,0 +1,165 @@
+"""
+Geminiモデルの振り分け（タスクごとのティア + 失敗時の切り替え + 応答時間の計測）
+1文字の手書きや短い作文のような軽い処理は速いモデル（fast）、教科書の読み取りは賢いモデル（quality）に回す。
+同じティアに複数のモデルがあれば、直近の応答時間（指数移動平均）が一番短い、調子の良いモデルから使い、
+エラーやタイムアウトが出たモデルはしばらく後回しにして次の候補（最後は別のティア）で取り直す
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+TIERS = ("fast", "quality")
+DEFAULT_TASK_TIERS = {
+    "handwriting": "fast",
+    "writing": "fast",
+    "textbook-word": "quality",
+    "textbook-grammar": "quality",
+}
+TIER_KEYWORDS = {"fast": ("flash",), "quality": ("pro",)}  # ティアのモデルを指定しない時、一覧から名前で選ぶ
+# 名前で選ぶ時に外すモデル（音声・画像生成などテキストの採点に使えないもの）
+NON_TEXT_KEYWORDS = ("tts", "image", "audio", "live", "embedding", "aqa", "vision")
+# 名前で選ぶ時に後ろへ回すモデル（試験版はよく消えたり遅かったりする）
+UNSTABLE_KEYWORDS = ("preview", "exp")
+
+GEMINI_TASK_TIERS = os.getenv("GEMINI_TASK_TIERS", "")  # 例: "writing=quality,textbook-word=fast"
+GEMINI_FAST_MODELS = os.getenv("GEMINI_FAST_MODELS", "")  # カンマ区切り。空なら一覧から "flash" を含むもの
+GEMINI_QUALITY_MODELS = os.getenv("GEMINI_QUALITY_MODELS", "")  # 空なら一覧から "pro" を含むもの
+GEMINI_FAILOVER_ATTEMPTS = int(os.getenv("GEMINI_FAILOVER_ATTEMPTS", "2"))  # 1回の処理で試すモデルの数
+GEMINI_MODEL_COOLDOWN = int(os.getenv("GEMINI_MODEL_COOLDOWN", "60"))  # 失敗したモデルを後回しにする秒数
+# まだ使っていないモデルをたまに先頭にして応答時間を測る割合（0で測らない。最初に測れたモデルだけで決めつけないため）
+GEMINI_EXPLORE_RATE = float(os.getenv("GEMINI_EXPLORE_RATE", "0.05"))
+LATENCY_ALPHA = 0.2  # 指数移動平均の重み（新しい計測をどれだけ効かせるか）
+
+
+def split_names(value: str) -> list:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def parse_task_tiers(value: str) -> dict:
+    """"writing=quality,handwriting=fast" -> {task: tier}（知らないタスク・ティアは無視）"""
+    tiers = dict(DEFAULT_TASK_TIERS)
+    for pair in split_names(value):
+        task, _, tier = pair.partition("=")
+        task, tier = task.strip(), tier.strip()
+        if task in tiers and tier in TIERS:
+            tiers[task] = tier
+    return tiers
+
+
+class ModelRouter:
+    """
+    available(): 今使えるモデル名の一覧（ModelCatalog.names）
+    tier_models: {ティア: [モデル名]}。空のティアは available() から名前で選ぶ
+    """
+
+    def __init__(self, available: Callable[[], list], task_tiers: Optional[dict] = None,
+                 tier_models: Optional[dict] = None, cooldown: float = GEMINI_MODEL_COOLDOWN,
+                 explore_rate: float = GEMINI_EXPLORE_RATE, rng: Callable[[], float] = random.random):
+        self.available = available
+        self.task_tiers = task_tiers or dict(DEFAULT_TASK_TIERS)
+        self.tier_models = {tier: list((tier_models or {}).get(tier) or []) for tier in TIERS}
+        self.cooldown = cooldown
+        self.explore_rate = explore_rate
+        self.rng = rng
+        self._health = {}  # モデル名 -> {"latency": EWMA秒, "calls", "failures", "down_until"}
+        self._lock = threading.Lock()
+        self.explorations = 0
+
+    def models_for_tier(self, tier: str) -> list:
+        """ティアのモデル。指定が無ければ一覧から名前で選ぶ（テキスト用のみ、正式版を先に）"""
+        if self.tier_models.get(tier):
+            return list(self.tier_models[tier])
+        names = self.available()
+        matched = [
+            name for name in names
+            if any(keyword in name for keyword in TIER_KEYWORDS[tier])
+            and not any(keyword in name for keyword in NON_TEXT_KEYWORDS)
+        ]
+        matched.sort(key=lambda name: any(keyword in name for keyword in UNSTABLE_KEYWORDS))
+        return matched or names[:1]
+
+    def tier_of(self, task: str) -> str:
+        return self.task_tiers.get(task, "quality")
+
+    def cache_name(self, task: str) -> str:
+        """採点結果キャッシュのキー用（応答時間で入れ替わらない、ティアの先頭のモデル）"""
+        models = self.models_for_tier(self.tier_of(task))
+        return models[0] if models else "none"
+
+    def _rank(self, names: list, now: float, explore: bool = False) -> list:
+        """
+        1. 応答時間を測れている調子の良いモデル（速い順）
+        2. まだ使っていないモデル（並び順のまま。生徒のリクエストで一斉に試さない）
+        3. 失敗しかしていないモデル
+        4. 失敗して後回し中のモデル
+        explore=True なら、まだ使っていないモデルの1つ目を先頭に出して測る
+        """
+        def key(item):
+            position, name = item
+            health = self._health.get(name)
+            if health is None:
+                return (1, 0.0, position)
+            if health["down_until"] > now:
+                return (3, 0.0, position)
+            if health["latency"] is None:
+                return (2, 0.0, position)
+            return (0, health["latency"], position)
+        ranked = sorted(enumerate(names), key=key)
+        if explore:
+            unmeasured = next((i for i, item in enumerate(ranked) if key(item)[0] == 1), None)
+            if unmeasured:  # 0 なら元から先頭
+                ranked.insert(0, ranked.pop(unmeasured))
+                self.explorations += 1
+        return [name for _, name in ranked]
+
+    def candidates(self, task: str) -> list:
+        """使う順番のモデル名。タスクのティアを先に、残りのティアを予備として後ろに付ける"""
+        primary_tier = self.tier_of(task)
+        now = time.time()
+        explore = self.explore_rate > 0 and self.rng() < self.explore_rate
+        ordered = []
+        with self._lock:
+            for tier in (primary_tier, *[tier for tier in TIERS if tier != primary_tier]):
+                for name in self._rank(self.models_for_tier(tier), now, explore and tier == primary_tier):
+                    if name not in ordered:
+                        ordered.append(name)
+        return ordered
+
+    def _entry(self, name: str) -> dict:
+        return self._health.setdefault(name, {"latency": None, "calls": 0, "failures": 0, "down_until": 0.0})
+
+    def record_success(self, name: str, seconds: float):
+        with self._lock:
+            health = self._entry(name)
+            previous = health["latency"]
+            health["latency"] = seconds if previous is None else previous + LATENCY_ALPHA * (seconds - previous)
+            health["calls"] += 1
+            health["down_until"] = 0.0
+
+    def record_failure(self, name: str):
+        with self._lock:
+            health = self._entry(name)
+            health["calls"] += 1
+            health["failures"] += 1
+            health["down_until"] = time.time() + self.cooldown
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            models = {
+                name: {
+                    "latency_ms": round(health["latency"] * 1000, 1) if health["latency"] is not None else None,
+                    "calls": health["calls"],
+                    "failures": health["failures"],
+                    "healthy": health["down_until"] <= now,
+                }
+                for name, health in self._health.items()
+            }
+        return {
+            "task_tiers": dict(self.task_tiers),
+            "tiers": {tier: self.models_for_tier(tier) for tier in TIERS},
+            "models": models,
+            "explorations": self.explorations,
+        }
@@ -0,0 +1,169 @@
+"""
+ローカル事前採点
+正解と完全一致・表記ゆれだけの回答は、LLMを呼ばずにその場で採点する
+確信が持てへん時だけ None を返して Gemini に回す
+"""
+import os
+import re
+import unicodedata
+from typing import Optional
+
+LOCAL_PRESCORE = os.getenv("LOCAL_PRESCORE", "1") != "0"  # 0で無効
+DEFAULT_LANGUAGE = "chinese"  # 言語がわからん時（古いクライアントなど）は中国語として扱う
+
+try:
+    from opencc import OpenCC  # 入っていれば繁体字→簡体字の変換に使う（任意）
+    _opencc = OpenCC("t2s")
+except Exception:
+    _opencc = None
+
+# opencc がない時用の、教科書によく出る繁体字→簡体字の対応表
+_TRAD_SIMP_PAIRS = (
+    "們们 個个 來来 說说 時时 對对 會会 學学 國国 這这 還还 沒没 麼么 為为 與与 開开 關关 長长 門门 問问 "
+    "間间 聽听 見见 覺觉 現现 發发 後后 從从 當当 樣样 點点 裡里 東东 車车 書书 買买 賣卖 錢钱 飯饭 館馆 "
+    "電电 話话 語语 漢汉 寫写 讀读 認认 識识 謝谢 請请 誰谁 幾几 歲岁 氣气 熱热 愛爱 歡欢 難难 邊边 過过 "
+    "進进 遠远 運运 動动 場场 機机 飛飞 醫医 體体 頭头 臉脸 腦脑 習习 練练 題题 號号 媽妈 爺爷 聲声 員员 "
+    "師师 園园 種种 紅红 綠绿 藍蓝 黃黄 顏颜 條条 張张 兩两 萬万 億亿 塊块 週周 鐘钟 陽阳 陰阴 雲云 風风 "
+    "雞鸡 魚鱼 鳥鸟 馬马 貓猫 蘋苹 麵面 湯汤 喫吃 飲饮 鹽盐 報报 紙纸 筆笔 畫画 樂乐 藝艺 術术 經经 濟济 "
+    "業业 農农 廠厂 產产 銀银 綫线 線线 網网 絡络 視视 節节 "
+)
+_TRAD_SIMP = {pair[0]: pair[1] for pair in _TRAD_SIMP_PAIRS.split() if len(pair) == 2}
+
+# 声調番号 -> 声調記号（結合文字）。5と0は軽声なので記号なし
+_TONE_MARKS = {"1": "\u0304", "2": "\u0301", "3": "\u030c", "4": "\u0300"}
+# 声調番号付きの音節（ni3 / lü4）。直前がローマ字でない数字（我有3个）は対象外
+_NUMBERED_SYLLABLE = re.compile(r"([a-zü]+)([0-5])")
+
+
+def to_simplified(text: str) -> str:
+    """繁体字を簡体字にそろえる"""
+    if _opencc is not None:
+        return _opencc.convert(text)
+    return "".join(_TRAD_SIMP.get(ch, ch) for ch in text)
+
+
+def _mark_syllable(match: re.Match) -> str:
+    letters, tone = match.groups()
+    mark = _TONE_MARKS.get(tone)
+    if mark is None:
+        return letters
+    # 記号を付ける母音: a か e があればそれ、ou なら o、それ以外は最後の母音
+    if "a" in letters:
+        position = letters.index("a")
+    elif "e" in letters:
+        position = letters.index("e")
+    elif "ou" in letters:
+        position = letters.index("o")
+    else:
+        position = max(letters.rfind(vowel) for vowel in "iouü")
+        if position < 0:
+            return match.group()  # mp3 のような母音なしはピンインやない
+    return letters[:position + 1] + mark + letters[position + 1:]
+
+
+def canonical_pinyin(text: str) -> str:
+    """
+    ピンインの声調を記号付きの形にそろえる（小文字の入力）: ni3 hao3 / nǐ hǎo -> nǐ hǎo、lv4 / lü4 -> lǜ
+    声調は消さへんので mǎi と mài、ni3 と ni2 は別物のまま
+    """
+    text = unicodedata.normalize("NFC", text).replace("v", "ü")
+    return unicodedata.normalize("NFC", _NUMBERED_SYLLABLE.sub(_mark_syllable, text))
+
+
+def is_chinese(language: Optional[str]) -> bool:
+    return (language or DEFAULT_LANGUAGE).lower() == "chinese"
+
+
+def normalize_answer(text: Optional[str], language: Optional[str] = DEFAULT_LANGUAGE) -> str:
+    """
+    採点用の正規化（表記の違いだけを吸収して、意味の違いは残す）
+    中国語: 全角/半角 → 小文字化 → 句読点・空白の除去 → 繁体字→簡体字 → ピンイン声調を記号付きにそろえる
+    それ以外: 全角/半角 → 小文字化 → 句読点を区切りにして空白をそろえる（数字・アクセント・単語の区切りは残す）
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    if not is_chinese(language):
+        # "I have 3 apples." と "I have 3 apples" は同じ、"a part" と "apart"、"schön" と "schon" は別
+        text = "".join(" " if unicodedata.category(ch)[0] == "P" else ch for ch in text)
+        return " ".join(text.split())
+    # 句読点（P*）・記号（S*）・空白（Z*）を落とす。「我是学生」と「我是学生。」を同じに扱う
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in ("P", "S", "Z") and not ch.isspace())
+    text = to_simplified(text)
+    return canonical_pinyin(text)
+
+
+def exact_match_prescorer(text: str, expected_answer: Optional[str], language: Optional[str]) -> Optional[dict]:
+    """完全一致なら満点"""
+    if expected_answer and text.strip() == expected_answer.strip():
+        return {
+            "grammar_score": 100,
+            "vocabulary_score": 100,
+            "suggestions": [],
+            "feedback": "完璧や！期待される回答とぴったり一致しとるで。",
+            "is_correct": True
+        }
+    return None
+
+
+def normalized_match_prescorer(text: str, expected_answer: Optional[str], language: Optional[str]) -> Optional[dict]:
+    """句読点・全角半角・大文字小文字（中国語なら繁体字/簡体字・声調の書き方も）の違いだけなら正解扱い"""
+    normalized = normalize_answer(text, language)
+    if expected_answer and normalized and normalized == normalize_answer(expected_answer, language):
+        return {
+            "grammar_score": 100,
+            "vocabulary_score": 100,
+            "suggestions": [f"模範解答の表記: {expected_answer}"],
+            "feedback": "正解や！句読点や字体などの表記の違いだけやで。",
+            "is_correct": True
+        }
+    return None
+
+
+# 作文の事前採点ステージ（前から順に試して、最初に結果を返したものを採用）
+WRITING_PRESCORERS = [exact_match_prescorer, normalized_match_prescorer]
+
+local_prescore_stats = {"writing_resolved": 0, "writing_escalated": 0, "handwriting_resolved": 0, "handwriting_escalated": 0}
+
+
+def prescore_writing(text: str, expected_answer: Optional[str], language: Optional[str] = DEFAULT_LANGUAGE) -> Optional[dict]:
+    """ローカルで採点できたら結果を返す。できなければNone（Geminiに回す）。language は学習中の言語"""
+    if not LOCAL_PRESCORE:
+        return None
+    for prescorer in WRITING_PRESCORERS:
+        result = prescorer(text, expected_answer, language)
+        if result is not None:
+            local_prescore_stats["writing_resolved"] += 1
+            return {**result, "scored_by": prescorer.__name__}
+    local_prescore_stats["writing_escalated"] += 1
+    return None
+
+
+def blank_canvas_prescorer(prepared: dict, expected_answer: str) -> Optional[dict]:
+    """何も書かれてへんキャンバスは採点するまでもなく不正解"""
+    if prepared["blank"]:
+        return {
+            "recognized_text": "認識結果: （何も書かれていません）\n正誤判定: 不正解\nフィードバック: 何か書いてから送信してな！",
+            "is_correct": False
+        }
+    return None
+
+
+# 手書きの事前採点ステージ
+HANDWRITING_PRESCORERS = [blank_canvas_prescorer]
+
+
+def prescore_handwriting(prepared: dict, expected_answer: str) -> Optional[dict]:
+    """
+    ローカルで採点できたら結果を返す。できなければNone（Gemini Visionに回す）
+    prepared は workers.preprocess_handwriting の戻り値
+    """
+    if not LOCAL_PRESCORE:
+        return None
+    for prescorer in HANDWRITING_PRESCORERS:
+        result = prescorer(prepared, expected_answer)
+        if result is not None:
+            local_prescore_stats["handwriting_resolved"] += 1
+            return {**result, "scored_by": prescorer.__name__}
+    local_prescore_stats["handwriting_escalated"] += 1
+    return None
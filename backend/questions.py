@@ -0,0 +1,136 @@
+"""
+問題の自動生成
+保存済みの単語（words）と文法（grammar）から 手書き・並べ替え・作文 の問題を作る
+作った問題は (ユーザー, レッスン) ごとにプロセス内に覚えておき、アップロードがあったら作り直す
+"""
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+QUESTION_TYPES = ("handwriting", "sorting", "writing")
+SORTING_MIN_TOKENS = 2  # これより短い例文は並べ替えにならないので出さない
+
+
+def example_pairs(item: dict) -> list:
+    """
+    文法の例文を (中国語, 日本語) の組にする
+    「1. ...」のように番号付きで複数並んでいる時は1つずつに分ける（「A 単純方向補語」のような見出し行は捨てる）
+    """
+    def split(text: str) -> list:
+        lines = [line.strip() for line in (text or "").split("\n") if line.strip()]
+        numbered = [re.sub(r"^\d+\.\s*", "", line) for line in lines if re.match(r"^\d+\.", line)]
+        return numbered or (["\n".join(lines)] if lines else [])
+
+    cn_examples = split(item.get("example_cn"))
+    jp_examples = split(item.get("example_jp"))
+    return [
+        (cn, jp_examples[i] if i < len(jp_examples) else "")
+        for i, cn in enumerate(cn_examples)
+    ]
+
+
+def build_questions(words: list, grammar: list, tokenize: Callable[[str], list]) -> list:
+    """
+    単語 → 手書き問題（ピンインと意味から漢字を書く）
+    文法の例文 → 並べ替え問題（tokenize で単語に分ける）と 作文問題（和文から中国語を書く）
+    """
+    questions = []
+    for item in words:
+        word = (item.get("word") or "").strip()
+        if not word:
+            continue
+        questions.append({
+            "id": f"handwriting-{item['id']}",
+            "type": "handwriting",
+            "lesson": item.get("lesson"),
+            "question": f"「{item.get('meaning') or ''}」（{item.get('pinyin') or ''}）を漢字で書いてください",
+            "expected_answer": word,
+            "pinyin": item.get("pinyin"),
+            "meaning": item.get("meaning"),
+        })
+
+    for item in grammar:
+        for i, (example_cn, example_jp) in enumerate(example_pairs(item)):
+            tokens = tokenize(example_cn)
+            if len(tokens) >= SORTING_MIN_TOKENS:
+                questions.append({
+                    "id": f"sorting-{item['id']}-{i}",
+                    "type": "sorting",
+                    "lesson": item.get("lesson"),
+                    "question": "以下の単語を正しい順序に並べ替えてください",
+                    "words": tokens,
+                    "expected_order": tokens,
+                    "meaning": example_jp,
+                })
+            if example_jp:
+                questions.append({
+                    "id": f"writing-{item['id']}-{i}",
+                    "type": "writing",
+                    "lesson": item.get("lesson"),
+                    "question": f"「{example_jp}」を中国語で書いてください",
+                    "expected_answer": example_cn,
+                })
+    return questions
+
+
+def shuffled_for_session(question: dict) -> dict:
+    """並べ替え問題の選択肢は出すたびに混ぜる（キャッシュの中身は変えない）"""
+    if question["type"] != "sorting":
+        return question
+    shuffled = list(question["words"])
+    random.shuffle(shuffled)
+    return {**question, "words": shuffled}
+
+
+class QuestionCache:
+    """
+    (user_id, lesson) -> 生成済みの問題リスト
+    fingerprint（レッスンの単語数・文法数）が変わっていたら作り直すので、
+    別のワーカーでアップロードされた時も古い問題を出し続けない
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (user_id, lesson) -> (fingerprint, questions)
+        self._generation = 0  # invalidate のたびに増やす（作っている途中に消されたら覚えない）
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "build_ms": 0.0}
+
+    def get(self, user_id: str, lesson: Optional[int], fingerprint, builder: Callable[[], list]) -> list:
+        key = (user_id, lesson)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            generation = self._generation
+
+        start = time.perf_counter()
+        questions = builder()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.stats["build_ms"] = round(elapsed_ms, 1)
+            if generation == self._generation:
+                self._entries[key] = (fingerprint, questions)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return questions
+
+    def invalidate(self, user_id: str, lesson: Optional[int] = None):
+        """そのレッスンと「全レッスン」の分を捨てる"""
+        with self._lock:
+            self._entries.pop((user_id, lesson), None)
+            self._entries.pop((user_id, None), None)
+            self._generation += 1
+            self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
@@ -0,0 +1,880 @@
+"""
+データアクセス層（UserRepo / WordRepo / GrammarRepo）
+エンドポイントごとに「Supabaseを試す → ダメならローカル」を書いていたのをここにまとめた
+実装は Supabase / SQLite / メモリ の3種類で、起動時に STORAGE_BACKEND で選ぶ
+どの実装も同じ入口（_call）を通るので、所要時間の計測やフォールバックはここだけで済む
+"""
+import asyncio
+import functools
+import itertools
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from typing import Optional
+
+from local_db import LocalDB, TABLE_COLUMNS
+
+# ==================== 計測 ====================
+repo_stats = {}  # "supabase.words.list" -> {"calls", "errors", "fallbacks", "total_ms", "max_ms"}
+repo_stats_lock = threading.Lock()
+
+
+def record_repo_call(key: str, elapsed_ms: float, error: bool = False, fallback: bool = False):
+    with repo_stats_lock:
+        stats = repo_stats.setdefault(key, {"calls": 0, "errors": 0, "fallbacks": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["fallbacks"] += int(fallback)
+        stats["total_ms"] = round(stats["total_ms"] + elapsed_ms, 2)
+        stats["max_ms"] = max(stats["max_ms"], round(elapsed_ms, 2))
+
+
+def repo_stats_snapshot() -> dict:
+    """管理画面用（平均の所要時間も付ける）"""
+    with repo_stats_lock:
+        return {
+            key: {**stats, "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0.0}
+            for key, stats in repo_stats.items()
+        }
+
+
+# ==================== 共通部分 ====================
+class Repository:
+    """
+    全リポジトリの共通部分
+    公開メソッドは _call(op, ...) を通して実装側の _op を呼ぶ
+    fallback があれば、エラー時にそっちで同じ操作をやり直す（strict_ops は除く）
+    """
+
+    name = ""  # 計測用の名前（users / words / grammar）
+    backend = ""  # supabase / sqlite / memory
+    strict_ops: tuple = ()  # フォールバックしない操作
+    executor = None  # asyncメソッドを動かすスレッドプール（Noneならイベントループの既定）
+
+    def __init__(self, fallback: Optional["Repository"] = None):
+        self.fallback = fallback
+
+    def _call(self, op: str, *args):
+        key = f"{self.backend}.{self.name}.{op}"
+        started = time.perf_counter()
+        try:
+            result = getattr(self, f"_{op}")(*args)
+        except Exception as e:
+            record_repo_call(key, (time.perf_counter() - started) * 1000, error=True, fallback=self.fallback is not None)
+            if self.fallback is None or op in self.strict_ops:
+                raise
+            print(f"⚠️ {key} でエラー: {e}（{self.fallback.backend}にフォールバック）", flush=True)
+            return self.fallback._call(op, *args)
+        record_repo_call(key, (time.perf_counter() - started) * 1000)
+        return result
+
+    async def _acall(self, op: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self._call, op, *args))
+
+
+class UserRepo(Repository):
+    name = "users"
+    strict_ops = ("insert",)  # 登録は本来の保存先に入らんと意味がないので、失敗はそのまま返す
+
+    def list_all(self) -> list:
+        return self._call("list_all")
+
+    def get(self, student_id: str) -> Optional[dict]:
+        return self._call("get", student_id)
+
+    def get_many(self, student_ids: list) -> list:
+        return self._call("get_many", list(student_ids))
+
+    def count(self) -> int:
+        return self._call("count")
+
+    def insert(self, user: dict):
+        return self._call("insert", user)
+
+    def upsert_many(self, users: list):
+        return self._call("upsert_many", users)
+
+    def update(self, student_id: str, fields: dict):
+        return self._call("update", student_id, fields)
+
+    def delete(self, student_id: str):
+        return self._call("delete", student_id)
+
+    def save_changed(self, users: list) -> dict:
+        return self._call("save_changed", users)
+
+    async def alist_all(self) -> list:
+        return await self._acall("list_all")
+
+    async def aget(self, student_id: str) -> Optional[dict]:
+        return await self._acall("get", student_id)
+
+    async def aget_many(self, student_ids: list) -> list:
+        return await self._acall("get_many", list(student_ids))
+
+    async def acount(self) -> int:
+        return await self._acall("count")
+
+    async def ainsert(self, user: dict):
+        return await self._acall("insert", user)
+
+    async def aupsert_many(self, users: list):
+        return await self._acall("upsert_many", users)
+
+    async def aupdate(self, student_id: str, fields: dict):
+        return await self._acall("update", student_id, fields)
+
+    async def adelete(self, student_id: str):
+        return await self._acall("delete", student_id)
+
+    async def asave_changed(self, users: list) -> dict:
+        return await self._acall("save_changed", users)
+
+    def _save_changed(self, users: list) -> dict:
+        """
+        変更があったユーザーだけまとめて保存する（ダーティチェック）
+        今の中身を1回で取ってきて比べ、同じ内容のユーザーは書き込まない
+        """
+        rows = {user["student_id"]: user_row(user) for user in users}  # 同じIDが並んでたら後勝ち
+        current = {user["student_id"]: user_row(user) for user in self.get_many(list(rows))}
+        dirty = [row for student_id, row in rows.items() if current.get(student_id) != row]
+        if dirty:
+            self.upsert_many(dirty)
+        created = sum(1 for row in dirty if row["student_id"] not in current)
+        return {"created": created, "updated": len(dirty) - created, "unchanged": len(rows) - len(dirty)}
+
+
+class LessonItemRepo(Repository):
+    """レッスンごとに保存するデータ（単語・文法）の共通インターフェース"""
+
+    def list(self, user_id: str, lesson: Optional[int] = None) -> list:
+        return self._call("list", user_id, lesson)
+
+    def lessons(self, user_id: str) -> list:
+        return self._call("lessons", user_id)
+
+    def insert_many(self, user_id: str, lesson: int, items: list):
+        return self._call("insert_many", user_id, lesson, items)
+
+    def query(self, user_id: str, lessons: Optional[list] = None, fields: Optional[list] = None,
+              after_id: Optional[int] = None, limit: Optional[int] = None) -> list:
+        """絞り込み・射影・idカーソルでのページ分け（id順）"""
+        return self._call("query", user_id, lessons, fields, after_id, limit)
+
+    def sample(self, user_id: str, size: int, lessons: Optional[list] = None, fields: Optional[list] = None) -> list:
+        """ランダムに size 件だけ取り出す"""
+        return self._call("sample", user_id, size, lessons, fields)
+
+    async def alist(self, user_id: str, lesson: Optional[int] = None) -> list:
+        return await self._acall("list", user_id, lesson)
+
+    async def aquery(self, user_id: str, lessons: Optional[list] = None, fields: Optional[list] = None,
+                     after_id: Optional[int] = None, limit: Optional[int] = None) -> list:
+        return await self._acall("query", user_id, lessons, fields, after_id, limit)
+
+    async def asample(self, user_id: str, size: int, lessons: Optional[list] = None, fields: Optional[list] = None) -> list:
+        return await self._acall("sample", user_id, size, lessons, fields)
+
+    async def alessons(self, user_id: str) -> list:
+        return await self._acall("lessons", user_id)
+
+    async def ainsert_many(self, user_id: str, lesson: int, items: list):
+        return await self._acall("insert_many", user_id, lesson, items)
+
+
+class LessonIndexRepo(Repository):
+    """ユーザーごとのレッスン一覧（単語・文法の件数付き）。追加のたびに件数を足していく"""
+    name = "lesson_index"
+
+    def list(self, user_id: str) -> list:
+        return self._call("list", user_id)
+
+    async def alist(self, user_id: str) -> list:
+        return await self._acall("list", user_id)
+
+
+class WordRepo(LessonItemRepo):
+    name = "words"
+    # 復習結果はローカルに書いても本来の保存先には残らへん（読む側も空振りして「保存済み」になる）。
+    # 失敗はそのまま返して、ジャーナル（review_buffer）に残したまま次の flush でやり直す
+    strict_ops = ("get_by_ids", "update_review_states")
+    count_column = "word_count"  # lesson_index の列
+    columns = TABLE_COLUMNS["words"]
+
+    def get_by_ids(self, user_id: str, word_ids: list) -> list:
+        """本人の単語だけをidでまとめて取得"""
+        return self._call("get_by_ids", user_id, list(word_ids))
+
+    def update_review_states(self, user_id: str, rows: list):
+        """復習結果（ease / interval_days / reps / next_due / 回数）をまとめて保存"""
+        return self._call("update_review_states", user_id, rows)
+
+    def due(self, user_id: str, now: str, limit: int, lessons: Optional[list] = None, include_new: bool = True) -> list:
+        """期限が来た単語を古い順に（足りなければ未学習の単語で埋める）"""
+        return self._call("due", user_id, now, limit, lessons, include_new)
+
+    def vocabulary(self) -> dict:
+        """全ユーザーの単語 -> 登録数（単語分割の辞書を作る時だけ使う）"""
+        return self._call("vocabulary")
+
+    async def aget_by_ids(self, user_id: str, word_ids: list) -> list:
+        return await self._acall("get_by_ids", user_id, list(word_ids))
+
+    async def aupdate_review_states(self, user_id: str, rows: list):
+        return await self._acall("update_review_states", user_id, rows)
+
+    async def adue(self, user_id: str, now: str, limit: int, lessons: Optional[list] = None,
+                   include_new: bool = True) -> list:
+        return await self._acall("due", user_id, now, limit, lessons, include_new)
+
+    @staticmethod
+    def to_row(user_id: str, lesson: int, word: dict) -> dict:
+        return {
+            "user_id": user_id,
+            "lesson": lesson,
+            "word": word.get("word", ""),
+            "pinyin": word.get("pinyin", ""),
+            "meaning": word.get("meaning", ""),
+            "correct_count": 0,
+            "miss_count": 0,
+            "last_reviewed": None
+        }
+
+
+class GrammarRepo(LessonItemRepo):
+    name = "grammar"
+    count_column = "grammar_count"
+    columns = TABLE_COLUMNS["grammar"]
+
+    @staticmethod
+    def to_row(user_id: str, lesson: int, item: dict) -> dict:
+        return {
+            "user_id": user_id,
+            "lesson": lesson,
+            "title": item.get("title", "無題"),
+            "description": item.get("description", ""),
+            "example_cn": item.get("example_cn", ""),
+            "example_jp": item.get("example_jp", "")
+        }
+
+
+def user_row(user: dict) -> dict:
+    """保存するユーザーの列をそろえる"""
+    return {
+        "student_id": user["student_id"],
+        "password_hash": user.get("password_hash") or "",
+        "is_admin": bool(user.get("is_admin", False)),
+        "language": user.get("language", "chinese"),
+        "created_at": user.get("created_at", ""),
+        "webauthn_credentials": user.get("webauthn_credentials", [])
+    }
+
+
+# ==================== Supabase ====================
+class SupabaseUserRepo(UserRepo):
+    backend = "supabase"
+    IN_QUERY_CHUNK = 200  # in_() はURLに並ぶので、長くなりすぎんよう分けて問い合わせる
+
+    def __init__(self, client, fallback: Optional[Repository] = None, chunk_size: int = 500):
+        super().__init__(fallback)
+        self.client = client
+        self.chunk_size = max(1, chunk_size)
+
+    def _list_all(self) -> list:
+        response = self.client.table("users").select("*").execute()
+        return response.data if response.data else []
+
+    def _get(self, student_id: str) -> Optional[dict]:
+        response = self.client.table("users").select("*").eq("student_id", student_id).execute()
+        return response.data[0] if response.data else None
+
+    def _get_many(self, student_ids: list) -> list:
+        users = []
+        for start in range(0, len(student_ids), self.IN_QUERY_CHUNK):
+            chunk = student_ids[start:start + self.IN_QUERY_CHUNK]
+            response = self.client.table("users").select("*").in_("student_id", chunk).execute()
+            users.extend(response.data or [])
+        return users
+
+    def _count(self) -> int:
+        response = self.client.table("users").select("id", count="exact").execute()
+        if getattr(response, "count", None) is not None:
+            return response.count
+        return len(response.data or [])
+
+    def _insert(self, user: dict):
+        self.client.table("users").insert(user_row(user)).execute()
+
+    def _upsert_many(self, users: list):
+        # student_id のユニーク制約でまとめてupsert（chunk_size人ずつ1リクエスト）
+        rows = [user_row(user) for user in users]
+        for start in range(0, len(rows), self.chunk_size):
+            self.client.table("users").upsert(rows[start:start + self.chunk_size], on_conflict="student_id").execute()
+
+    def _update(self, student_id: str, fields: dict):
+        if fields:
+            self.client.table("users").update(fields).eq("student_id", student_id).execute()
+
+    def _delete(self, student_id: str):
+        self.client.table("users").delete().eq("student_id", student_id).execute()
+
+
+class SupabaseLessonItemMixin:
+    """words / grammar テーブル共通のSupabase実装"""
+    backend = "supabase"
+
+    def __init__(self, client, fallback: Optional[Repository] = None,
+                 lesson_index: Optional["SupabaseLessonIndexRepo"] = None):
+        super().__init__(fallback)
+        self.client = client
+        self.lesson_index = lesson_index or SupabaseLessonIndexRepo(client)
+
+    def _list(self, user_id: str, lesson: Optional[int] = None) -> list:
+        query = self.client.table(self.name).select("*").eq("user_id", user_id)
+        if lesson is not None:
+            query = query.eq("lesson", lesson)
+        response = query.execute()
+        return response.data if response.data else []
+
+    def _lessons(self, user_id: str) -> list:
+        response = self.client.table(self.name).select("lesson").eq("user_id", user_id).execute()
+        return sorted({row["lesson"] for row in (response.data or []) if "lesson" in row})
+
+    def _filtered(self, columns: str, user_id: str, lessons: Optional[list]):
+        query = self.client.table(self.name).select(columns).eq("user_id", user_id)
+        if lessons:
+            query = query.in_("lesson", lessons)
+        return query
+
+    def _query(self, user_id: str, lessons=None, fields=None, after_id=None, limit=None) -> list:
+        query = self._filtered(",".join(fields) if fields else "*", user_id, lessons)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        query = query.order("id")
+        if limit is not None:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    def _sample(self, user_id: str, size: int, lessons=None, fields=None) -> list:
+        # PostgRESTはランダム順にできへんので、idだけ取ってきて選び、選んだ行だけ取り直す
+        ids = [row["id"] for row in (self._filtered("id", user_id, lessons).execute().data or [])]
+        chosen = random.sample(ids, min(size, len(ids)))
+        if not chosen:
+            return []
+        columns = "*"
+        if fields:
+            columns = ",".join(fields if "id" in fields else [*fields, "id"])
+        response = self.client.table(self.name).select(columns).in_("id", chosen).execute()
+        rows = {row["id"]: row for row in (response.data or [])}
+        picked = [rows[item_id] for item_id in chosen if item_id in rows]
+        if fields and "id" not in fields:
+            for row in picked:
+                row.pop("id", None)
+        return picked
+
+    def _insert_many(self, user_id: str, lesson: int, items: list):
+        rows = [self.to_row(user_id, lesson, item) for item in items]
+        if not rows:
+            return
+        self.client.table(self.name).insert(rows).execute()
+        # 行は保存済みなので、ここから先の失敗でSQLiteにフォールバックさせたらあかん（二重保存になる）
+        self.lesson_index.bump(user_id, lesson, self.count_column, len(rows))
+
+
+class SupabaseWordRepo(SupabaseLessonItemMixin, WordRepo):
+    IN_QUERY_CHUNK = 200
+    PAGE_SIZE = 1000  # PostgREST が1回で返す最大行数
+
+    def _get_by_ids(self, user_id: str, word_ids: list) -> list:
+        rows = []
+        for start in range(0, len(word_ids), self.IN_QUERY_CHUNK):
+            chunk = word_ids[start:start + self.IN_QUERY_CHUNK]
+            rows.extend(self._filtered("*", user_id, None).in_("id", chunk).execute().data or [])
+        return rows
+
+    def _update_review_states(self, user_id: str, rows: list):
+        # id の主キーでまとめてupsert（NOT NULL の列も入れておかんと INSERT 側で弾かれる）
+        payload = [{
+            "id": row["id"], "user_id": user_id, "lesson": row["lesson"], "word": row["word"],
+            "ease": row["ease"], "interval_days": row["interval_days"], "reps": row["reps"],
+            "next_due": row["next_due"], "correct_count": row["correct_count"],
+            "miss_count": row["miss_count"], "last_reviewed": row["last_reviewed"],
+        } for row in rows]
+        if payload:
+            self.client.table("words").upsert(payload, on_conflict="id").execute()
+
+    def _due(self, user_id: str, now: str, limit: int, lessons=None, include_new=True) -> list:
+        rows = (
+            self._filtered("*", user_id, lessons)
+            .lte("next_due", now).order("next_due").limit(limit).execute().data or []
+        )
+        if include_new and len(rows) < limit:
+            rows += (
+                self._filtered("*", user_id, lessons)
+                .is_("next_due", "null").order("id").limit(limit - len(rows)).execute().data or []
+            )
+        return rows
+
+    def _vocabulary(self) -> dict:
+        counts = {}
+        start = 0
+        while True:
+            rows = (
+                self.client.table("words").select("word").order("id")
+                .range(start, start + self.PAGE_SIZE - 1).execute().data or []
+            )
+            for row in rows:
+                counts[row["word"]] = counts.get(row["word"], 0) + 1
+            if len(rows) < self.PAGE_SIZE:
+                return counts
+            start += self.PAGE_SIZE
+
+
+class SupabaseGrammarRepo(SupabaseLessonItemMixin, GrammarRepo):
+    pass
+
+
+class SupabaseLessonIndexRepo(LessonIndexRepo):
+    """
+    件数は保存のたびに bump_lesson_index で足していく
+    足すのに失敗したら recount_lesson_index でそのレッスンを数え直し、それも駄目なら次に一覧を読む時にやり直す
+    """
+    backend = "supabase"
+
+    def __init__(self, client, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self.client = client
+        self._stale = set()  # 件数がずれたままの (user_id, lesson)
+        self._lock = threading.Lock()
+
+    def bump(self, user_id: str, lesson: int, count_column: str, count: int):
+        counts = {"p_user_id": user_id, "p_lesson": lesson, "p_words": 0, "p_grammar": 0}
+        counts["p_words" if count_column == "word_count" else "p_grammar"] = count
+        try:
+            self.client.rpc("bump_lesson_index", counts).execute()
+        except Exception as e:
+            print(f"⚠️ lesson_index の更新に失敗: {e}（数え直します）", flush=True)
+            self.recount(user_id, lesson)
+
+    def recount(self, user_id: str, lesson: int) -> bool:
+        """words / grammar の行数からレッスンの件数を作り直す"""
+        try:
+            self.client.rpc("recount_lesson_index", {"p_user_id": user_id, "p_lesson": lesson}).execute()
+        except Exception as e:
+            print(f"⚠️ lesson_index の数え直しに失敗: {e}（次に一覧を読む時にやり直します）", flush=True)
+            with self._lock:
+                self._stale.add((user_id, lesson))
+            return False
+        with self._lock:
+            self._stale.discard((user_id, lesson))
+        return True
+
+    def _list(self, user_id: str) -> list:
+        with self._lock:
+            stale = sorted(lesson for owner, lesson in self._stale if owner == user_id)
+        for lesson in stale:
+            self.recount(user_id, lesson)
+        response = (
+            self.client.table("lesson_index")
+            .select("lesson,word_count,grammar_count")
+            .eq("user_id", user_id)
+            .order("lesson")
+            .execute()
+        )
+        return response.data or []
+
+
+# ==================== SQLite ====================
+class SQLiteUserRepo(UserRepo):
+    backend = "sqlite"
+
+    def __init__(self, db: LocalDB, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self.db = db
+
+    def _list_all(self) -> list:
+        return self.db.load_users()
+
+    def _get(self, student_id: str) -> Optional[dict]:
+        return self.db.get_user(student_id)
+
+    def _get_many(self, student_ids: list) -> list:
+        return self.db.get_users(student_ids)
+
+    def _count(self) -> int:
+        return self.db.count_users()
+
+    def _insert(self, user: dict):
+        if not self.db.insert_user(user_row(user)):
+            raise ValueError(f"ユーザーは既に存在します: {user['student_id']}")
+
+    def _upsert_many(self, users: list):
+        self.db.upsert_users([user_row(user) for user in users])
+
+    def _update(self, student_id: str, fields: dict):
+        self.db.update_user(student_id, fields)
+
+    def _delete(self, student_id: str):
+        self.db.delete_user(student_id)
+
+
+class SQLiteWordRepo(WordRepo):
+    backend = "sqlite"
+
+    def __init__(self, db: LocalDB, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self.db = db
+
+    def _get_by_ids(self, user_id: str, word_ids: list) -> list:
+        return self.db.get_words_by_ids(user_id, word_ids)
+
+    def _update_review_states(self, user_id: str, rows: list):
+        self.db.update_review_states(user_id, rows)
+
+    def _due(self, user_id: str, now: str, limit: int, lessons=None, include_new=True) -> list:
+        return self.db.get_due_words(user_id, now, limit, lessons, include_new)
+
+    def _vocabulary(self) -> dict:
+        return self.db.get_vocabulary()
+
+    def _list(self, user_id: str, lesson: Optional[int] = None) -> list:
+        return self.db.get_words(user_id, lesson)
+
+    def _lessons(self, user_id: str) -> list:
+        return self.db.get_lessons("words", user_id)
+
+    def _query(self, user_id: str, lessons=None, fields=None, after_id=None, limit=None) -> list:
+        return self.db.query_items("words", user_id, lessons, fields, after_id, limit)
+
+    def _sample(self, user_id: str, size: int, lessons=None, fields=None) -> list:
+        return self.db.query_items("words", user_id, lessons, fields, limit=size, random_order=True)
+
+    def _insert_many(self, user_id: str, lesson: int, items: list):
+        self.db.insert_words(user_id, lesson, items)
+
+
+class SQLiteLessonIndexRepo(LessonIndexRepo):
+    backend = "sqlite"
+
+    def __init__(self, db: LocalDB, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self.db = db
+
+    def _list(self, user_id: str) -> list:
+        return self.db.get_lesson_index(user_id)
+
+
+class SQLiteGrammarRepo(GrammarRepo):
+    backend = "sqlite"
+
+    def __init__(self, db: LocalDB, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self.db = db
+
+    def _list(self, user_id: str, lesson: Optional[int] = None) -> list:
+        return self.db.get_grammar(user_id, lesson)
+
+    def _lessons(self, user_id: str) -> list:
+        return self.db.get_lessons("grammar", user_id)
+
+    def _query(self, user_id: str, lessons=None, fields=None, after_id=None, limit=None) -> list:
+        return self.db.query_items("grammar", user_id, lessons, fields, after_id, limit)
+
+    def _sample(self, user_id: str, size: int, lessons=None, fields=None) -> list:
+        return self.db.query_items("grammar", user_id, lessons, fields, limit=size, random_order=True)
+
+    def _insert_many(self, user_id: str, lesson: int, items: list):
+        self.db.insert_grammar(user_id, lesson, items)
+
+
+# ==================== メモリ（テスト・お試し用） ====================
+class MemoryUserRepo(UserRepo):
+    backend = "memory"
+
+    def __init__(self, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self._users = {}  # student_id -> user
+        self._lock = threading.Lock()
+
+    def _list_all(self) -> list:
+        with self._lock:
+            return [dict(user) for user in self._users.values()]
+
+    def _get(self, student_id: str) -> Optional[dict]:
+        with self._lock:
+            user = self._users.get(student_id)
+            return dict(user) if user else None
+
+    def _get_many(self, student_ids: list) -> list:
+        with self._lock:
+            return [dict(self._users[sid]) for sid in student_ids if sid in self._users]
+
+    def _count(self) -> int:
+        return len(self._users)
+
+    def _insert(self, user: dict):
+        with self._lock:
+            if user["student_id"] in self._users:
+                raise ValueError(f"ユーザーは既に存在します: {user['student_id']}")
+            self._users[user["student_id"]] = user_row(user)
+
+    def _upsert_many(self, users: list):
+        with self._lock:
+            for user in users:
+                self._users[user["student_id"]] = user_row(user)
+
+    def _update(self, student_id: str, fields: dict):
+        with self._lock:
+            if student_id in self._users:
+                self._users[student_id].update(fields)
+
+    def _delete(self, student_id: str):
+        with self._lock:
+            self._users.pop(student_id, None)
+
+
+class MemoryLessonItemMixin:
+    backend = "memory"
+
+    def __init__(self, fallback: Optional[Repository] = None):
+        super().__init__(fallback)
+        self._rows = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _list(self, user_id: str, lesson: Optional[int] = None) -> list:
+        with self._lock:
+            return [
+                dict(row) for row in self._rows
+                if row["user_id"] == user_id and (lesson is None or str(row["lesson"]) == str(lesson))
+            ]
+
+    def _lessons(self, user_id: str) -> list:
+        with self._lock:
+            return sorted({row["lesson"] for row in self._rows if row["user_id"] == user_id})
+
+    def _matching(self, user_id: str, lessons: Optional[list]) -> list:
+        wanted = {str(lesson) for lesson in lessons} if lessons else None
+        with self._lock:
+            return [
+                row for row in self._rows
+                if row["user_id"] == user_id and (wanted is None or str(row["lesson"]) in wanted)
+            ]
+
+    def _project(self, rows: list, fields: Optional[list]) -> list:
+        columns = fields or self.columns
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def _query(self, user_id: str, lessons=None, fields=None, after_id=None, limit=None) -> list:
+        rows = [row for row in self._matching(user_id, lessons) if after_id is None or row["id"] > after_id]
+        return self._project(rows[:limit] if limit is not None else rows, fields)
+
+    def _sample(self, user_id: str, size: int, lessons=None, fields=None) -> list:
+        rows = self._matching(user_id, lessons)
+        return self._project(random.sample(rows, min(size, len(rows))), fields)
+
+    def _insert_many(self, user_id: str, lesson: int, items: list):
+        with self._lock:
+            for item in items:
+                self._rows.append({"id": next(self._ids), **self.to_row(user_id, lesson, item)})
+
+
+class MemoryWordRepo(MemoryLessonItemMixin, WordRepo):
+    REVIEW_FIELDS = ("ease", "interval_days", "reps", "next_due", "correct_count", "miss_count", "last_reviewed")
+
+    def _get_by_ids(self, user_id: str, word_ids: list) -> list:
+        wanted = set(word_ids)
+        return self._project([row for row in self._matching(user_id, None) if row["id"] in wanted], None)
+
+    def _update_review_states(self, user_id: str, rows: list):
+        updates = {row["id"]: row for row in rows}
+        with self._lock:
+            for row in self._rows:
+                if row["user_id"] == user_id and row["id"] in updates:
+                    row.update({field: updates[row["id"]][field] for field in self.REVIEW_FIELDS})
+
+    def _due(self, user_id: str, now: str, limit: int, lessons=None, include_new=True) -> list:
+        rows = self._matching(user_id, lessons)
+        due = sorted((row for row in rows if row.get("next_due") and row["next_due"] <= now), key=lambda row: row["next_due"])
+        if include_new:
+            due += [row for row in rows if not row.get("next_due")]
+        return self._project(due[:limit], None)
+
+    def _vocabulary(self) -> dict:
+        with self._lock:
+            return dict(Counter(row["word"] for row in self._rows))
+
+
+class MemoryGrammarRepo(MemoryLessonItemMixin, GrammarRepo):
+    pass
+
+
+class MemoryLessonIndexRepo(LessonIndexRepo):
+    """メモリ版は単語・文法の行をその場で数える"""
+    backend = "memory"
+
+    def __init__(self, words: MemoryWordRepo, grammar: MemoryGrammarRepo):
+        super().__init__()
+        self.words = words
+        self.grammar = grammar
+
+    def _list(self, user_id: str) -> list:
+        index = {}
+        for repo in (self.words, self.grammar):
+            for row in repo._list(user_id):
+                entry = index.setdefault(row["lesson"], {"lesson": row["lesson"], "word_count": 0, "grammar_count": 0})
+                entry[repo.count_column] += 1
+        return [index[lesson] for lesson in sorted(index)]
+
+
+# ==================== ユーザーキャッシュ ====================
+class CachedUserRepo(UserRepo):
+    """
+    get の結果を短時間（ttl秒）だけ覚えておくラッパー
+    管理者チェックや /api/auth/me のたびにDBへ問い合わせんで済むようにする
+    書き込み（登録・更新・削除）は中身に任せて、そのユーザーのキャッシュを捨てる
+    """
+    backend = "cache"
+
+    def __init__(self, inner: UserRepo, ttl: int = 30, max_entries: int = 1000):
+        super().__init__()
+        self.inner = inner
+        self.executor = inner.executor
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # student_id -> (期限, user)
+        self._generation = 0  # 書き込みのたびに増やす（読み込み中に更新されたら古い値を覚えない）
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def invalidate(self, student_id: str):
+        with self._lock:
+            self._entries.pop(student_id, None)
+            self._generation += 1
+            self.stats["invalidations"] += 1
+
+    def _remember(self, user: dict, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[user["student_id"]] = (time.monotonic() + self.ttl, dict(user))
+            self._entries.move_to_end(user["student_id"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached(self, student_id: str) -> Optional[dict]:
+        entry = self._entries.get(student_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[student_id]
+            return None
+        self._entries.move_to_end(student_id)
+        return dict(entry[1])
+
+    def _get(self, student_id: str) -> Optional[dict]:
+        with self._lock:
+            user = self._cached(student_id)
+            generation = self._generation
+            self.stats["hits" if user else "misses"] += 1
+        if user:
+            return user
+        user = self.inner.get(student_id)
+        if user:
+            self._remember(user, generation)
+        return user
+
+    def _get_many(self, student_ids: list) -> list:
+        with self._lock:
+            found = [user for user in map(self._cached, student_ids) if user]
+            generation = self._generation
+        missing = [sid for sid in student_ids if sid not in {user["student_id"] for user in found}]
+        if missing:
+            for user in self.inner.get_many(missing):
+                self._remember(user, generation)
+                found.append(user)
+        return found
+
+    def _list_all(self) -> list:
+        return self.inner.list_all()
+
+    def _count(self) -> int:
+        return self.inner.count()
+
+    def _insert(self, user: dict):
+        self.inner.insert(user)
+        self.invalidate(user["student_id"])
+
+    def _upsert_many(self, users: list):
+        self.inner.upsert_many(users)
+        for user in users:
+            self.invalidate(user["student_id"])
+
+    def _update(self, student_id: str, fields: dict):
+        self.inner.update(student_id, fields)
+        self.invalidate(student_id)
+
+    def _delete(self, student_id: str):
+        self.inner.delete(student_id)
+        self.invalidate(student_id)
+
+    def _save_changed(self, users: list) -> dict:
+        # 比較はキャッシュではなく保存先の最新の値でやる
+        result = self.inner.save_changed(users)
+        for user in users:
+            self.invalidate(user["student_id"])
+        return result
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "ttl": self.ttl, "max_entries": self.max_entries}
+
+
+# ==================== 起動時の選択 ====================
+Repositories = namedtuple("Repositories", ["users", "words", "grammar", "lessons"])
+
+
+def create_repositories(backend: str, supabase_client=None, local_db: Optional[LocalDB] = None,
+                        chunk_size: int = 500, executor=None) -> Repositories:
+    """
+    STORAGE_BACKEND に合わせてリポジトリを作る
+    auto: Supabaseがあれば Supabase（エラー時はSQLiteにフォールバック）、なければSQLite
+    supabase / sqlite / memory: 指定どおり
+    chunk_size: Supabaseへまとめて書き込む時の1リクエストあたりの件数
+    executor: async メソッドを動かすDB専用のスレッドプール
+    """
+    repos = _create_repositories(backend, supabase_client, local_db, chunk_size)
+    for repo in repos:
+        repo.executor = executor
+    return repos
+
+
+def _create_repositories(backend: str, supabase_client, local_db: Optional[LocalDB], chunk_size: int) -> Repositories:
+    if backend == "memory":
+        print("🧠 ストレージ: メモリ（再起動で消えます）")
+        words, grammar = MemoryWordRepo(), MemoryGrammarRepo()
+        return Repositories(MemoryUserRepo(), words, grammar, MemoryLessonIndexRepo(words, grammar))
+
+    if local_db is None:
+        raise ValueError("SQLiteのストレージが必要です")
+    local = Repositories(
+        SQLiteUserRepo(local_db), SQLiteWordRepo(local_db), SQLiteGrammarRepo(local_db), SQLiteLessonIndexRepo(local_db)
+    )
+
+    if backend == "sqlite" or supabase_client is None:
+        if backend == "supabase":
+            print("⚠️ STORAGE_BACKEND=supabase やけどSupabaseに繋がってへんので、SQLiteを使います")
+        print(f"💾 ストレージ: SQLite ({local_db.path})")
+        return local
+
+    print(f"☁️ ストレージ: Supabase（エラー時は SQLite {local_db.path} にフォールバック）")
+    # Supabaseが落ちてる間は単語・文法もSQLiteから読む（そっちに入った分だけ）ので、件数もSQLite側の表を返す
+    lessons = SupabaseLessonIndexRepo(supabase_client, fallback=local.lessons)
+    return Repositories(
+        SupabaseUserRepo(supabase_client, fallback=local.users, chunk_size=chunk_size),
+        SupabaseWordRepo(supabase_client, fallback=local.words, lesson_index=lessons),
+        SupabaseGrammarRepo(supabase_client, fallback=local.grammar, lesson_index=lessons),
+        lessons,
+    )
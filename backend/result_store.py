@@ -0,0 +1,142 @@
+"""
+採点結果ストア（タスクID -> 採点結果）
+memory: プロセス内のLRU+TTL（ワーカー1つ向け）
+sqlite: ファイル共有なので uvicorn --workers N でも結果が見える＆再起動しても消えへん
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from local_db import SQLiteBackedStore
+
+SCORING_RESULT_BACKEND = os.getenv("SCORING_RESULT_BACKEND", "memory")
+SCORING_RESULT_TTL = int(os.getenv("SCORING_RESULT_TTL", "3600"))  # 結果の保持時間（秒）
+SCORING_RESULT_MAX = int(os.getenv("SCORING_RESULT_MAX", "10000"))  # 保持する最大件数
+SCORING_RESULT_DB = os.getenv("SCORING_RESULT_DB", "scoring_results.db")
+
+
+class MemoryResultStore:
+    """プロセス内のLRU+TTLストア（古いものから自動で捨てる）"""
+
+    shared = False  # 他のワーカーからは見えへん
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # task_id -> (expires_at, result)
+        self._lock = threading.Lock()
+
+    def put(self, task_id: str, result: dict):
+        with self._lock:
+            self._data[task_id] = (time.time() + self.ttl, result)
+            self._data.move_to_end(task_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._data.get(task_id)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.time():
+                del self._data[task_id]
+                return None
+            self._data.move_to_end(task_id)
+            return result
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteResultStore(SQLiteBackedStore):
+    """SQLiteファイルに結果を保存するストア（複数ワーカーで共有可能）"""
+
+    PURGE_EVERY = 100  # 何回書き込むごとに期限切れ掃除をするか
+    shared = True  # 他のワーカーが書いた結果も見える
+
+    def __init__(self, path: str, max_entries: int, ttl: int):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scoring_results (
+                task_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        try:
+            # 旧バージョンで作ったファイルには user_id 列がない
+            conn.execute("ALTER TABLE scoring_results ADD COLUMN user_id TEXT")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scoring_results_user ON scoring_results(user_id, updated_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scoring_results_expires ON scoring_results(expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scoring_results_updated ON scoring_results(updated_at)")
+        conn.commit()
+
+    def put(self, task_id: str, result: dict):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO scoring_results (task_id, user_id, data, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (task_id, result.get("user_id"), json.dumps(result, ensure_ascii=False), now + self.ttl, now),
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT data FROM scoring_results WHERE task_id = ? AND expires_at > ?",
+            (task_id, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def updated_since(self, user_id: str, since: float) -> list:
+        """他のワーカーが書いた結果も拾えるよう、ユーザーの更新分を返す"""
+        rows = self._conn().execute(
+            "SELECT data, updated_at FROM scoring_results WHERE user_id = ? AND updated_at > ? ORDER BY updated_at",
+            (user_id, since),
+        ).fetchall()
+        return [(json.loads(data), updated_at) for data, updated_at in rows]
+
+    def purge(self):
+        """期限切れと上限超過分を削除"""
+        conn = self._conn()
+        conn.execute("DELETE FROM scoring_results WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            """
+            DELETE FROM scoring_results WHERE task_id IN (
+                SELECT task_id FROM scoring_results ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM scoring_results").fetchone()[0]
+
+
+def create_result_store():
+    """SCORING_RESULT_BACKEND に応じてストアを作る"""
+    if SCORING_RESULT_BACKEND == "sqlite":
+        try:
+            store = SQLiteResultStore(SCORING_RESULT_DB, SCORING_RESULT_MAX, SCORING_RESULT_TTL)
+            print(f"✅ 採点結果ストア: SQLite ({SCORING_RESULT_DB})")
+            return store
+        except Exception as e:
+            print(f"⚠️ SQLite結果ストアの初期化に失敗: {e}")
+            print("💡 メモリストアで動作します")
+    return MemoryResultStore(SCORING_RESULT_MAX, SCORING_RESULT_TTL)
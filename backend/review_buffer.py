@@ -0,0 +1,142 @@
+"""
+復習結果の書き込みバッファ（write-behind）
+回答が届くたびにSupabaseへ1行ずつ書くと書き込みが倍増するので、
+いったんローカルのジャーナル（SQLite、コミットごとにfsync）に貯めて、
+件数か時間で区切ってユーザーごとに1回のまとめ更新にする。
+ジャーナルはディスクにあるので、保存前に落ちても再起動後に続きから書ける
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from local_db import SQLiteBackedStore
+
+REVIEW_JOURNAL_FILE = os.getenv("REVIEW_JOURNAL_FILE", "review_journal.db")
+
+
+class ReviewWriteBuffer(SQLiteBackedStore):
+    """
+    append() でジャーナルに追記して即返し、flush() でまとめてDBに書く
+    writer(user_id, [(word_id, quality, answered_at), ...]) がユーザー1人分をまとめて保存する関数
+    """
+
+    CLAIM_TIMEOUT = 300  # flush中に落ちたワーカーの取りかけ分を何秒後に取り直すか
+
+    def __init__(self, path: str, writer: Callable[[str, list], object]):
+        super().__init__(path)
+        self.writer = writer
+        self._flush_lock = threading.Lock()  # このプロセス内で flush は同時に1つだけ
+        self._count_lock = threading.Lock()
+        self._appended = 0  # このプロセスで追記して、まだ書いていない件数
+        self.stats = {"appended": 0, "flushes": 0, "flushed": 0, "failed": 0, "last_flush_ms": 0.0}
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS review_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                word_id INTEGER NOT NULL,
+                quality INTEGER NOT NULL,
+                answered_at TEXT NOT NULL,
+                claimed_by TEXT,
+                claimed_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_review_journal_user ON review_journal(user_id)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = super()._conn()
+            # コミットのたびにfsyncして、返事をした回答は落ちても消えないようにする
+            conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append(self, user_id: str, outcomes: list) -> int:
+        """[(word_id, quality, answered_at), ...] をジャーナルに追記。戻り値はflush待ちの件数"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO review_journal (user_id, word_id, quality, answered_at) VALUES (?, ?, ?, ?)",
+                [(user_id, word_id, quality, answered_at) for word_id, quality, answered_at in outcomes],
+            )
+        with self._count_lock:
+            self._appended += len(outcomes)
+            self.stats["appended"] += len(outcomes)
+            return self._appended
+
+    def pending(self) -> int:
+        """まだDBに書いていない件数（他のワーカーの分も含む）"""
+        return self._conn().execute("SELECT COUNT(*) FROM review_journal").fetchone()[0]
+
+    def has_pending(self, user_id: str) -> bool:
+        row = self._conn().execute("SELECT 1 FROM review_journal WHERE user_id = ? LIMIT 1", (user_id,)).fetchone()
+        return row is not None
+
+    def _claim(self, user_id: Optional[str]) -> tuple:
+        """まだ誰も書いていない行に印を付けて取る（複数ワーカーで同じ行を二重に書かないように）"""
+        token = f"{os.getpid()}-{uuid.uuid4().hex}"
+        now = time.time()
+        conn = self._conn()
+        query = ("UPDATE review_journal SET claimed_by = ?, claimed_at = ? "
+                 "WHERE (claimed_by IS NULL OR claimed_at < ?)")
+        params = [token, now, now - self.CLAIM_TIMEOUT]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with conn:
+            conn.execute(query, params)
+        rows = conn.execute(
+            "SELECT user_id, word_id, quality, answered_at FROM review_journal WHERE claimed_by = ? ORDER BY seq",
+            (token,),
+        ).fetchall()
+        return token, rows
+
+    def flush(self, user_id: Optional[str] = None) -> dict:
+        """
+        ジャーナルの中身をユーザーごとにまとめて writer に渡す
+        書けた分だけジャーナルから消し、失敗した分は次の flush でやり直す
+        （DBに書いた直後に落ちた時だけ同じ回答が2回反映されることがある）
+        """
+        with self._flush_lock:
+            start = time.perf_counter()
+            token, rows = self._claim(user_id)
+            if not rows:
+                return {"users": 0, "outcomes": 0, "failed": 0}
+
+            by_user = {}
+            for uid, word_id, quality, answered_at in rows:
+                by_user.setdefault(uid, []).append((word_id, quality, answered_at))
+
+            conn = self._conn()
+            failed = 0
+            for uid, outcomes in by_user.items():
+                try:
+                    self.writer(uid, outcomes)
+                except Exception as e:
+                    print(f"⚠️ 復習結果の保存に失敗（次回やり直し）: User={uid}, {len(outcomes)}件: {e}", flush=True)
+                    failed += len(outcomes)
+                    with conn:
+                        conn.execute(
+                            "UPDATE review_journal SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ? AND user_id = ?",
+                            (token, uid),
+                        )
+                    continue
+                with conn:
+                    conn.execute("DELETE FROM review_journal WHERE claimed_by = ? AND user_id = ?", (token, uid))
+
+            # 書けた分だけ減らす（1人分だけの flush や失敗した分で、他の人の件数の判定を遅らせない）
+            with self._count_lock:
+                self._appended = max(0, self._appended - (len(rows) - failed))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["flushed"] += len(rows) - failed
+            self.stats["failed"] += failed
+            self.stats["last_flush_ms"] = round(elapsed_ms, 1)
+            return {"users": len(by_user), "outcomes": len(rows), "failed": failed}
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": self.pending()}
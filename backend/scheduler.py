@@ -0,0 +1,81 @@
+"""
+復習スケジュール（SM-2方式）
+単語ごとに ease（覚えやすさ）/ interval_days（次までの日数）/ reps（連続正解数）を持ち、
+回答の出来（quality 0〜5）から次に出す日（next_due）を決める
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+PASSING_QUALITY = 3  # これ未満は「忘れてた」扱いで最初からやり直し
+CORRECT_QUALITY = 4  # correct=true だけ送られてきた時の quality
+WRONG_QUALITY = 1  # correct=false の時
+DUE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def format_due(moment: datetime) -> str:
+    """next_due の保存形式（UTCのISO形式、文字列のままでも大小比較できる）"""
+    return moment.strftime(DUE_FORMAT)
+
+
+def parse_due(value: str) -> datetime:
+    """format_due の逆"""
+    return datetime.strptime(value, DUE_FORMAT)
+
+
+def outcome_quality(quality: Optional[int], correct: Optional[bool]) -> int:
+    """quality（0〜5）か correct（正解/不正解）のどちらかから quality を決める"""
+    if quality is not None:
+        return max(0, min(5, int(quality)))
+    return CORRECT_QUALITY if correct else WRONG_QUALITY
+
+
+def schedule_review(card: dict, quality: int, now: datetime) -> dict:
+    """
+    1回分の回答を反映した新しい復習状態を返す（card自体は変えない）
+    """
+    ease = card.get("ease") or DEFAULT_EASE
+    reps = card.get("reps") or 0
+    interval = card.get("interval_days") or 0
+
+    if quality < PASSING_QUALITY:
+        reps = 0
+        interval = 1
+    else:
+        reps += 1
+        if reps == 1:
+            interval = 1
+        elif reps == 2:
+            interval = 6
+        else:
+            interval = max(1, round(interval * ease))
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+
+    return {
+        "ease": round(ease, 3),
+        "interval_days": interval,
+        "reps": reps,
+        "next_due": format_due(now + timedelta(days=interval)),
+        "last_reviewed": format_due(now),
+        "correct_count": (card.get("correct_count") or 0) + (1 if quality >= PASSING_QUALITY else 0),
+        "miss_count": (card.get("miss_count") or 0) + (0 if quality >= PASSING_QUALITY else 1),
+    }
+
+
+def apply_reviews(cards: dict, outcomes: list, now: datetime) -> list:
+    """
+    まとめて送られてきた回答（[(word_id, quality), ...]）を順番に反映する
+    回答した時刻を (word_id, quality, answered_at) で渡せばそれを使う（無ければ now）
+    cards: word_id -> 今の行。同じ単語が何回出てきても順に積み重ねる
+    戻り値: 更新後の行のリスト（1単語1行）
+    """
+    updated = {}
+    for outcome in outcomes:
+        word_id, quality = outcome[0], outcome[1]
+        answered_at = outcome[2] if len(outcome) > 2 and outcome[2] else now
+        card = updated.get(word_id) or cards.get(word_id)
+        if card is None:
+            continue
+        updated[word_id] = {**card, **schedule_review(card, quality, answered_at)}
+    return list(updated.values())
@@ -0,0 +1,145 @@
+"""
+採点結果のキャッシュ
+ScoreCache: ハッシュキー -> 作文の採点結果（SQLiteに保存、件数とTTLで追い出し）
+PerceptualHashIndex: 正解ごとの手書き画像ハッシュ -> 採点結果（プロセス内、見た目がほぼ同じなら使い回す）
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from local_db import SQLiteBackedStore
+
+SCORE_CACHE_DB = os.getenv("SCORE_CACHE_DB", "score_cache.db")
+WRITING_CACHE_TTL = int(os.getenv("WRITING_CACHE_TTL", str(60 * 60 * 24 * 7)))  # 7日間
+WRITING_CACHE_MAX = int(os.getenv("WRITING_CACHE_MAX", "50000"))
+HANDWRITING_HASH_CACHE = os.getenv("HANDWRITING_HASH_CACHE", "1") != "0"  # 0でキャッシュ無効
+HANDWRITING_HASH_DISTANCE = int(os.getenv("HANDWRITING_HASH_DISTANCE", "4"))  # 何ビット差まで「同じ」とみなすか（64ビット中）
+HANDWRITING_HASH_MAX_ANSWERS = int(os.getenv("HANDWRITING_HASH_MAX_ANSWERS", "2000"))  # 覚えておく正解の数
+HANDWRITING_HASH_PER_ANSWER = int(os.getenv("HANDWRITING_HASH_PER_ANSWER", "32"))  # 正解ごとに覚えておく画像の数
+
+
+class ScoreCache(SQLiteBackedStore):
+    """ハッシュキー → 採点結果 のキャッシュ（ディスク永続、件数とTTLで追い出し）"""
+
+    EVICT_EVERY = 200  # 何回書き込むごとに追い出しをするか
+
+    def __init__(self, path: str, table: str, max_entries: int, ttl: int):
+        super().__init__(path)
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                cache_key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_last_access ON {table}(last_access)")
+        conn.commit()
+
+    def get(self, cache_key: str) -> Optional[dict]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            f"SELECT data FROM {self.table} WHERE cache_key = ? AND created_at > ?",
+            (cache_key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+        conn.commit()
+        self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, cache_key: str, data: dict):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (cache_key, data, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (cache_key, json.dumps(data, ensure_ascii=False), now, now),
+        )
+        conn.commit()
+        self.stats["stores"] += 1
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """期限切れと、上限を超えた古い（最近使われてへん）ものを削除"""
+        conn = self._conn()
+        expired = conn.execute(f"DELETE FROM {self.table} WHERE created_at <= ?", (time.time() - self.ttl,)).rowcount
+        overflow = conn.execute(
+            f"""
+            DELETE FROM {self.table} WHERE cache_key IN (
+                SELECT cache_key FROM {self.table} ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        ).rowcount
+        conn.commit()
+        self.stats["evictions"] += expired + overflow
+
+    def snapshot(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0],
+            "hit_rate": round(self.stats["hits"] / total, 3) if total else 0.0,
+        }
+
+
+class PerceptualHashIndex:
+    """正解ごとに (画像ハッシュ, 採点結果) を覚えておく索引（LRUで上限あり）"""
+
+    def __init__(self, max_answers: int, per_answer: int, max_distance: int):
+        self.max_answers = max_answers
+        self.per_answer = per_answer
+        self.max_distance = max_distance
+        self._index = OrderedDict()  # answer_key -> OrderedDict(image_hash -> result)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def lookup(self, answer_key: str, image_hash: int) -> Optional[dict]:
+        with self._lock:
+            entries = self._index.get(answer_key)
+            if entries:
+                self._index.move_to_end(answer_key)
+                for known_hash, result in entries.items():
+                    if (known_hash ^ image_hash).bit_count() <= self.max_distance:
+                        entries.move_to_end(known_hash)
+                        self.stats["hits"] += 1
+                        return result
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, answer_key: str, image_hash: int, result: dict):
+        with self._lock:
+            entries = self._index.setdefault(answer_key, OrderedDict())
+            self._index.move_to_end(answer_key)
+            entries[image_hash] = result
+            entries.move_to_end(image_hash)
+            self.stats["stores"] += 1
+            while len(entries) > self.per_answer:
+                entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            while len(self._index) > self.max_answers:
+                _, dropped = self._index.popitem(last=False)
+                self.stats["evictions"] += len(dropped)
+
+    def snapshot(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "answers": len(self._index),
+            "max_distance": self.max_distance,
+            "hit_rate": round(self.stats["hits"] / total, 3) if total else 0.0,
+        }
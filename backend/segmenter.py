@@ -0,0 +1,206 @@
+"""
+中国語の単語分割（並べ替え問題用）
+辞書は「内蔵の基本語彙 + 全ユーザーが登録した単語」から作る前方一致辞書（単語の途中までも 0 で入れておく）。
+文ごとに「どこからどこまでが辞書の単語か」のDAGを作り、出現頻度の積が最大になる区切り方を動的計画法で選ぶ。
+辞書は最初に分割する時に読み込み（起動は遅くならない）、marshal のキャッシュファイルに保存して次回から一瞬で読む
+"""
+import marshal
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Optional
+
+SEGMENT_DICT_CACHE = os.getenv("SEGMENT_DICT_CACHE", "segment_dict.cache")
+SEGMENT_DICT_TTL = int(os.getenv("SEGMENT_DICT_TTL", "86400"))  # キャッシュを作り直すまでの秒数
+
+CACHE_VERSION = 1
+BASE_FREQ = 3  # 内蔵語彙の重み。ユーザーの単語は登録した人数ぶん足す
+
+# よく使う語（HSK1〜3あたり）。教科書の単語が登録されていない文でもそれなりに区切れるように
+BASE_LEXICON = """
+我们 你们 他们 她们 它们 咱们 自己 大家 什么 怎么 怎么样 为什么 哪里 哪儿 那里 那儿 这里 这儿 这个 那个 哪个
+这些 那些 多少 几个 谁的 时候 现在 今天 明天 昨天 后天 前天 今年 明年 去年 早上 上午 中午 下午 晚上 星期 周末
+小时 分钟 时间 已经 一直 一起 一定 一下 一点儿 一些 一样 有点儿 可以 可能 应该 能够 需要 希望 觉得 认为 知道
+认识 喜欢 感觉 想要 打算 准备 开始 结束 继续 完成 学习 学生 老师 同学 朋友 学校 大学 中学 小学 教室 图书馆
+宿舍 食堂 医院 医生 商店 超市 银行 公司 工作 上班 下班 休息 睡觉 起床 吃饭 喝水 米饭 面条 饺子 水果 苹果
+香蕉 咖啡 牛奶 茶叶 东西 衣服 裤子 鞋子 帽子 手机 电脑 电视 电影 音乐 照片 汉语 中文 日语 英语 汉字 生词
+语法 课文 问题 回答 考试 作业 练习 复习 预习 说话 听说 阅读 写字 帮助 介绍 欢迎 谢谢 不客气 对不起 没关系
+再见 你好 您好 早安 晚安 请问 非常 特别 比较 还是 或者 但是 可是 因为 所以 如果 虽然 而且 然后 只有 只要
+不但 而是 就是 还有 没有 不是 是不是 有没有 要是 以后 以前 之前 之后 的时候 中国 日本 美国 北京 上海 东京
+大阪 京都 国家 城市 地方 房间 家里 爸爸 妈妈 哥哥 姐姐 弟弟 妹妹 孩子 儿子 女儿 丈夫 妻子 先生 小姐 男人
+女人 身体 眼睛 耳朵 头发 高兴 快乐 漂亮 好看 好吃 好喝 容易 困难 重要 简单 清楚 认真 努力 干净 舒服 方便
+便宜 昂贵 天气 下雨 下雪 晴天 阴天 春天 夏天 秋天 冬天 旅游 旅行 飞机 火车 汽车 地铁 公共汽车 出租车 自行车
+机场 车站 飞机场 火车站 左边 右边 前边 后边 上边 下边 里边 外边 旁边 中间 对面 附近 东边 西边 南边 北边
+打电话 发短信 看书 看见 听见 遇见 找到 买东西 做饭 洗澡 跑步 游泳 唱歌 跳舞 运动 比赛 足球 篮球 生日 礼物
+一个 两个 三个 第一 第二 一百 一千 一万 人民币 日元 多长时间 怎么办 没问题 当然 真的 最近 马上 刚才
+""".split()
+
+_HAN_BLOCK = re.compile(r"([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[A-Za-z0-9]+)")
+
+
+class Segmenter:
+    """
+    vocabulary_source(): {単語: 登録数} を返す関数（全ユーザーの words から集める）
+    segment() / segment_many() を最初に呼んだ時に辞書を読み込む
+    辞書は (freq, log_total) の組ごと差し替えるので、分割中のスレッドは読み始めた時の辞書を最後まで使う
+    """
+
+    def __init__(self, cache_path: str, vocabulary_source: Callable[[], dict], ttl: int = SEGMENT_DICT_TTL):
+        self.cache_path = cache_path
+        self.vocabulary_source = vocabulary_source
+        self.ttl = ttl
+        self._state: Optional[tuple] = None  # (前方一致辞書, log(重みの合計))
+        self._total = 0
+        self._lock = threading.Lock()  # 辞書の読み込みと差し替え
+        self._stats_lock = threading.Lock()
+        self.stats = {"load_ms": 0.0, "source": None, "words": 0, "sentences": 0}
+
+    # ---------- 辞書の読み込み ----------
+    def _load_cache(self) -> Optional[tuple]:
+        try:
+            if time.time() - os.path.getmtime(self.cache_path) > self.ttl:
+                return None
+            with open(self.cache_path, "rb") as f:
+                version, freq, total = marshal.load(f)
+            return (freq, total) if version == CACHE_VERSION else None
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+
+    def _save_cache(self, freq: dict, total: int):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                marshal.dump((CACHE_VERSION, freq, total), f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ 分割辞書のキャッシュ保存に失敗: {e}", flush=True)
+
+    @staticmethod
+    def _build(vocabulary: dict) -> tuple:
+        """{単語: 重み} から前方一致辞書を作る（途中までの部分は重み0で入れる）"""
+        weights = {word: BASE_FREQ for word in BASE_LEXICON}
+        for word, count in vocabulary.items():
+            word = (word or "").strip()
+            if word:
+                weights[word] = weights.get(word, 0) + BASE_FREQ + count
+        freq = {}
+        for word, weight in weights.items():
+            freq[word] = freq.get(word, 0) + weight
+            for end in range(1, len(word)):
+                freq.setdefault(word[:end], 0)
+        return freq, sum(weights.values())
+
+    def _ensure_loaded(self) -> tuple:
+        state = self._state
+        if state is not None:
+            return state
+        with self._lock:
+            if self._state is not None:
+                return self._state
+            start = time.perf_counter()
+            cached = self._load_cache()
+            if cached is not None:
+                freq, total = cached
+                self.stats["source"] = "cache"
+            else:
+                try:
+                    vocabulary = self.vocabulary_source()
+                except Exception as e:
+                    print(f"⚠️ 単語の読み込みに失敗（内蔵語彙だけで分割します）: {e}", flush=True)
+                    vocabulary = {}
+                freq, total = self._build(vocabulary)
+                self._save_cache(freq, total)
+                self.stats["source"] = "database"
+            self._total = total
+            self.stats["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            self.stats["words"] = sum(1 for weight in freq.values() if weight)
+            print(f"📖 分割辞書を読み込み: {self.stats['words']}語 ({self.stats['source']}, {self.stats['load_ms']}ms)", flush=True)
+            self._state = (freq, math.log(max(total, 1)))
+            return self._state
+
+    def add_words(self, words: list):
+        """アップロードされた単語をすぐ辞書に足す（キャッシュファイルは古くなるので消す）"""
+        with self._lock:
+            if self._state is not None:
+                freq = dict(self._state[0])
+                total = self._total
+                for word in words:
+                    word = (word or "").strip()
+                    if not word:
+                        continue
+                    if not freq.get(word):
+                        self.stats["words"] += 1
+                    freq[word] = freq.get(word, 0) + BASE_FREQ + 1
+                    total += BASE_FREQ + 1
+                    for end in range(1, len(word)):
+                        freq.setdefault(word[:end], 0)
+                self._total = total
+                self._state = (freq, math.log(max(total, 1)))  # 作り直した辞書と合計を一度に差し替える
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass
+
+    # ---------- 分割 ----------
+    def _cut_han(self, block: str, freq: dict, log_total: float) -> list:
+        """漢字の並び1つをDAG + 動的計画法で区切る"""
+        length = len(block)
+        dag = []
+        for start in range(length):
+            ends = []
+            end = start
+            fragment = block[start]
+            while end < length and fragment in freq:
+                if freq[fragment]:
+                    ends.append(end)
+                end += 1
+                fragment = block[start:end + 1]
+            dag.append(ends or [start])
+
+        route = [(0.0, 0)] * (length + 1)
+        for start in range(length - 1, -1, -1):
+            route[start] = max(
+                (math.log(freq.get(block[start:end + 1]) or 1) - log_total + route[end + 1][0], end)
+                for end in dag[start]
+            )
+
+        tokens = []
+        start = 0
+        while start < length:
+            end = route[start][1] + 1
+            tokens.append(block[start:end])
+            start = end
+        return tokens
+
+    def segment(self, sentence: str, keep_punctuation: bool = False) -> list:
+        """
+        1文を単語のリストにする
+        英数字の並びは1語、空白は捨てる。句読点は keep_punctuation=True の時だけ1つずつ残す
+        """
+        freq, log_total = self._ensure_loaded()
+        tokens = []
+        for block in _HAN_BLOCK.split(sentence or ""):
+            if not block:
+                continue
+            if _HAN_BLOCK.fullmatch(block):
+                tokens.extend(self._cut_han(block, freq, log_total) if not block.isascii() else [block])
+                continue
+            for ch in block:
+                if ch.isspace():
+                    continue
+                if unicodedata.category(ch)[0] in ("P", "S") and not keep_punctuation:
+                    continue
+                tokens.append(ch)
+        with self._stats_lock:
+            self.stats["sentences"] += 1
+        return tokens
+
+    def segment_many(self, sentences: list, keep_punctuation: bool = False) -> list:
+        return [self.segment(sentence, keep_punctuation) for sentence in sentences]
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            return {**self.stats, "loaded": self._state is not None}
@@ -0,0 +1,133 @@
+"""
+並べ替え問題の部分点採点（LLMなし、数マイクロ秒）
+回答の各単語を正解の何番目に当たるかに置き換えて、
+- 最長増加部分列（LIS）: 正しい順番のまま残っている単語の数
+- ケンドールのタウ距離: 入れ替わっている組の数
+から点数を出し、1語ずつ「合ってる / 順番はOK / 場所違い / 余分」を返す
+"""
+from bisect import bisect_left
+from typing import Callable, Optional
+
+
+def align_to_expected(user_order: list, expected_order: list) -> tuple:
+    """
+    回答の各単語 -> 正解での位置（正解に無い単語は None）
+    同じ単語が2回出てくる時は前から順に割り当てる
+    戻り値: (位置のリスト, 使われなかった正解の位置)
+    """
+    slots = {}
+    for index, token in enumerate(expected_order):
+        slots.setdefault(token, []).append(index)
+    used = {token: 0 for token in slots}
+    positions = []
+    for token in user_order:
+        candidates = slots.get(token)
+        if candidates and used[token] < len(candidates):
+            positions.append(candidates[used[token]])
+            used[token] += 1
+        else:
+            positions.append(None)
+    matched = {position for position in positions if position is not None}
+    missing = [index for index in range(len(expected_order)) if index not in matched]
+    return positions, missing
+
+
+def longest_increasing_subsequence(values: list) -> list:
+    """増加部分列のうち一番長いものの「values の添字」を返す（O(n log n)）"""
+    tails = []  # 長さ k+1 の増加列の末尾の値
+    tail_indices = []  # その添字
+    previous = [-1] * len(values)
+    for index, value in enumerate(values):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indices.append(index)
+        else:
+            tails[k] = value
+            tail_indices[k] = index
+        previous[index] = tail_indices[k - 1] if k > 0 else -1
+    result = []
+    index = tail_indices[-1] if tail_indices else -1
+    while index != -1:
+        result.append(index)
+        index = previous[index]
+    return result[::-1]
+
+
+def count_inversions(values: list) -> int:
+    """順番が逆になっている組の数（ケンドールのタウ距離）。マージソートで O(n log n)"""
+    def sort(items: list) -> tuple:
+        if len(items) <= 1:
+            return items, 0
+        middle = len(items) // 2
+        left, left_count = sort(items[:middle])
+        right, right_count = sort(items[middle:])
+        merged = []
+        count = left_count + right_count
+        i = j = 0
+        while i < len(left) and j < len(right):
+            if left[i] <= right[j]:
+                merged.append(left[i])
+                i += 1
+            else:
+                merged.append(right[j])
+                count += len(left) - i
+                j += 1
+        merged.extend(left[i:])
+        merged.extend(right[j:])
+        return merged, count
+
+    return sort(list(values))[1]
+
+
+def score_sorting_answer(user_order: list, expected_order: list,
+                         normalize: Optional[Callable[[str], str]] = None) -> dict:
+    """
+    並べ替えの回答を部分点付きで採点する
+    score = 100 × (LISの割合 と 並び順の一致度 の平均) × (正解の単語を使えた割合)
+    """
+    normalize = normalize or (lambda token: token.strip())
+    user_keys = [normalize(token) for token in user_order]
+    expected_keys = [normalize(token) for token in expected_order]
+    is_correct = user_keys == expected_keys
+
+    positions, missing = align_to_expected(user_keys, expected_keys)
+    matched = [(index, position) for index, position in enumerate(positions) if position is not None]
+    matched_positions = [position for _, position in matched]
+    in_order = {matched[k][0] for k in longest_increasing_subsequence(matched_positions)}
+    inversions = count_inversions(matched_positions)
+    pairs = len(matched_positions) * (len(matched_positions) - 1) // 2
+
+    total = max(len(expected_keys), len(user_keys))
+    if is_correct:
+        score = 100
+    elif total == 0 or not matched:
+        score = 0
+    else:
+        lis_ratio = len(in_order) / len(expected_keys)
+        order_ratio = 1 - inversions / pairs if pairs else 1.0
+        coverage = len(matched) / total
+        score = round(100 * (lis_ratio + order_ratio) / 2 * coverage)
+
+    feedback_positions = []
+    for index, token in enumerate(user_order):
+        position = positions[index]
+        if position is None:
+            status = "extra"  # 正解に無い単語
+        elif position == index:
+            status = "correct"
+        elif index in in_order:
+            status = "in_order"  # 前後の順番は合っているが、場所がずれている
+        else:
+            status = "misplaced"
+        feedback_positions.append({"index": index, "token": token, "status": status, "expected_index": position})
+
+    return {
+        "is_correct": is_correct,
+        "score": score,
+        "lis_length": len(in_order),
+        "kendall_tau_distance": inversions,
+        "kendall_tau": round(1 - 2 * inversions / pairs, 3) if pairs else 1.0,
+        "positions": feedback_positions,
+        "missing": [expected_order[index] for index in missing],
+    }
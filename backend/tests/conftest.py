@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# backend/ のモジュールを `import local_db` のように読めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py は import した時点でDBやキャッシュのファイルを作るので、全部一時ディレクトリに向ける
+MAIN_ENV = {
+    "STORAGE_BACKEND": "memory",
+    "GEMINI_API_KEY": "",
+    "LOCAL_DB_FILE": "local.db",
+    "REVIEW_JOURNAL_FILE": "review_journal.db",
+    "SCORING_RESULT_DB": "scoring_results.db",
+    "SCORE_CACHE_DB": "score_cache.db",
+    "SEGMENT_DICT_CACHE": "segment_dict.cache",
+    "GEMINI_MODELS_CACHE": "gemini_models.json",
+}
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    """一時ディレクトリの中で main を import する（セッション中は使い回し）"""
+    workdir = tmp_path_factory.mktemp("main")
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in MAIN_ENV.items():
+            mp.setenv(name, value)
+        mp.chdir(workdir)
+        import main
+        yield main
+
+
+class FakeModel:
+    """GenerativeModel の代わり。delay 秒かけて、error があれば投げる。blocked なら release されるまで返さない"""
+
+    def __init__(self, name: str, release: threading.Event):
+        self.model_name = name
+        self.reply = f"{name}の応答"
+        self.error = None
+        self.delay = 0.0
+        self.blocked = False
+        self.release = release
+        self.calls = 0
+
+    def generate_content(self, contents):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.blocked:
+            self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(text=self.reply)
+
+
+class FakeGemini:
+    def __init__(self):
+        self.release = threading.Event()
+        self.models = {}
+
+    def get(self, name: str) -> FakeModel:
+        if name not in self.models:
+            self.models[name] = FakeModel(name, self.release)
+        return self.models[name]
+
+
+def wait_until(predicate, timeout: float = 5.0):
+    """別スレッドでの後片付け（枠の返却など）を待つ"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "待ちきれへんかった"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fake_gemini(main_module, monkeypatch):
+    """Geminiを呼ばずに FakeModel を使う（fast: fast-a, fast-b / quality: quality-a）"""
+    from model_router import ModelRouter
+
+    gemini = FakeGemini()
+    monkeypatch.setattr(main_module, "model", gemini.get("fast-a"))
+    monkeypatch.setattr(main_module, "vision_model", gemini.get("fast-a"))
+    monkeypatch.setattr(main_module, "gemini_model", gemini.get)
+    monkeypatch.setattr(main_module, "model_router", ModelRouter(
+        lambda: ["fast-a", "fast-b", "quality-a"],
+        tier_models={"fast": ["fast-a", "fast-b"], "quality": ["quality-a"]},
+        explore_rate=0,
+    ))
+    yield gemini
+    gemini.release.set()
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+@pytest.fixture
+def client(main_module):
+    """起動イベントは動かさない（モデル一覧の更新や復習の定期書き出しはテストでは要らん）"""
+    from fastapi.testclient import TestClient
+
+    return TestClient(main_module.app)
+
+
+@pytest.fixture
+def auth_headers(main_module):
+    """auth_headers("s1") でそのユーザーのトークン付きヘッダー"""
+    from datetime import timedelta
+
+    def headers(student_id: str) -> dict:
+        token = main_module.create_access_token({"sub": student_id}, timedelta(hours=1))
+        return {"Authorization": f"Bearer {token}"}
+    return headers
@@ -0,0 +1,65 @@
+import asyncio
+
+from batching import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_items_are_grouped_by_window_and_size():
+    batches = []
+
+    async def handler(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_size=3, window=0.05)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(7)))
+        return batcher, results
+
+    batcher, results = run(main())
+    assert results == [i * 10 for i in range(7)]
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert batcher.snapshot()["largest"] == 3 and batcher.snapshot()["pending"] == 0
+
+
+def test_exception_in_result_fails_only_that_item():
+    async def handler(items):
+        return [ValueError(item) if item == "bad" else item.upper() for item in items]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_size=10, window=0.01)
+        return await asyncio.gather(*(batcher.submit(item) for item in ("a", "bad", "c")), return_exceptions=True)
+
+    ok_a, error, ok_c = run(main())
+    assert (ok_a, ok_c) == ("A", "C")
+    assert isinstance(error, ValueError)
+
+
+def test_handler_error_fails_the_whole_batch():
+    async def handler(items):
+        raise RuntimeError("gemini down")
+
+    async def main():
+        batcher = MicroBatcher(handler, max_size=10, window=0.01)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_short_result_list_leaves_no_future_hanging():
+    async def handler(items):
+        return items[:1]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_size=10, window=0.01)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True), 1
+        )
+
+    first, second = run(main())
+    assert first == 1
+    assert isinstance(second, RuntimeError)
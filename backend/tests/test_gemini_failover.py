@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+import pytest
+
+
+def call(main_module, task, timeout):
+    return asyncio.run(main_module.call_gemini_for(task, "プロンプト", timeout=timeout))
+
+
+def test_failover_to_the_next_model(main_module, fake_gemini):
+    fake_gemini.get("fast-a").error = RuntimeError("500")
+
+    response = call(main_module, "writing", 5)
+
+    assert response.text == "fast-bの応答"
+    assert main_module.model_router.snapshot()["models"]["fast-a"]["failures"] == 1
+
+
+def test_retries_share_one_deadline(main_module, fake_gemini):
+    fake_gemini.get("fast-a").delay = 1.5
+    fake_gemini.get("fast-a").error = RuntimeError("500")
+    fake_gemini.get("fast-b").blocked = True
+
+    start = time.monotonic()
+    with pytest.raises(Exception, match="タイムアウト"):
+        call(main_module, "writing", 3)
+
+    assert fake_gemini.get("fast-b").calls == 1
+    assert time.monotonic() - start < 3.8  # 取り直しも3秒のうち（1回ごとなら4.5秒）
+
+
+def test_no_retry_when_the_deadline_is_used_up(main_module, fake_gemini):
+    fake_gemini.get("fast-a").blocked = True
+
+    with pytest.raises(Exception, match="タイムアウト"):
+        call(main_module, "writing", 1.2)
+
+    assert fake_gemini.get("fast-b").calls == 0
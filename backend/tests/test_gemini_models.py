@@ -0,0 +1,41 @@
+import json
+import time
+
+from gemini_models import FALLBACK_MODELS, ModelCatalog
+
+
+def test_no_network_until_refresh(tmp_path):
+    calls = []
+    catalog = ModelCatalog(lambda: calls.append(1) or ["gemini-1.5-flash"], str(tmp_path / "models.json"), 60, "")
+    assert catalog.names() == FALLBACK_MODELS and catalog.needs_refresh()
+    assert calls == []
+
+    assert catalog.refresh() == ["gemini-1.5-flash"]
+    assert not catalog.needs_refresh()
+    assert json.loads((tmp_path / "models.json").read_text())["models"] == ["gemini-1.5-flash"]
+
+
+def test_next_start_uses_disk_cache_even_when_stale(tmp_path):
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({"fetched_at": time.time() - 1000, "models": ["gemini-1.5-pro"]}))
+    catalog = ModelCatalog(lambda: [], str(path), 60, "")
+    assert catalog.names() == ["gemini-1.5-pro"]
+    assert catalog.snapshot()["source"] == "cache" and catalog.needs_refresh()
+
+
+def test_failed_refresh_keeps_current_list(tmp_path):
+    def broken():
+        raise ConnectionError("offline")
+
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({"fetched_at": 0, "models": ["gemini-1.5-pro"]}))
+    catalog = ModelCatalog(broken, str(path), 60, "")
+    assert catalog.refresh() == ["gemini-1.5-pro"]
+    assert catalog.snapshot()["failures"] == 1
+
+
+def test_override_skips_discovery(tmp_path):
+    catalog = ModelCatalog(lambda: 1 / 0, str(tmp_path / "models.json"), 60, "gemini-2.0-flash")
+    assert catalog.names() == ["gemini-2.0-flash"]
+    assert not catalog.needs_refresh()
+    assert catalog.refresh() == ["gemini-2.0-flash"]
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import wait_until
+
+
+def test_slot_is_returned_after_a_call(main_module, fake_gemini):
+    response = asyncio.run(main_module.call_gemini(fake_gemini.get("fast-a"), "プロンプト"))
+
+    assert response.text == "fast-aの応答"
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+def test_full_queue_is_rejected_with_503(main_module, fake_gemini, monkeypatch):
+    monkeypatch.setattr(main_module, "GEMINI_MAX_QUEUE", 2)
+    fake_gemini.get("fast-a").blocked = True
+    rejected = main_module.gemini_stats["rejected"]
+
+    async def scenario():
+        running = [asyncio.create_task(main_module.call_gemini(fake_gemini.get("fast-a"), "x")) for _ in range(2)]
+        await asyncio.sleep(0.1)
+        assert main_module.gemini_inflight == 2
+        with pytest.raises(HTTPException) as error:
+            await main_module.call_gemini(fake_gemini.get("fast-a"), "x")
+        fake_gemini.release.set()
+        await asyncio.gather(*running)
+        return error.value
+
+    error = asyncio.run(scenario())
+
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "5"
+    assert main_module.gemini_stats["rejected"] == rejected + 1
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+def test_timeout_keeps_the_slot_until_the_thread_finishes(main_module, fake_gemini):
+    fake_gemini.get("fast-a").blocked = True
+    timeouts = main_module.gemini_stats["timeouts"]
+
+    with pytest.raises(Exception, match="タイムアウト"):
+        asyncio.run(main_module.call_gemini(fake_gemini.get("fast-a"), "x", timeout=0.2))
+
+    assert main_module.gemini_stats["timeouts"] == timeouts + 1
+    assert main_module.gemini_inflight == 1  # スレッドはまだGeminiを待っている
+    fake_gemini.release.set()
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+def test_cancelled_call_returns_the_slot_when_the_thread_finishes(main_module, fake_gemini):
+    fake_gemini.get("fast-a").blocked = True
+
+    async def scenario():
+        task = asyncio.create_task(main_module.call_gemini(fake_gemini.get("fast-a"), "x"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    assert main_module.gemini_inflight == 1
+    fake_gemini.release.set()
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+def test_reserved_slot_is_handed_over_not_taken_twice(main_module, fake_gemini, monkeypatch):
+    monkeypatch.setattr(main_module, "GEMINI_MAX_QUEUE", 1)
+    main_module.acquire_gemini_slot()  # 受付の時に予約（満杯なら503）
+    assert main_module.gemini_inflight == 1
+
+    response = asyncio.run(main_module.call_gemini(fake_gemini.get("fast-a"), "x", slot_reserved=True))
+
+    assert response.text == "fast-aの応答"
+    wait_until(lambda: main_module.gemini_inflight == 0)
+
+
+def test_reserved_slot_is_returned_when_there_is_no_model(main_module):
+    main_module.acquire_gemini_slot()
+
+    with pytest.raises(Exception, match="初期化"):
+        asyncio.run(main_module.call_gemini(None, "x", slot_reserved=True))
+
+    assert main_module.gemini_inflight == 0
+
+
+def test_queued_writing_counts_toward_the_cap_only_at_intake(main_module, monkeypatch):
+    monkeypatch.setattr(main_module, "GEMINI_MAX_QUEUE", 1)
+    main_module.reserve_writing_slots(1)
+    try:
+        with pytest.raises(HTTPException):
+            main_module.acquire_gemini_slot()
+        main_module.acquire_gemini_slot(count_queued=False)  # 受付済みの作文のバッチは通す
+        main_module.release_gemini_slot()
+    finally:
+        main_module.release_writing_slot()
+    assert (main_module.gemini_inflight, main_module.writing_queued) == (0, 0)
+
+
+def test_writing_endpoint_returns_503_when_full(main_module, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(main_module, "GEMINI_MAX_QUEUE", 0)
+
+    response = client.post(
+        "/api/score/writing",
+        json={"text": "我是老师", "question_id": "q1", "expected_answer": "我是学生"},
+        headers=auth_headers("s1"),
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
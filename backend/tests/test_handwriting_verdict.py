@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("- 認識結果: 你\n- 正誤判定: 正解\n- フィードバック: きれいや", True),
+    ("- 認識結果: 尔\n- 正誤判定: 不正解\n- フィードバック: 偏が違う", False),
+    ("**正誤判定**: [不正解]", False),
+    ("正誤判定：【正解】", True),
+    ("認識結果: 你\nよく書けてるで", None),
+    ("", None),
+])
+def test_parse_handwriting_verdict(main_module, text, expected):
+    assert main_module.parse_handwriting_verdict(text) is expected
+
+
+def test_handwriting_result_sets_is_correct_only_with_a_verdict(main_module):
+    assert main_module.handwriting_result("正誤判定: 正解") == {"recognized_text": "正誤判定: 正解", "is_correct": True}
+    assert main_module.handwriting_result("よく書けてるで") == {"recognized_text": "よく書けてるで"}
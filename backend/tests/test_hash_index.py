@@ -0,0 +1,58 @@
+import pytest
+
+from score_cache import PerceptualHashIndex
+
+
+@pytest.fixture
+def index():
+    return PerceptualHashIndex(max_answers=2, per_answer=2, max_distance=4)
+
+
+def test_near_duplicate_image_hits(index):
+    index.store("你", 0b1111_0000, {"is_correct": True})
+
+    assert index.lookup("你", 0b1111_0011) == {"is_correct": True}  # 2ビット差
+
+
+def test_distant_image_misses(index):
+    index.store("你", 0, {"is_correct": True})
+
+    assert index.lookup("你", 0b1_1111) is None  # 5ビット差
+
+
+def test_results_are_per_answer(index):
+    index.store("你", 0, {"is_correct": True})
+
+    assert index.lookup("好", 0) is None
+
+
+def test_per_answer_limit_drops_oldest_image(index):
+    index.store("你", 0, {"n": 1})
+    index.store("你", 0xFF00, {"n": 2})
+    index.store("你", 0xFF0000, {"n": 3})
+
+    assert index.lookup("你", 0) is None
+    assert index.lookup("你", 0xFF0000) == {"n": 3}
+    assert index.snapshot()["evictions"] == 1
+
+
+def test_answer_limit_drops_least_recently_used_answer(index):
+    index.store("你", 0, {"answer": "你"})
+    index.store("好", 0, {"answer": "好"})
+    index.lookup("你", 0)  # 你 を最近使ったことにする
+    index.store("学", 0, {"answer": "学"})
+
+    assert index.lookup("好", 0) is None
+    assert index.lookup("你", 0) == {"answer": "你"}
+    assert index.snapshot()["answers"] == 2
+
+
+def test_snapshot_counts_hits_and_misses(index):
+    index.store("你", 0, {"is_correct": True})
+    index.lookup("你", 0)
+    index.lookup("好", 0)
+
+    snapshot = index.snapshot()
+
+    assert (snapshot["hits"], snapshot["misses"], snapshot["stores"]) == (1, 1, 1)
+    assert snapshot["hit_rate"] == 0.5
@@ -0,0 +1,55 @@
+import json
+import threading
+
+from local_db import LocalDB
+
+
+def write_json(path, rows):
+    path.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+
+
+def test_migrate_from_json_imports_once(tmp_path):
+    words = tmp_path / "database.json"
+    grammar = tmp_path / "grammar.json"
+    users = tmp_path / "users.json"
+    write_json(words, [{"user_id": "a", "lesson": "1", "word": "你好"}, {"user_id": "a", "lesson": 2, "word": "谢谢"}])
+    write_json(grammar, [{"user_id": "a", "lesson": 1, "title": "是構文"}])
+    write_json(users, [{"student_id": "a", "password_hash": ""}])
+
+    db = LocalDB(str(tmp_path / "local.db"))
+    db.migrate_from_json(str(words), str(grammar), str(users))
+    db.migrate_from_json(str(words), str(grammar), str(users))
+
+    conn = db._conn()
+    assert conn.execute("SELECT COUNT(*) FROM words").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM grammar").fetchone()[0] == 1
+    assert conn.execute("SELECT lesson FROM words WHERE word = '你好'").fetchone()[0] == 1
+    assert not words.exists() and (tmp_path / "database.json.migrated").exists()
+
+
+def test_concurrent_workers_migrate_once(tmp_path):
+    words = tmp_path / "database.json"
+    write_json(words, [{"user_id": "a", "lesson": 1, "word": f"w{i}"} for i in range(500)])
+    missing = str(tmp_path / "none.json")
+    path = str(tmp_path / "local.db")
+    LocalDB(path)  # テーブル作成は先に済ませておく（起動時と同じ）
+
+    workers = [LocalDB(path) for _ in range(4)]
+    barrier = threading.Barrier(len(workers))
+    errors = []
+
+    def run(db):
+        barrier.wait()
+        try:
+            db.migrate_from_json(str(words), missing, missing)
+        except Exception as e:  # 負けた側が FileNotFoundError で落ちないこと
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(db,)) for db in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert workers[0]._conn().execute("SELECT COUNT(*) FROM words").fetchone()[0] == 500
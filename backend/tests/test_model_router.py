@@ -0,0 +1,79 @@
+from model_router import ModelRouter, parse_task_tiers
+
+CATALOG = [
+    "gemini-2.0-flash-exp", "gemini-1.5-flash", "gemini-2.5-flash-preview-tts", "gemini-2.0-flash-exp-image-generation",
+    "gemini-1.5-pro", "gemini-2.5-pro-preview", "gemini-pro-vision", "text-embedding-004",
+]
+
+
+def make(**kwargs):
+    kwargs.setdefault("explore_rate", 0)
+    return ModelRouter(lambda: list(CATALOG), **kwargs)
+
+
+def test_tiers_pick_text_models_stable_first():
+    router = make()
+    assert router.models_for_tier("fast") == ["gemini-1.5-flash", "gemini-2.0-flash-exp"]
+    assert router.models_for_tier("quality") == ["gemini-1.5-pro", "gemini-2.5-pro-preview"]
+    assert ModelRouter(lambda: ["gemini-pro"]).models_for_tier("fast") == ["gemini-pro"]
+
+
+def test_task_tiers_and_explicit_models():
+    assert parse_task_tiers("writing=quality, bogus=fast, handwriting=slow")["writing"] == "quality"
+    assert parse_task_tiers("handwriting=slow")["handwriting"] == "fast"
+
+    router = make(tier_models={"fast": ["m-fast"], "quality": ["m-good"]})
+    assert router.candidates("handwriting") == ["m-fast", "m-good"]
+    assert router.candidates("textbook-word") == ["m-good", "m-fast"]
+    assert router.cache_name("writing") == "m-fast"
+
+
+def test_unmeasured_models_keep_catalog_order_after_measured_ones():
+    router = make()
+    assert router.candidates("handwriting")[:2] == ["gemini-1.5-flash", "gemini-2.0-flash-exp"]
+
+    router.record_success("gemini-2.0-flash-exp", 0.4)
+    assert router.candidates("handwriting")[:2] == ["gemini-2.0-flash-exp", "gemini-1.5-flash"]
+
+    router.record_success("gemini-1.5-flash", 0.2)
+    assert router.candidates("handwriting")[:2] == ["gemini-1.5-flash", "gemini-2.0-flash-exp"]
+
+
+def test_failed_model_is_moved_back_and_recovers():
+    router = make(tier_models={"fast": ["a", "b", "c"], "quality": ["q"]}, cooldown=60)
+    router.record_success("a", 0.1)
+    router.record_failure("a")
+    router.record_failure("b")
+    assert router.candidates("writing") == ["c", "a", "b", "q"]
+
+    router.cooldown = 0
+    router.record_failure("b")
+    # 後回しが終わっても、失敗しかしていないモデルはまだ使っていないモデルより後ろ
+    router._health["a"]["down_until"] = 0.0
+    assert router.candidates("writing") == ["a", "c", "b", "q"]
+
+
+def test_latency_is_an_ewma():
+    router = make(tier_models={"fast": ["a"], "quality": ["q"]})
+    router.record_success("a", 1.0)
+    router.record_success("a", 2.0)
+    assert router.snapshot()["models"]["a"]["latency_ms"] == 1200.0
+
+
+def test_exploration_occasionally_tries_an_unmeasured_model_first():
+    draws = iter([0.5, 0.01])
+    router = make(tier_models={"fast": ["a", "b", "c"], "quality": ["q"]}, explore_rate=0.1, rng=lambda: next(draws))
+    router.record_success("a", 0.5)
+
+    assert router.candidates("writing") == ["a", "b", "c", "q"]
+    assert router.candidates("writing") == ["b", "a", "c", "q"]  # 10%未満を引いた回だけ b を測る
+    assert router.snapshot()["explorations"] == 1
+
+
+def test_exploration_stops_once_everything_is_measured():
+    router = make(tier_models={"fast": ["a", "b"], "quality": ["q"]}, explore_rate=1.0)
+    router.record_success("a", 0.5)
+    router.record_success("b", 0.1)
+    router.record_success("q", 0.1)
+
+    assert router.candidates("writing") == ["b", "a", "q"]
@@ -0,0 +1,92 @@
+import pytest
+
+import prescore
+
+
+@pytest.fixture(autouse=True)
+def enable_prescore(monkeypatch):
+    monkeypatch.setattr(prescore, "LOCAL_PRESCORE", True)
+
+
+def test_normalize_answer_removes_punctuation_width_and_case():
+    assert prescore.normalize_answer("我是学生。") == "我是学生"
+    assert prescore.normalize_answer("ＨＥＬＬＯ， world!", "english") == "hello world"
+    assert prescore.normalize_answer(None) == ""
+
+
+def test_normalize_answer_simplifies_traditional_characters():
+    assert prescore.normalize_answer("我們是學生") == prescore.normalize_answer("我们是学生")
+
+
+def test_normalize_answer_unifies_pinyin_tone_notation():
+    assert prescore.normalize_answer("nǐ hǎo") == prescore.normalize_answer("ni3 hao3")
+    assert prescore.normalize_answer("lǜ") == prescore.normalize_answer("lv4") == prescore.normalize_answer("lü4")
+    assert prescore.normalize_answer("ma5") == prescore.normalize_answer("ma")
+    assert prescore.normalize_answer("liu2") == prescore.normalize_answer("liú")
+
+
+@pytest.mark.parametrize("answer, expected, language", [
+    ("mǎi", "mài", "chinese"),  # 声調の間違い
+    ("ni3", "ni2", "chinese"),
+    ("hao", "hǎo", "chinese"),  # 声調なしは声調ありと同じにしない
+    ("我有3个苹果", "我有5个苹果", "chinese"),
+    ("I have 3 apples", "I have 5 apples", "english"),
+    ("schön", "schon", "german"),
+    ("sí", "si", "spanish"),
+    ("a part", "apart", "english"),
+    ("it's", "its", "english"),
+])
+def test_normalize_answer_keeps_meaningful_differences(answer, expected, language):
+    assert prescore.normalize_answer(answer, language) != prescore.normalize_answer(expected, language)
+
+
+def test_other_languages_keep_cjk_and_tone_folding_off():
+    assert prescore.normalize_answer("ni3", "english") == "ni3"
+    assert prescore.normalize_answer("¿Cómo estás?", "spanish") == prescore.normalize_answer("cómo  estás", "spanish")
+
+
+def test_exact_match_is_scored_locally():
+    result = prescore.prescore_writing("我是学生", "我是学生")
+
+    assert result["is_correct"] is True
+    assert result["scored_by"] == "exact_match_prescorer"
+
+
+def test_notation_difference_is_scored_locally():
+    result = prescore.prescore_writing("我們是學生！", "我们是学生")
+
+    assert result["is_correct"] is True
+    assert result["scored_by"] == "normalized_match_prescorer"
+    assert result["suggestions"] == ["模範解答の表記: 我们是学生"]
+
+
+def test_tone_error_is_not_scored_locally():
+    assert prescore.prescore_writing("wǒ mǎi", "wǒ mài") is None
+    assert prescore.prescore_writing("I have 3 apples", "I have 5 apples.", "english") is None
+
+
+def test_notation_difference_in_other_languages_is_scored_locally():
+    result = prescore.prescore_writing("¿Dónde está el baño?", "dónde está el baño", "spanish")
+
+    assert result["scored_by"] == "normalized_match_prescorer"
+
+
+def test_different_answer_goes_to_gemini():
+    assert prescore.prescore_writing("我是老师", "我是学生") is None
+    assert prescore.prescore_writing("我是学生", None) is None
+    assert prescore.prescore_writing("。", "！") is None  # 句読点だけの回答は正解にしない
+
+
+def test_blank_canvas_is_scored_locally():
+    result = prescore.prescore_handwriting({"blank": True}, "你")
+
+    assert result["is_correct"] is False
+    assert result["scored_by"] == "blank_canvas_prescorer"
+    assert prescore.prescore_handwriting({"blank": False}, "你") is None
+
+
+def test_prescore_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(prescore, "LOCAL_PRESCORE", False)
+
+    assert prescore.prescore_writing("我是学生", "我是学生") is None
+    assert prescore.prescore_handwriting({"blank": True}, "你") is None
@@ -0,0 +1,47 @@
+from questions import QuestionCache, build_questions, example_pairs, shuffled_for_session
+
+
+def test_example_pairs_split_numbered_lines():
+    item = {"example_cn": "A 単純方向補語\n1. 他回来了。\n2. 我上去。", "example_jp": "1. 彼は戻ってきた。\n2. 私は上がる。"}
+    assert example_pairs(item) == [("他回来了。", "彼は戻ってきた。"), ("我上去。", "私は上がる。")]
+    assert example_pairs({"example_cn": "我是学生。", "example_jp": ""}) == [("我是学生。", "")]
+    assert example_pairs({}) == []
+
+
+def test_build_questions():
+    words = [{"id": 1, "lesson": 1, "word": "你好", "pinyin": "nǐ hǎo", "meaning": "こんにちは"}, {"id": 2, "word": " "}]
+    grammar = [{"id": 7, "lesson": 1, "example_cn": "我是学生", "example_jp": "私は学生です"},
+               {"id": 8, "lesson": 1, "example_cn": "好", "example_jp": ""}]
+    questions = build_questions(words, grammar, lambda text: ["我", "是", "学生"] if len(text) > 1 else [text])
+
+    by_id = {question["id"]: question for question in questions}
+    assert set(by_id) == {"handwriting-1", "sorting-7-0", "writing-7-0"}
+    assert by_id["handwriting-1"]["expected_answer"] == "你好"
+    assert by_id["sorting-7-0"]["expected_order"] == ["我", "是", "学生"]
+    assert by_id["writing-7-0"]["expected_answer"] == "我是学生"
+
+
+def test_shuffle_does_not_touch_cached_question():
+    question = {"type": "sorting", "words": list("abcdefgh"), "expected_order": list("abcdefgh")}
+    shuffled = shuffled_for_session(question)
+    assert sorted(shuffled["words"]) == question["words"] == list("abcdefgh")
+
+
+def test_question_cache_rebuilds_on_fingerprint_change_and_invalidate():
+    cache = QuestionCache(max_entries=2)
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return [len(builds)]
+
+    assert cache.get("a", 1, (3, 1), builder) == [1]
+    assert cache.get("a", 1, (3, 1), builder) == [1]
+    assert cache.get("a", 1, (4, 1), builder) == [2]  # 別のワーカーで単語が増えた
+    cache.invalidate("a", 1)
+    assert cache.get("a", 1, (4, 1), builder) == [3]
+    assert cache.snapshot()["hits"] == 1
+
+    cache.get("b", 1, None, builder)
+    cache.get("c", 1, None, builder)
+    assert cache.snapshot()["entries"] == 2
@@ -0,0 +1,256 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from local_db import LocalDB
+from repositories import MemoryUserRepo, MemoryWordRepo, create_repositories, repo_stats_snapshot
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repos(request, tmp_path):
+    return create_repositories(request.param, local_db=LocalDB(str(tmp_path / "local.db")))
+
+
+def test_words_and_grammar_round_trip(repos):
+    repos.words.insert_many("a", 1, [{"word": "你好", "pinyin": "nǐ hǎo", "meaning": "こんにちは"}])
+    repos.words.insert_many("b", 1, [{"word": "谢谢"}])
+    repos.grammar.insert_many("a", 2, [{"title": "是構文", "example_cn": "我是学生"}])
+
+    words = repos.words.list("a")
+    assert [(word["word"], word["lesson"]) for word in words] == [("你好", 1)]
+    assert repos.words.list("a", 2) == []
+    assert [item["title"] for item in repos.grammar.list("a", 2)] == ["是構文"]
+    assert asyncio.run(repos.words.alist("b"))[0]["word"] == "谢谢"
+
+
+def test_users_crud(repos):
+    repos.users.insert({"student_id": "a", "password_hash": "", "is_admin": True})
+    repos.users.update("a", {"language": "english"})
+    user = repos.users.get("a")
+    assert user["is_admin"] and user["language"] == "english"
+    assert repos.users.count() == 1
+    repos.users.delete("a")
+    assert repos.users.get("a") is None
+
+
+class BrokenUserRepo(MemoryUserRepo):
+    backend = "broken"
+
+    def _get(self, student_id):
+        raise ConnectionError("supabase down")
+
+
+def test_errors_fall_back_and_are_counted():
+    fallback = MemoryUserRepo()
+    fallback.insert({"student_id": "a"})
+    repo = BrokenUserRepo(fallback=fallback)
+
+    assert repo.get("a")["student_id"] == "a"
+    assert repo_stats_snapshot()["broken.users.get"]["fallbacks"] >= 1
+    with pytest.raises(ConnectionError):
+        BrokenUserRepo().get("a")
+
+
+def test_save_changed_writes_only_dirty_users(repos):
+    first = repos.users.save_changed([{"student_id": "a"}, {"student_id": "b", "is_admin": True}])
+    assert first == {"created": 2, "updated": 0, "unchanged": 0}
+
+    second = repos.users.save_changed([
+        {"student_id": "a"},
+        {"student_id": "b", "is_admin": False},
+        {"student_id": "c"},
+        {"student_id": "c", "language": "english"},  # 同じIDは後勝ち
+    ])
+    assert second == {"created": 1, "updated": 1, "unchanged": 1}
+    assert not repos.users.get("b")["is_admin"]
+    assert repos.users.get("c")["language"] == "english"
+
+
+def test_lesson_index_counts_words_and_grammar(repos):
+    repos.words.insert_many("a", 1, [{"word": "你好"}, {"word": "谢谢"}])
+    repos.words.insert_many("a", 3, [{"word": "学生"}])
+    repos.grammar.insert_many("a", 3, [{"title": "是構文"}])
+    repos.words.insert_many("b", 9, [{"word": "老师"}])
+
+    assert repos.lessons.list("a") == [
+        {"lesson": 1, "word_count": 2, "grammar_count": 0},
+        {"lesson": 3, "word_count": 1, "grammar_count": 1},
+    ]
+
+
+def test_query_filters_projects_and_pages(repos):
+    repos.words.insert_many("a", 1, [{"word": f"w{i}"} for i in range(5)])
+    repos.words.insert_many("a", 2, [{"word": "x"}])
+    repos.words.insert_many("a", 3, [{"word": "y"}])
+
+    page = repos.words.query("a", [1, 3], ["id", "word"], None, 4)
+    assert [set(row) for row in page] == [{"id", "word"}] * 4
+    rest = repos.words.query("a", [1, 3], ["id", "word"], page[-1]["id"], 10)
+    assert [row["word"] for row in page + rest] == ["w0", "w1", "w2", "w3", "w4", "y"]
+
+    sample = repos.words.sample("a", 3, [1], ["word"])
+    assert len(sample) == 3 and {row["word"] for row in sample} <= {f"w{i}" for i in range(5)}
+    assert len(repos.words.sample("a", 50)) == 7
+
+
+def test_due_returns_overdue_first_then_new_words(repos):
+    repos.words.insert_many("a", 1, [{"word": "old"}, {"word": "later"}, {"word": "new"}, {"word": "older"}])
+    ids = {row["word"]: row["id"] for row in repos.words.list("a")}
+    repos.words.update_review_states("a", [
+        {"id": ids["old"], "ease": 2.5, "interval_days": 1, "reps": 1, "next_due": "2024-04-02T00:00:00",
+         "last_reviewed": "2024-04-01T00:00:00", "correct_count": 1, "miss_count": 0},
+        {"id": ids["older"], "ease": 2.5, "interval_days": 1, "reps": 1, "next_due": "2024-04-01T00:00:00",
+         "last_reviewed": "2024-03-31T00:00:00", "correct_count": 1, "miss_count": 0},
+        {"id": ids["later"], "ease": 2.5, "interval_days": 6, "reps": 2, "next_due": "2024-05-01T00:00:00",
+         "last_reviewed": "2024-04-01T00:00:00", "correct_count": 2, "miss_count": 0},
+    ])
+
+    now = "2024-04-10T00:00:00"
+    assert [row["word"] for row in repos.words.due("a", now, 10)] == ["older", "old", "new"]
+    assert [row["word"] for row in repos.words.due("a", now, 10, None, False)] == ["older", "old"]
+    assert [row["word"] for row in repos.words.due("a", now, 1)] == ["older"]
+    assert repos.words.get_by_ids("b", [ids["old"]]) == []
+
+
+def test_vocabulary_counts_words_across_users(repos):
+    repos.words.insert_many("a", 1, [{"word": "你好"}, {"word": "谢谢"}])
+    repos.words.insert_many("b", 4, [{"word": "你好"}])
+    assert repos.words.vocabulary() == {"你好": 2, "谢谢": 1}
+
+
+class BrokenWordRepo(MemoryWordRepo):
+    backend = "broken"
+
+    def _get_by_ids(self, user_id, word_ids):
+        raise ConnectionError("supabase down")
+
+    def _update_review_states(self, user_id, rows):
+        raise ConnectionError("supabase down")
+
+    def _vocabulary(self):
+        raise ConnectionError("supabase down")
+
+
+def test_review_state_errors_do_not_fall_back():
+    fallback = MemoryWordRepo()
+    fallback.insert_many("a", 1, [{"word": "你好"}])
+    repo = BrokenWordRepo(fallback=fallback)
+
+    with pytest.raises(ConnectionError):
+        repo.get_by_ids("a", [1])
+    with pytest.raises(ConnectionError):
+        repo.update_review_states("a", [])
+    assert repo.vocabulary() == {"你好": 1}  # ほかの操作は今まで通りフォールバック
+
+
+class FakeSupabase:
+    """words / grammar / lesson_index と2つのRPCだけ真似する。failing に入れたRPCは落ちる"""
+
+    def __init__(self):
+        self.tables = {"words": [], "grammar": [], "lesson_index": {}}
+        self.failing = set()
+        self.down = False
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeQuery(self, name, rpc=params)
+
+    def run_rpc(self, name, params):
+        if self.down or name in self.failing:
+            raise ConnectionError(f"{name} failed")
+        key = (params["p_user_id"], params["p_lesson"])
+        entry = self.tables["lesson_index"].setdefault(
+            key, {"lesson": key[1], "word_count": 0, "grammar_count": 0}
+        )
+        if name == "bump_lesson_index":
+            entry["word_count"] += params["p_words"]
+            entry["grammar_count"] += params["p_grammar"]
+        else:
+            for table, column in (("words", "word_count"), ("grammar", "grammar_count")):
+                entry[column] = sum(1 for row in self.tables[table] if (row["user_id"], row["lesson"]) == key)
+
+
+class FakeQuery:
+    def __init__(self, client, name, rpc=None):
+        self.client, self.name, self.rpc_params = client, name, rpc
+        self.rows, self.filters = None, {}
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def order(self, column):
+        return self
+
+    def execute(self):
+        if self.client.down:
+            raise ConnectionError("supabase down")
+        if self.rpc_params is not None:
+            self.client.run_rpc(self.name, self.rpc_params)
+            return SimpleNamespace(data=None)
+        if self.rows is not None:
+            self.client.tables[self.name].extend(self.rows)
+            return SimpleNamespace(data=self.rows)
+        index = self.client.tables["lesson_index"]
+        data = [dict(index[key]) for key in sorted(index) if key[0] == self.filters["user_id"]]
+        return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def supabase(tmp_path):
+    client = FakeSupabase()
+    return client, create_repositories("supabase", supabase_client=client, local_db=LocalDB(str(tmp_path / "local.db")))
+
+
+def test_supabase_lesson_index_is_bumped_on_insert(supabase):
+    client, repos = supabase
+    repos.words.insert_many("a", 1, [{"word": "你好"}, {"word": "谢谢"}])
+    repos.grammar.insert_many("a", 1, [{"title": "是構文"}])
+
+    assert repos.lessons.list("a") == [{"lesson": 1, "word_count": 2, "grammar_count": 1}]
+
+
+def test_failed_bump_is_repaired_by_recounting(supabase):
+    client, repos = supabase
+    repos.words.insert_many("a", 1, [{"word": "你好"}])
+    client.failing.add("bump_lesson_index")
+
+    repos.words.insert_many("a", 1, [{"word": "谢谢"}, {"word": "学生"}])
+
+    assert repos.lessons.list("a") == [{"lesson": 1, "word_count": 3, "grammar_count": 0}]
+    assert len(client.tables["words"]) == 3
+    assert repos.words.fallback.list("a") == []  # 保存済みの行をSQLiteに二重に入れたりせえへん
+
+
+def test_failed_recount_is_retried_on_the_next_read(supabase):
+    client, repos = supabase
+    client.failing.update({"bump_lesson_index", "recount_lesson_index"})
+    repos.grammar.insert_many("a", 2, [{"title": "是構文"}])
+    assert repos.lessons.list("a") == []
+
+    client.failing.clear()
+
+    assert repos.lessons.list("a") == [{"lesson": 2, "word_count": 0, "grammar_count": 1}]
+    assert repos.lessons._stale == set()
+
+
+def test_lesson_index_falls_back_with_the_items(supabase):
+    client, repos = supabase
+    repos.words.insert_many("a", 1, [{"word": "你好"}])
+    client.down = True
+
+    repos.words.insert_many("a", 2, [{"word": "谢谢"}])  # SQLiteに入る
+
+    # 落ちてる間は単語もSQLiteから読むので、件数もSQLiteに入った分と合う
+    assert [row["word"] for row in repos.words.list("a")] == ["谢谢"]
+    assert repos.lessons.list("a") == [{"lesson": 2, "word_count": 1, "grammar_count": 0}]
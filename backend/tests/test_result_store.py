@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from result_store import MemoryResultStore, SQLiteResultStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryResultStore(max_entries=3, ttl=60)
+    return SQLiteResultStore(str(tmp_path / "results.db"), max_entries=3, ttl=60)
+
+
+def test_put_and_get(store):
+    store.put("writing_q1_a", {"status": "completed", "user_id": "u1", "score": 80})
+
+    assert store.get("writing_q1_a") == {"status": "completed", "user_id": "u1", "score": 80}
+    assert store.get("missing") is None
+    assert len(store) == 1
+
+
+def test_put_overwrites(store):
+    store.put("t", {"status": "processing", "user_id": "u1"})
+    store.put("t", {"status": "completed", "user_id": "u1"})
+
+    assert store.get("t")["status"] == "completed"
+    assert len(store) == 1
+
+
+def test_expired_results_are_not_returned(store):
+    store.ttl = -1
+    store.put("t", {"status": "completed", "user_id": "u1"})
+
+    assert store.get("t") is None
+
+
+def test_memory_store_drops_least_recently_used():
+    store = MemoryResultStore(max_entries=2, ttl=60)
+    store.put("a", {"n": 1})
+    store.put("b", {"n": 2})
+    store.get("a")  # a を最近使ったことにする
+    store.put("c", {"n": 3})
+
+    assert store.get("b") is None
+    assert store.get("a") == {"n": 1}
+    assert store.get("c") == {"n": 3}
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "results.db")
+    writer = SQLiteResultStore(path, max_entries=10, ttl=60)
+    reader = SQLiteResultStore(path, max_entries=10, ttl=60)
+
+    writer.put("t", {"status": "completed", "user_id": "u1"})
+
+    assert reader.get("t") == {"status": "completed", "user_id": "u1"}
+
+
+def test_sqlite_updated_since_returns_only_that_users_newer_results(tmp_path):
+    store = SQLiteResultStore(str(tmp_path / "results.db"), max_entries=10, ttl=60)
+    store.put("old", {"status": "completed", "user_id": "u1", "n": 1})
+    since = time.time()
+    time.sleep(0.01)
+    store.put("new", {"status": "completed", "user_id": "u1", "n": 2})
+    store.put("other", {"status": "completed", "user_id": "u2"})
+
+    updated = store.updated_since("u1", since)
+
+    assert [data["n"] for data, _ in updated] == [2]
+
+
+def test_sqlite_purge_keeps_newest_entries(tmp_path):
+    store = SQLiteResultStore(str(tmp_path / "results.db"), max_entries=2, ttl=60)
+    for name in ("a", "b", "c"):
+        store.put(name, {"name": name})
+        time.sleep(0.01)
+
+    store.purge()
+
+    assert len(store) == 2
+    assert store.get("a") is None
+    assert store.get("c") == {"name": "c"}
+
+
+def test_new_task_id_is_unique(main_module):
+    first = main_module.new_task_id("writing", "q1")
+    second = main_module.new_task_id("writing", "q1")
+
+    assert first.startswith("writing_q1_")
+    assert first != second
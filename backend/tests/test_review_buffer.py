@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from repositories import MemoryWordRepo
+from review_buffer import ReviewWriteBuffer
+
+AT = "2024-04-01T09:00:00"
+
+
+class Writer:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, user_id, outcomes):
+        if user_id in self.failing:
+            raise RuntimeError("db down")
+        self.calls.append((user_id, list(outcomes)))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal.db")
+
+
+def test_flush_groups_outcomes_per_user(path):
+    writer = Writer()
+    buffer = ReviewWriteBuffer(path, writer)
+    assert buffer.append("a", [(1, 5, AT), (2, 1, AT)]) == 2
+    assert buffer.append("b", [(3, 4, AT)]) == 3
+
+    result = buffer.flush()
+    assert result == {"users": 2, "outcomes": 3, "failed": 0}
+    assert sorted(writer.calls) == [("a", [(1, 5, AT), (2, 1, AT)]), ("b", [(3, 4, AT)])]
+    assert buffer.pending() == 0
+
+
+def test_failed_user_is_retried_on_next_flush(path):
+    writer = Writer(failing={"b"})
+    buffer = ReviewWriteBuffer(path, writer)
+    buffer.append("a", [(1, 5, AT)])
+    buffer.append("b", [(2, 5, AT)])
+
+    assert buffer.flush()["failed"] == 1
+    assert buffer.pending() == 1 and buffer.has_pending("b") and not buffer.has_pending("a")
+
+    writer.failing.clear()
+    assert buffer.flush() == {"users": 1, "outcomes": 1, "failed": 0}
+    assert writer.calls[-1] == ("b", [(2, 5, AT)])
+
+
+def test_single_user_flush_keeps_other_users_count(path):
+    buffer = ReviewWriteBuffer(path, Writer())
+    buffer.append("a", [(1, 5, AT)] * 3)
+    buffer.append("b", [(2, 5, AT)] * 4)
+
+    buffer.flush("a")
+    # b の4件はまだ書いていないので、件数での書き出し判定に残る
+    assert buffer.append("b", [(2, 5, AT)]) == 5
+
+
+def test_failed_flush_keeps_count(path):
+    buffer = ReviewWriteBuffer(path, Writer(failing={"a"}))
+    buffer.append("a", [(1, 5, AT)] * 3)
+    buffer.flush()
+    assert buffer.append("a", [(1, 5, AT)]) == 4
+
+
+def test_journal_survives_restart(path):
+    ReviewWriteBuffer(path, Writer()).append("a", [(1, 5, AT)])
+
+    writer = Writer()
+    assert ReviewWriteBuffer(path, writer).flush()["outcomes"] == 1
+    assert writer.calls == [("a", [(1, 5, AT)])]
+
+
+def test_claimed_rows_are_not_flushed_twice(path):
+    buffer = ReviewWriteBuffer(path, Writer())
+    buffer.append("a", [(1, 5, AT)])
+    token, rows = buffer._claim(None)  # 別のワーカーが書いている途中
+    assert len(rows) == 1
+    assert buffer.flush()["outcomes"] == 0
+
+    # 取ったワーカーが落ちたら CLAIM_TIMEOUT 後に取り直せる
+    conn = buffer._conn()
+    with conn:
+        conn.execute("UPDATE review_journal SET claimed_at = ?", (time.time() - buffer.CLAIM_TIMEOUT - 1,))
+    assert buffer.flush()["outcomes"] == 1
+
+
+class UnreachableWordRepo(MemoryWordRepo):
+    backend = "unreachable"
+
+    def _get_by_ids(self, user_id, word_ids):
+        raise ConnectionError("supabase down")
+
+
+def test_primary_store_failure_keeps_outcomes_in_journal(main_module, monkeypatch, path):
+    local = MemoryWordRepo()
+    local.insert_many("a", 1, [{"word": "你好"}])
+    monkeypatch.setattr(main_module, "words_repo", UnreachableWordRepo(fallback=local))
+    buffer = ReviewWriteBuffer(path, main_module.write_review_outcomes)
+    buffer.append("a", [(1, 5, AT)])
+
+    assert buffer.flush()["failed"] == 1
+    assert buffer.pending() == 1
+    assert local.list("a")[0].get("reps") is None  # ローカルにも書いてへん
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from scheduler import (
+    DEFAULT_EASE, MIN_EASE, apply_reviews, format_due, outcome_quality, parse_due, schedule_review,
+)
+
+NOW = datetime(2024, 4, 1, 9, 0, 0)
+
+
+def test_intervals_follow_sm2():
+    card = {"id": 1}
+    intervals = []
+    for _ in range(4):
+        card = {**card, **schedule_review(card, 5, NOW)}
+        intervals.append(card["interval_days"])
+    # 1日 → 6日 → 前回 × ease
+    assert intervals[:2] == [1, 6]
+    assert intervals[2] == round(6 * 2.7)
+    assert card["reps"] == 4
+    assert card["correct_count"] == 4
+
+
+def test_ease_changes_with_quality():
+    assert schedule_review({}, 5, NOW)["ease"] == pytest.approx(DEFAULT_EASE + 0.1)
+    assert schedule_review({}, 4, NOW)["ease"] == pytest.approx(DEFAULT_EASE)
+    assert schedule_review({}, 3, NOW)["ease"] == pytest.approx(DEFAULT_EASE - 0.14)
+    assert schedule_review({"ease": MIN_EASE}, 0, NOW)["ease"] == MIN_EASE
+
+
+def test_failure_resets_repetitions():
+    card = {"ease": 2.5, "reps": 3, "interval_days": 15, "miss_count": 2}
+    result = schedule_review(card, 2, NOW)
+    assert result["reps"] == 0
+    assert result["interval_days"] == 1
+    assert result["miss_count"] == 3
+    assert result["next_due"] == "2024-04-02T09:00:00"
+
+
+def test_outcome_quality():
+    assert outcome_quality(7, None) == 5
+    assert outcome_quality(-1, True) == 0
+    assert outcome_quality(None, True) == 4
+    assert outcome_quality(None, False) == 1
+
+
+def test_due_round_trip():
+    assert parse_due(format_due(NOW)) == NOW
+
+
+def test_apply_reviews_stacks_outcomes_per_word():
+    cards = {1: {"id": 1}, 2: {"id": 2}}
+    later = datetime(2024, 4, 3, 9, 0, 0)
+    updated = apply_reviews(cards, [(1, 5), (2, 1), (1, 5, later), (99, 5)], NOW)
+    by_id = {card["id"]: card for card in updated}
+    assert set(by_id) == {1, 2}  # 知らない単語は無視
+    assert by_id[1]["reps"] == 2
+    assert by_id[1]["last_reviewed"] == format_due(later)
+    assert by_id[1]["next_due"] == "2024-04-09T09:00:00"
+    assert by_id[2]["reps"] == 0
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from score_cache import ScoreCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ScoreCache(str(tmp_path / "cache.db"), "writing_cache", max_entries=2, ttl=60)
+
+
+def test_miss_then_hit(cache):
+    assert cache.get("k") is None
+
+    cache.put("k", {"grammar_score": 90})
+
+    assert cache.get("k") == {"grammar_score": 90}
+    assert cache.snapshot()["hits"] == 1
+    assert cache.snapshot()["misses"] == 1
+    assert cache.snapshot()["hit_rate"] == 0.5
+
+
+def test_expired_entries_are_misses(cache):
+    cache.ttl = -1
+    cache.put("k", {"grammar_score": 90})
+
+    assert cache.get("k") is None
+
+
+def test_evict_drops_least_recently_used(cache):
+    for key in ("a", "b", "c"):
+        cache.put(key, {"key": key})
+        time.sleep(0.01)
+    cache.get("a")  # a を最近使ったことにする
+
+    cache.evict()
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"key": "a"}
+    assert cache.snapshot()["entries"] == 2
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_cache_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ScoreCache(path, "writing_cache", 10, 60).put("k", {"ok": True})
+
+    reopened = ScoreCache(path, "writing_cache", 10, 60)
+
+    assert reopened.get("k") == {"ok": True}
+
+
+def test_cache_key_ignores_width_and_spacing(main_module):
+    key = main_module.writing_cache_key("我是 学生", "我是学生", "gemini-pro")
+
+    assert main_module.writing_cache_key("  我是　学生 ", "我是学生", "gemini-pro") == key
+    assert main_module.writing_cache_key("ＡＢＣ", "我是学生", "gemini-pro") == \
+        main_module.writing_cache_key("ABC", "我是学生", "gemini-pro")
+
+
+def test_cache_key_depends_on_answer_expected_and_model(main_module):
+    key = main_module.writing_cache_key("我是学生", "我是学生", "gemini-pro")
+
+    assert main_module.writing_cache_key("我是老师", "我是学生", "gemini-pro") != key
+    assert main_module.writing_cache_key("我是学生", None, "gemini-pro") != key
+    assert main_module.writing_cache_key("我是学生", "我是学生", "gemini-1.5-flash") != key
@@ -0,0 +1,258 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from result_store import SQLiteResultStore
+from score_cache import ScoreCache
+
+
+@pytest.fixture
+def shared_store(main_module, monkeypatch, tmp_path):
+    """--workers N 相当: 別ワーカーが書いた結果はプッシュされず、共有ストアにだけ入る"""
+    store = SQLiteResultStore(str(tmp_path / "results.db"), max_entries=100, ttl=60)
+    monkeypatch.setattr(main_module, "scoring_results", store)
+    monkeypatch.setattr(main_module, "SHARED_STORE_POLL_INTERVAL", 0.05)
+    return store
+
+
+class FakeRequest:
+    """SSEのジェネレーターが見るのは is_disconnected だけ"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def open_stream(main_module, user_id):
+    token = main_module.create_access_token({"sub": user_id})
+    return FakeRequest(), token
+
+
+class ThreadRecording:
+    """get / put を呼んだスレッドの名前を覚える（イベントループで直接叩いてへんか見る）"""
+
+    def get(self, *args):
+        self.threads.append(threading.current_thread().name)
+        return super().get(*args)
+
+    def put(self, *args):
+        self.threads.append(threading.current_thread().name)
+        return super().put(*args)
+
+
+class RecordingResultStore(ThreadRecording, SQLiteResultStore):
+    pass
+
+
+class RecordingScoreCache(ThreadRecording, ScoreCache):
+    pass
+
+
+# ==================== ScoreEventHub ====================
+def test_publish_reaches_only_that_users_subscribers(main_module):
+    hub = main_module.ScoreEventHub()
+
+    async def scenario():
+        mine, theirs = hub.subscribe("u1"), hub.subscribe("u2")
+        hub.publish("u1", {"task_id": "t1", "status": "completed"})
+        return mine.get_nowait(), theirs.empty()
+
+    received, other_empty = asyncio.run(scenario())
+
+    assert received == {"task_id": "t1", "status": "completed"}
+    assert other_empty
+
+
+def test_unsubscribed_queue_gets_nothing(main_module):
+    hub = main_module.ScoreEventHub()
+
+    async def scenario():
+        queue = hub.subscribe("u1")
+        hub.unsubscribe("u1", queue)
+        hub.publish("u1", {"task_id": "t1", "status": "completed"})
+        return queue.empty()
+
+    assert asyncio.run(scenario())
+    assert hub._subscribers == {}
+
+
+def test_full_subscriber_queue_does_not_block_publish(main_module):
+    hub = main_module.ScoreEventHub()
+
+    async def scenario():
+        queue = hub.subscribe("u1")
+        for n in range(queue.maxsize + 5):
+            hub.publish("u1", {"task_id": f"t{n}", "status": "completed"})
+        return queue.qsize()
+
+    assert asyncio.run(scenario()) == 256
+
+
+def test_wait_for_wakes_on_publish(main_module):
+    hub = main_module.ScoreEventHub()
+
+    async def scenario():
+        asyncio.get_running_loop().call_later(0.05, hub.publish, "u1", {"task_id": "t1", "status": "completed"})
+        started = time.monotonic()
+        result = await hub.wait_for("t1", timeout=5)
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result["status"] == "completed"
+    assert elapsed < 1
+    assert hub._waiters == {}
+
+
+def test_wait_for_times_out_with_none(main_module):
+    hub = main_module.ScoreEventHub()
+
+    assert asyncio.run(hub.wait_for("t1", timeout=0.05)) is None
+    assert hub._waiters == {}
+
+
+# ==================== ロングポーリング ====================
+def test_result_of_another_user_is_not_found(main_module):
+    asyncio.run(main_module.start_task("writing_q1_other", "q1", "u1"))
+    asyncio.run(main_module.finish_task(
+        "writing_q1_other", "u1", {"task_id": "writing_q1_other", "status": "completed", "score": 90}
+    ))
+
+    result = asyncio.run(main_module.get_score_result("writing_q1_other", wait=0, current_user="u2"))
+
+    assert result == {"status": "not_found"}
+    own = asyncio.run(main_module.get_score_result("writing_q1_other", wait=0, current_user="u1"))
+    assert own["score"] == 90
+
+
+def test_long_poll_returns_as_soon_as_the_task_finishes(main_module):
+    asyncio.run(main_module.start_task("writing_q1_wait", "q1", "u1"))
+
+    async def finish_later():
+        await asyncio.sleep(0.1)
+        await main_module.finish_task("writing_q1_wait", "u1", {"task_id": "writing_q1_wait", "status": "completed", "score": 70})
+
+    async def scenario():
+        finishing = asyncio.create_task(finish_later())
+        started = time.monotonic()
+        result = await main_module.get_score_result("writing_q1_wait", wait=5, current_user="u1")
+        await finishing
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result["status"] == "completed"
+    assert elapsed < 1
+
+
+def test_long_poll_gives_up_after_wait(main_module):
+    asyncio.run(main_module.start_task("writing_q1_slow", "q1", "u1"))
+
+    started = time.monotonic()
+    result = asyncio.run(main_module.get_score_result("writing_q1_slow", wait=0.2, current_user="u1"))
+
+    assert result["status"] == "processing"
+    assert 0.2 <= time.monotonic() - started < 1
+
+
+def test_long_poll_sees_results_written_by_another_worker(main_module, shared_store):
+    asyncio.run(main_module.start_task("writing_q1_shared", "q1", "u1"))
+
+    async def scenario():
+        # 別ワーカーの finish_task: ストアには書くけど、このワーカーの score_events には届かへん
+        asyncio.get_running_loop().call_later(0.1, shared_store.put, "writing_q1_shared",
+                                              {"task_id": "writing_q1_shared", "user_id": "u1", "status": "completed"})
+        started = time.monotonic()
+        result = await main_module.get_score_result("writing_q1_shared", wait=5, current_user="u1")
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result["status"] == "completed"
+    assert elapsed < 1
+
+
+# ==================== SSE ====================
+def test_stream_pushes_finished_results(main_module):
+    request, token = open_stream(main_module, "u_stream")
+
+    async def scenario():
+        response = await main_module.stream_score_results(request, token)
+        events = response.body_iterator
+        ready = await events.__anext__()
+        await main_module.finish_task("writing_q1_push", "u_stream", {"task_id": "writing_q1_push", "status": "completed"})
+        await main_module.finish_task("writing_q1_push2", "u_other", {"task_id": "writing_q1_push2", "status": "completed"})
+        pushed = await asyncio.wait_for(events.__anext__(), timeout=2)
+        await events.aclose()
+        return ready, pushed
+
+    ready, pushed = asyncio.run(scenario())
+
+    assert ready.startswith("event: ready")
+    assert pushed.startswith("event: result")
+    assert '"writing_q1_push"' in pushed
+    assert "u_stream" not in main_module.score_events._subscribers
+
+
+def test_stream_picks_up_results_from_another_worker(main_module, shared_store):
+    request, token = open_stream(main_module, "u_shared")
+
+    async def scenario():
+        response = await main_module.stream_score_results(request, token)
+        events = response.body_iterator
+        await events.__anext__()  # ready
+        await asyncio.sleep(0.01)  # updated_since の基準時刻より後に書く
+        shared_store.put("t_other_user", {"task_id": "t_other_user", "user_id": "u_else", "status": "completed"})
+        shared_store.put("t_mine", {"task_id": "t_mine", "user_id": "u_shared", "status": "completed"})
+        pushed = await asyncio.wait_for(events.__anext__(), timeout=2)
+        await events.aclose()
+        return pushed
+
+    pushed = asyncio.run(scenario())
+
+    assert pushed.startswith("event: result")
+    assert '"t_mine"' in pushed
+
+
+def test_stream_rejects_invalid_token(main_module):
+    with pytest.raises(main_module.HTTPException) as error:
+        asyncio.run(main_module.stream_score_results(FakeRequest(), "not-a-token"))
+
+    assert error.value.status_code == 401
+
+
+# ==================== DBスレッドへの逃がし ====================
+def test_result_store_is_used_on_db_threads(main_module, monkeypatch, tmp_path):
+    store = RecordingResultStore(str(tmp_path / "results.db"), max_entries=100, ttl=60)
+    store.threads = []
+    monkeypatch.setattr(main_module, "scoring_results", store)
+
+    async def scenario():
+        await main_module.start_task("writing_q1_db", "q1", "u1")
+        await main_module.finish_task("writing_q1_db", "u1", {"task_id": "writing_q1_db", "status": "completed"})
+        return await main_module.get_score_result("writing_q1_db", wait=0, current_user="u1")
+
+    assert asyncio.run(scenario())["status"] == "completed"
+    assert len(store.threads) == 3
+    assert all(name.startswith("db") for name in store.threads)
+
+
+def test_writing_cache_is_used_on_db_threads(main_module, monkeypatch, tmp_path):
+    cache = RecordingScoreCache(str(tmp_path / "cache.db"), "writing_cache", max_entries=10, ttl=60)
+    cache.threads = []
+    monkeypatch.setattr(main_module, "writing_cache", cache)
+    submission = main_module.WritingSubmission(text="我是老师", question_id="q1", expected_answer="我是学生")
+
+    result, cache_key = asyncio.run(main_module.instant_writing_result(submission, "u1", "chinese"))
+    assert result is None
+    assert cache.threads[0].startswith("db")
+    cache.put(cache_key, {"grammar_score": 80})  # 採点済みにしておく
+
+    cached, _ = asyncio.run(main_module.instant_writing_result(submission, "u1", "chinese"))
+
+    assert cached["cached"] and cached["result"] == {"grammar_score": 80}
+    assert cache.threads[-1].startswith("db")
@@ -0,0 +1,74 @@
+import os
+import threading
+
+from segmenter import Segmenter
+
+
+def make(tmp_path, vocabulary=None, calls=None):
+    def source():
+        if calls is not None:
+            calls.append(1)
+        return vocabulary or {}
+    return Segmenter(str(tmp_path / "segment.cache"), source)
+
+
+def test_segment_with_base_lexicon(tmp_path):
+    segmenter = make(tmp_path)
+    assert segmenter.segment("我们是学生") == ["我们", "是", "学生"]
+    assert segmenter.segment("我喜欢喝咖啡。", keep_punctuation=True) == ["我", "喜欢", "喝", "咖啡", "。"]
+    assert segmenter.segment("我 有 iPhone 15！") == ["我", "有", "iPhone", "15"]
+    assert segmenter.segment("") == []
+
+
+def test_user_vocabulary_and_add_words(tmp_path):
+    segmenter = make(tmp_path, {"熊猫": 2})
+    assert segmenter.segment("熊猫很可爱") == ["熊猫", "很", "可", "爱"]
+
+    segmenter.add_words(["可爱", " "])
+    assert segmenter.segment("熊猫很可爱") == ["熊猫", "很", "可爱"]
+    assert not os.path.exists(segmenter.cache_path)  # 古くなったキャッシュは消す
+
+
+def test_dictionary_is_loaded_lazily_and_cached(tmp_path):
+    calls = []
+    first = make(tmp_path, {"熊猫": 1}, calls)
+    assert calls == [] and not first.snapshot()["loaded"]
+    first.segment("熊猫")
+    assert calls == [1] and first.snapshot()["source"] == "database"
+
+    second = make(tmp_path, {}, calls)
+    assert second.segment("熊猫") == ["熊猫"]
+    assert calls == [1] and second.snapshot()["source"] == "cache"
+
+
+def test_expired_cache_is_rebuilt(tmp_path):
+    calls = []
+    make(tmp_path, {}, calls).segment("我")
+    segmenter = make(tmp_path, {}, calls)
+    segmenter.ttl = -1
+    segmenter.segment("我")
+    assert calls == [1, 1]
+
+
+def test_add_words_while_segmenting(tmp_path):
+    segmenter = make(tmp_path)
+    segmenter.segment("我")
+    errors = []
+
+    def reader():
+        try:
+            for _ in range(300):
+                assert "".join(segmenter.segment("我们都喜欢学习汉语")) == "我们都喜欢学习汉语"
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(200):
+        segmenter.add_words([f"学习{i}", "汉语课"])
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert segmenter.snapshot()["sentences"] == 1 + 4 * 300
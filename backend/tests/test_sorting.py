@@ -0,0 +1,74 @@
+from sorting import align_to_expected, count_inversions, longest_increasing_subsequence, score_sorting_answer
+
+
+def brute_inversions(values):
+    return sum(1 for i in range(len(values)) for j in range(i + 1, len(values)) if values[i] > values[j])
+
+
+def test_align_handles_duplicates_and_extras():
+    positions, missing = align_to_expected(["的", "我", "的", "猫"], ["我", "的", "书", "的"])
+    assert positions == [1, 0, 3, None]
+    assert missing == [2]
+
+
+def test_longest_increasing_subsequence():
+    values = [3, 1, 4, 1, 5, 9, 2, 6]
+    indices = longest_increasing_subsequence(values)
+    picked = [values[i] for i in indices]
+    assert len(picked) == 4 and picked == sorted(set(picked))
+    assert longest_increasing_subsequence([]) == []
+
+
+def test_count_inversions_matches_brute_force():
+    for values in ([], [1], [2, 1], [3, 1, 2, 5, 4, 0], list(range(10, 0, -1))):
+        assert count_inversions(values) == brute_inversions(values)
+
+
+def test_exact_answer_scores_full():
+    result = score_sorting_answer(["我", "是", "学生"], ["我", "是", "学生"])
+    assert result["is_correct"] and result["score"] == 100
+    assert result["kendall_tau"] == 1.0
+    assert [p["status"] for p in result["positions"]] == ["correct"] * 3
+
+
+def test_partial_credit_and_feedback():
+    result = score_sorting_answer(["是", "我", "学生"], ["我", "是", "学生"])
+    assert not result["is_correct"]
+    assert result["kendall_tau_distance"] == 1
+    assert result["lis_length"] == 2
+    assert 0 < result["score"] < 100
+    assert [p["status"] for p in result["positions"]] == ["misplaced", "in_order", "correct"]
+
+    reversed_result = score_sorting_answer(["学生", "是", "我"], ["我", "是", "学生"])
+    assert reversed_result["score"] < result["score"]
+    assert reversed_result["kendall_tau"] == -1.0
+
+
+def test_missing_and_extra_tokens():
+    result = score_sorting_answer(["我", "是", "老师"], ["我", "是", "学生"])
+    assert result["missing"] == ["学生"]
+    assert result["positions"][2]["status"] == "extra"
+    assert score_sorting_answer([], ["我"])["score"] == 0
+
+
+def test_normalize_is_applied():
+    result = score_sorting_answer([" 我", "是 "], ["我", "是"])
+    assert result["is_correct"]
+    assert score_sorting_answer(["Hello"], ["hello"], normalize=str.lower)["is_correct"]
+
+
+def test_grade_sorting_keeps_tones_and_language(main_module):
+    submission = main_module.SortingSubmission(
+        words=["wǒ", "mǎi", "shū"], question_id="q1", expected_order=["wǒ", "mài", "shū"]
+    )
+    assert not main_module.grade_sorting(submission)["is_correct"]
+
+    submission = main_module.SortingSubmission(
+        words=["我們", "學生。"], question_id="q1", expected_order=["我们", "学生"]
+    )
+    assert main_module.grade_sorting(submission)["is_correct"]
+
+    submission = main_module.SortingSubmission(
+        words=["I", "have", "3"], question_id="q1", expected_order=["I", "have", "5"], language="english"
+    )
+    assert not main_module.grade_sorting(submission)["is_correct"]
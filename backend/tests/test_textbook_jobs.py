@@ -0,0 +1,151 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+
+class FakeParser:
+    """parse_textbook_page の代わり。ページの中身で挙動を変える
+
+    b"ok"   -> 2個の単語
+    b"busy" -> busy_times 回だけ503（混雑）してから成功
+    b"bad"  -> 解析エラー
+    """
+
+    def __init__(self, busy_times: int = 0):
+        self.busy_times = busy_times
+        self.calls = {}
+
+    async def __call__(self, page: dict, type: str) -> list:
+        data = page["data"]
+        self.calls[data] = self.calls.get(data, 0) + 1
+        if data == b"bad":
+            raise Exception("JSONの解析に失敗")
+        if data == b"busy" and self.calls[data] <= self.busy_times:
+            raise HTTPException(status_code=503, detail="Geminiが混雑してます")
+        return [{"word": "你好"}, {"word": "谢谢"}]
+
+
+@pytest.fixture
+def textbook(main_module, fake_gemini, monkeypatch):
+    """画像の前処理・Gemini・保存を差し替えて、ジョブの流れだけを見る"""
+    parser = FakeParser()
+    saved = []
+
+    async def run_inline(fn, *args):
+        return fn(*args)
+
+    monkeypatch.setattr(main_module, "run_cpu_task", run_inline)
+    monkeypatch.setattr(main_module, "prepare_textbook_page", lambda contents: {"mime_type": "image/jpeg", "data": contents})
+    monkeypatch.setattr(main_module, "parse_textbook_page", parser)
+    monkeypatch.setattr(main_module, "save_textbook_items",
+                        lambda items, lesson, type, user_id: saved.append((lesson, type, user_id, len(items))))
+    monkeypatch.setattr(main_module, "TEXTBOOK_OVERLOAD_BACKOFF", 0.01)
+    parser.saved = saved
+    return parser
+
+
+def upload(*pages: bytes) -> list:
+    return [UploadFile(file=io.BytesIO(page), filename=f"page{n}.jpg") for n, page in enumerate(pages)]
+
+
+def run_job(main_module, user_id: str, *pages: bytes, events: list = None) -> dict:
+    """ジョブを作って、バックグラウンド処理が終わるまで待つ"""
+
+    async def scenario():
+        queue = main_module.score_events.subscribe(user_id)
+        try:
+            created = await main_module.create_textbook_job(files=upload(*pages), lesson=3, type="word", current_user=user_id)
+            await asyncio.gather(*main_module.background_tasks)
+            while events is not None and not queue.empty():
+                events.append(queue.get_nowait())
+        finally:
+            main_module.score_events.unsubscribe(user_id, queue)
+        return await main_module.get_textbook_job(created["job_id"], current_user=user_id)
+
+    return asyncio.run(scenario())
+
+
+def test_all_pages_are_parsed_and_saved(main_module, textbook):
+    job = run_job(main_module, "u1", b"ok", b"ok")
+
+    assert job["status"] == "completed"
+    assert (job["done_pages"], job["failed_pages"], job["saved_items"]) == (2, 0, 4)
+    assert [page["status"] for page in job["pages"]] == ["completed", "completed"]
+    assert textbook.saved == [(3, "word", "u1", 2), (3, "word", "u1", 2)]
+
+
+def test_overloaded_page_is_retried(main_module, textbook):
+    textbook.busy_times = 2
+
+    job = run_job(main_module, "u1", b"busy")
+
+    assert job["status"] == "completed"
+    assert textbook.calls[b"busy"] == 3
+    assert job["pages"][0] == {"page": 1, "status": "completed", "items": 2}
+
+
+def test_page_gives_up_after_the_retry_limit(main_module, textbook, monkeypatch):
+    monkeypatch.setattr(main_module, "TEXTBOOK_OVERLOAD_RETRIES", 2)
+    textbook.busy_times = 10
+
+    job = run_job(main_module, "u1", b"busy")
+
+    assert textbook.calls[b"busy"] == 3
+    assert job["pages"][0]["status"] == "error"
+    assert "混雑" in job["pages"][0]["error"]
+
+
+def test_other_errors_are_not_retried(main_module, textbook):
+    job = run_job(main_module, "u1", b"bad")
+
+    assert textbook.calls[b"bad"] == 1
+    assert job["pages"][0]["status"] == "error"
+
+
+def test_job_completes_when_only_some_pages_fail(main_module, textbook):
+    job = run_job(main_module, "u1", b"ok", b"bad", b"ok")
+
+    assert job["status"] == "completed"
+    assert (job["done_pages"], job["failed_pages"], job["saved_items"]) == (3, 1, 4)
+    assert [page["status"] for page in job["pages"]] == ["completed", "error", "completed"]
+    assert "3ページ中2ページ" in job["message"]
+
+
+def test_job_is_an_error_when_every_page_fails(main_module, textbook):
+    job = run_job(main_module, "u1", b"bad", b"bad")
+
+    assert job["status"] == "error"
+    assert job["failed_pages"] == 2
+    assert textbook.saved == []
+
+
+def test_progress_is_pushed_to_the_owner(main_module, textbook):
+    events = []
+
+    job = run_job(main_module, "u_progress", b"ok", b"ok", events=events)
+
+    assert all(event["job_id"] == job["job_id"] for event in events)
+    done = [event["done_pages"] for event in events]
+    assert done == sorted(done) and done[-1] == 2
+    assert events[0]["status"] == "processing"
+    assert events[-1]["status"] == "completed"
+    # 途中経過は progress、最後だけ result としてSSEに流れる
+    assert [main_module.sse_event_name(event) for event in events].count("result") == 1
+
+
+def test_job_of_another_user_is_not_found(main_module, textbook):
+    job = run_job(main_module, "u1", b"ok")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main_module.get_textbook_job(job["job_id"], current_user="u2"))
+
+    assert error.value.status_code == 404
+
+
+def test_empty_upload_is_rejected(main_module, textbook):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main_module.create_textbook_job(files=upload(b""), lesson=3, type="word", current_user="u1"))
+
+    assert error.value.status_code == 400
@@ -0,0 +1,49 @@
+import time
+
+from token_cache import TokenCache
+
+
+def payload(sub="a", exp_in=3600, iat_offset=-10):
+    now = time.time()
+    return {"sub": sub, "exp": int(now + exp_in), "iat": int(now + iat_offset)}
+
+
+def test_hit_after_put_and_key_is_hashed():
+    cache = TokenCache(10)
+    cache.put("token-a", payload())
+    assert cache.get("token-a")["sub"] == "a"
+    assert cache.get("token-b") is None
+    assert all("token" not in key for key in cache._entries)  # トークン自体は覚えない
+    assert cache.snapshot()["hits"] == 1 and cache.snapshot()["misses"] == 1
+
+
+def test_expired_token_is_not_returned():
+    cache = TokenCache(10)
+    cache.put("t", payload(exp_in=-1))
+    assert cache.get("t") is None
+    assert cache.snapshot()["expired"] == 1 and cache.snapshot()["entries"] == 0
+
+
+def test_lru_limit_and_disabled_cache():
+    cache = TokenCache(2)
+    for token in ("a", "b", "c"):
+        cache.put(token, payload(sub=token))
+    assert cache.get("a") is None and cache.get("c") is not None
+
+    disabled = TokenCache(0)
+    disabled.put("a", payload())
+    assert disabled.get("a") is None
+
+
+def test_revoke_subject_rejects_earlier_tokens_only():
+    cache = TokenCache(10)
+    old = payload(sub="a")
+    cache.put("old", old)
+    cache.put("other", payload(sub="b"))
+
+    cache.revoke_subject("a")
+    assert cache.get("old") is None and cache.get("other") is not None
+    assert cache.is_revoked(old)
+    assert cache.is_revoked({"sub": "a"})  # iat の無い古いトークン
+    assert not cache.is_revoked(payload(sub="b"))
+    assert not cache.is_revoked(payload(sub="a", iat_offset=5))  # 削除の後に登録し直した人
@@ -0,0 +1,52 @@
+from repositories import CachedUserRepo, MemoryUserRepo
+
+
+class CountingRepo(MemoryUserRepo):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def _get(self, student_id):
+        self.reads += 1
+        return super()._get(student_id)
+
+
+def test_reads_are_cached_until_write():
+    inner = CountingRepo()
+    inner.insert({"student_id": "a", "is_admin": False})
+    repo = CachedUserRepo(inner, ttl=30)
+
+    assert not repo.get("a")["is_admin"]
+    assert not repo.get("a")["is_admin"]
+    assert inner.reads == 1
+
+    repo.update("a", {"is_admin": True})
+    assert repo.get("a")["is_admin"]
+    assert inner.reads == 2
+
+    repo.delete("a")
+    assert repo.get("a") is None
+
+
+def test_cached_copy_cannot_be_mutated_by_caller():
+    inner = MemoryUserRepo()
+    inner.insert({"student_id": "a", "language": "chinese"})
+    repo = CachedUserRepo(inner, ttl=30)
+    repo.get("a")["language"] = "german"
+    assert repo.get("a")["language"] == "chinese"
+
+
+def test_expired_and_evicted_entries_are_reloaded():
+    inner = CountingRepo()
+    for sid in ("a", "b", "c"):
+        inner.insert({"student_id": sid})
+    repo = CachedUserRepo(inner, ttl=0)
+    repo.get("a")
+    repo.get("a")
+    assert inner.reads == 2
+
+    repo = CachedUserRepo(inner, ttl=30, max_entries=2)
+    for sid in ("a", "b", "c", "a"):
+        repo.get(sid)
+    assert repo.snapshot()["entries"] == 2
+    assert repo.snapshot()["misses"] == 4
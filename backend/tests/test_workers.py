@@ -0,0 +1,61 @@
+import base64
+import io
+
+from PIL import Image, ImageDraw
+
+from workers import difference_hash, prepare_textbook_page, preprocess_handwriting
+
+
+def canvas_data_url(offset=(0, 0), size=(800, 600), blank=False) -> str:
+    image = Image.new("RGBA", size, (0, 0, 0, 0))  # キャンバスと同じ透明背景
+    if not blank:
+        draw = ImageDraw.Draw(image)
+        x, y = 300 + offset[0], 200 + offset[1]
+        draw.line((x, y, x + 200, y), fill=(0, 0, 0, 255), width=12)
+        draw.line((x + 100, y, x + 100, y + 200), fill=(0, 0, 0, 255), width=12)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_preprocess_crops_and_shrinks():
+    result = preprocess_handwriting(canvas_data_url(), max_side=128)
+    assert not result["blank"]
+    assert max(result["size"]) <= 128
+    assert result["original_size"] == (800, 600)
+    assert result["bytes_out"] < result["bytes_in"]
+    assert Image.open(io.BytesIO(result["png"])).mode == "1"
+
+
+def test_blank_canvas_has_no_hash():
+    result = preprocess_handwriting(canvas_data_url(blank=True))
+    assert result["blank"] and result["dhash"] is None
+
+
+def test_shifted_strokes_hash_the_same():
+    first = preprocess_handwriting(canvas_data_url())["dhash"]
+    shifted = preprocess_handwriting(canvas_data_url(offset=(-150, 120)))["dhash"]
+    assert bin(first ^ shifted).count("1") <= 4
+    assert difference_hash(Image.new("L", (10, 10), 255)) is None
+
+
+def test_textbook_page_is_shrunk_to_jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGBA", (4000, 3000), (255, 255, 255, 0)).save(buffer, format="PNG")
+    page = prepare_textbook_page(buffer.getvalue())
+    assert page["mime_type"] == "image/jpeg"
+    assert page["size"][0] <= 1920 and page["size"][1] <= 1080
+
+
+def test_password_hash_and_rehash_on_round_change():
+    from workers import hash_passwords, verify_password_hash
+
+    hashed, blank = hash_passwords(["secret", "  "], rounds=1000)
+    assert blank == "" and "$1000$" in hashed
+
+    assert verify_password_hash("secret", hashed, 1000) == (True, None)
+    assert verify_password_hash("wrong", hashed, 1000) == (False, None)
+
+    ok, new_hash = verify_password_hash("secret", hashed, 2000)
+    assert ok and "$2000$" in new_hash
+    assert verify_password_hash("secret", new_hash, 2000) == (True, None)
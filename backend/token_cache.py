@@ -0,0 +1,80 @@
+"""
+検証済みJWTのキャッシュ
+同じトークンが1秒ごとのポーリングで何度も来るので、署名の検証は最初の1回だけにして
+2回目からは sha256(トークン) -> 中身 の辞書を引くだけにする（トークン自体は覚えない）
+ユーザーを削除したら、その人に削除より前に発行したトークンはキャッシュにあっても無くても通さない
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    sha256(トークン) -> (exp, 中身) のLRU
+    exp を過ぎたものは返さない。revoke_subject() した人の古いトークンも返さない
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (exp, payload)
+        self._revoked = {}  # sub -> 取り消した時刻（これより前の iat のトークンは無効）
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "revoked": 0}
+
+    def get(self, token: str) -> Optional[dict]:
+        key = token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            exp, payload = entry
+            if exp is not None and exp <= time.time():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return payload
+
+    def put(self, token: str, payload: dict):
+        """decode 済みのトークンを覚える（max_entries=0 なら何もしない）"""
+        if self.max_entries <= 0:
+            return
+        key = token_key(token)
+        with self._lock:
+            self._entries[key] = (payload.get("exp"), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def is_revoked(self, payload: dict) -> bool:
+        """取り消した人の、取り消しより前に発行したトークンか（iat の無い古いトークンも無効）"""
+        revoked_at = self._revoked.get(payload.get("sub"))
+        if revoked_at is None:
+            return False
+        iat = payload.get("iat")
+        if iat is None or iat < revoked_at:
+            self.stats["revoked"] += 1
+            return True
+        return False
+
+    def revoke_subject(self, sub: str):
+        """その人のキャッシュを捨てて、今までに発行したトークンを通さないようにする"""
+        with self._lock:
+            # iat は秒単位（切り捨て）なので、同じ秒のうちに発行したトークンも弾かれる側に倒れる
+            self._revoked[sub] = time.time()
+            for key in [key for key, (_, payload) in self._entries.items() if payload.get("sub") == sub]:
+                del self._entries[key]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "revoked_subjects": len(self._revoked)}
@@ -0,0 +1,204 @@
+"""
+プロセスプールで動かすCPU処理（画像の前処理・パスワードのハッシュなど）
+main.py を import すると Supabase接続やGeminiの初期化まで走ってしまうので、
+子プロセスからはこの軽いモジュールだけを読み込む
+"""
+import base64
+import io
+import time
+from typing import Optional
+
+from passlib.context import CryptContext
+from PIL import Image
+
+INK_THRESHOLD = 200  # これより暗いピクセルを「インク」とみなす
+CROP_MARGIN = 16  # 文字の周りに残す余白（px）
+
+
+def difference_hash(image: Image.Image, hash_size: int = 8) -> Optional[int]:
+    """
+    dHash（差分ハッシュ）を計算
+    文字の位置がずれても同じになるよう、インクのある範囲だけ切り出してから縮小する
+    真っ白（何も書いてない）ならNone
+    """
+    grey = image.convert("L")
+    bbox = grey.point(lambda px: 255 if px < INK_THRESHOLD else 0).getbbox()  # 薄いノイズは無視
+    if bbox is None:
+        return None
+    small = grey.crop(bbox).resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def flatten_to_white(image: Image.Image) -> Image.Image:
+    """透明部分を白にして、白背景に黒文字のRGB画像にする"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        background.paste(image, mask=image.split()[3])  # アルファチャンネルをマスクに使う
+        image = background
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def preprocess_handwriting(image_data: str, max_side: int = 512, binarize: bool = True) -> dict:
+    """
+    手書きキャンバス（base64）をGeminiに送る最小限の画像にする
+    デコード → 白背景に合成 → グレースケール → 文字の範囲で切り抜き → 縮小 → 2値化 → PNG
+    各ステップの所要時間（ミリ秒）も返す
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    def lap(step: str):
+        nonlocal started
+        now = time.perf_counter()
+        timings[step] = round((now - started) * 1000, 2)
+        started = now
+
+    image_bytes = base64.b64decode(image_data.split(",")[-1])
+    lap("decode")
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    original_size = image.size
+    lap("open")
+    image = flatten_to_white(image)
+    lap("flatten")
+
+    grey = image.convert("L")
+    ink_bbox = grey.point(lambda px: 255 if px < INK_THRESHOLD else 0).getbbox()
+    lap("greyscale")
+    if ink_bbox is not None:
+        # 文字のある範囲だけ残す（白紙ならそのまま）
+        left, top, right, bottom = ink_bbox
+        grey = grey.crop((
+            max(0, left - CROP_MARGIN),
+            max(0, top - CROP_MARGIN),
+            min(grey.size[0], right + CROP_MARGIN),
+            min(grey.size[1], bottom + CROP_MARGIN),
+        ))
+    if max(grey.size) > max_side:
+        grey.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    lap("downscale")
+
+    if binarize:
+        grey = grey.point(lambda px: 255 if px >= INK_THRESHOLD else 0).convert("1")
+        lap("binarize")
+
+    dhash = difference_hash(grey) if ink_bbox is not None else None
+    lap("hash")
+
+    buffer = io.BytesIO()
+    grey.save(buffer, format="PNG", optimize=True)
+    png = buffer.getvalue()
+    lap("encode")
+
+    return {
+        "blank": ink_bbox is None,
+        "png": png,
+        "dhash": dhash,
+        "original_size": original_size,
+        "size": grey.size,
+        "bytes_in": len(image_bytes),
+        "bytes_out": len(png),
+        "timings": timings,
+    }
+
+
+def prepare_textbook_page(contents: bytes, max_width: int = 1920, max_height: int = 1080) -> dict:
+    """
+    教科書の写真をGeminiに送るサイズに縮小してJPEGにする
+    大きすぎる画像は処理が遅いため最大1920x1080に収める
+    """
+    try:
+        image = Image.open(io.BytesIO(contents))
+        image.load()
+    except Exception as img_error:
+        raise ValueError(f"画像の読み込みに失敗: {str(img_error)}")
+    original_size = image.size
+    image_format = image.format
+    if image.size[0] > max_width or image.size[1] > max_height:
+        image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    image = flatten_to_white(image)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return {
+        "data": buffer.getvalue(),
+        "mime_type": "image/jpeg",
+        "format": image_format,
+        "original_size": original_size,
+        "size": image.size,
+    }
+
+
+def split_pdf_pages(pdf_bytes: bytes, dpi: int = 150) -> list:
+    """
+    PDFを1ページずつPNG画像にする（pypdfium2 が必要、任意の依存）
+    """
+    import pypdfium2 as pdfium  # 入っていなければ ImportError を呼び出し元で扱う
+
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    pages = []
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            image = page.render(scale=dpi / 72).to_pil()
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            pages.append(buffer.getvalue())
+            page.close()
+    finally:
+        pdf.close()
+    return pages
+
+
+# ==================== パスワードハッシュ ====================
+# pbkdf2 は1回で数十ミリ秒かかるので、ログインが集中してもイベントループを止めないよう子プロセスで計算する
+_password_contexts = {}
+
+
+def password_context(rounds: int) -> CryptContext:
+    """
+    rounds 回の pbkdf2_sha256 で作る CryptContext（0 なら passlib の既定値）
+    rounds を指定した時は最小・最大も同じにして、違う回数のハッシュは needs_update で作り直させる
+    """
+    context = _password_contexts.get(rounds)
+    if context is None:
+        settings = {}
+        if rounds > 0:
+            settings = {
+                "pbkdf2_sha256__default_rounds": rounds,
+                "pbkdf2_sha256__min_rounds": rounds,
+                "pbkdf2_sha256__max_rounds": rounds,
+            }
+        context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto", **settings)
+        _password_contexts[rounds] = context
+    return context
+
+
+def hash_passwords(passwords: list, rounds: int = 0) -> list:
+    """パスワードをまとめてハッシュ化（空のパスワードは空文字列のまま）"""
+    context = password_context(rounds)
+    return [context.hash(password) if password and password.strip() else "" for password in passwords]
+
+
+def verify_password_hash(password: str, password_hash: str, rounds: int = 0) -> tuple:
+    """
+    パスワードを検証して (合っているか, 作り直したハッシュ or None) を返す
+    ハッシュの回数が今の設定と違えば、合っていた時だけ新しい回数でハッシュし直す
+    """
+    context = password_context(rounds)
+    if not context.verify(password, password_hash):
+        return False, None
+    if context.needs_update(password_hash):
+        return True, context.hash(password)
+    return True, None
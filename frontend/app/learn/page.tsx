@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import Link from 'next/link';
 import { getApiUrl, getAuthHeaders } from '@/lib/api';
 import { useAuth } from '@/contexts/AuthContext';
@@ -42,6 +42,7 @@ interface Grammar {
   description: string;
   example_cn: string;
   example_jp: string;
+  tokens?: string[]; // サーバーで単語に区切った例文（並べ替えの選択肢）
 }
 
 export default function LearnPage() {
@@ -55,16 +56,18 @@ export default function LearnPage() {
   const [selectedLesson, setSelectedLesson] = useState<number | null>(null);
   const [currentMode, setCurrentMode] = useState<QuizMode>('translation'); // デフォルトは和文中訳
   const [availableLessons, setAvailableLessons] = useState<number[]>([]); // アップロードされたレッスン番号のリスト
+  const [lessonCounts, setLessonCounts] = useState<Record<number, { word_count: number | null; grammar_count: number | null }>>({}); // レッスンごとの件数
   const [handwritingResults, setHandwritingResults] = useState<any[]>([]); // 手書きモードの採点結果を保存
   const [showResultScreen, setShowResultScreen] = useState(false); // リザルト画面の表示フラグ
   const QUESTIONS_PER_SET = 10; // 10問ごとにリザルト表示
+  const reviewedCountRef = useRef(0); // 復習スケジュールに送り済みの結果の数
 
   // --- 🛠️ アップロードされたレッスン番号を取得 ---
   useEffect(() => {
     const fetchLessons = async () => {
       try {
         const apiUrl = getApiUrl();
-        const res = await fetch(`${apiUrl}/api/lessons`, {
+        const res = await fetch(`${apiUrl}/api/lessons?with_counts=true`, {
           headers: getAuthHeaders()
         });
         
@@ -74,9 +77,10 @@ export default function LearnPage() {
           return;
         }
         
-        const data = await res.json();
+        const data: { lesson: number; word_count: number | null; grammar_count: number | null }[] = await res.json();
         console.log('📚 取得したレッスン番号:', data);
-        setAvailableLessons(data);
+        setAvailableLessons(data.map((entry) => entry.lesson));
+        setLessonCounts(Object.fromEntries(data.map((entry) => [entry.lesson, entry])));
       } catch (e) {
         console.error('レッスン番号の取得に失敗:', e);
       }
@@ -84,6 +88,25 @@ export default function LearnPage() {
     fetchLessons();
   }, []);
 
+  // --- 🧠 リザルト画面が出たら、まだ送ってない結果をまとめて1回で復習スケジュールに送る ---
+  useEffect(() => {
+    if (!showResultScreen) return;
+    const pending = handwritingResults.slice(reviewedCountRef.current);
+    reviewedCountRef.current = handwritingResults.length;
+    // 正誤がはっきりしている結果だけ送る（送信エラーや判定が読み取れなかった分を「不正解」として数えない）
+    const results = pending
+      .filter((r) => r.status !== 'error' && !r.error && typeof r.is_correct === 'boolean')
+      .map((r) => ({ match: /^handwriting-(\d+)$/.exec(r.question_id || ''), correct: r.is_correct as boolean }))
+      .filter((r) => r.match)
+      .map((r) => ({ word_id: parseInt(r.match![1]), correct: r.correct }));
+    if (results.length === 0) return;
+    fetch(`${getApiUrl()}/api/review`, {
+      method: 'POST',
+      headers: getAuthHeaders(),
+      body: JSON.stringify({ results })
+    }).catch((e) => console.error('復習結果の送信に失敗:', e));
+  }, [showResultScreen]);
+
   // --- 🛠️ 必須機能: 配列をグシャグシャに混ぜる関数（フィッシャー–イェーツ法） ---
   const shuffleArray = <T,>(array: T[]): T[] => {
     const newArray = [...array];
@@ -112,12 +135,14 @@ export default function LearnPage() {
       const apiUrl = getApiUrl();
       
       // ★★★ ここを変更！モードによって宛先を変える！ ★★★
-      let endpoint = "/api/words";
+      // 単語はサーバー側でランダムに10問分だけ抜き出してもらう
+      // 文法は例文ごとに問題を作るので全部取ってくる
+      let query = `/api/words?lesson=${lesson}&sample=${QUESTIONS_PER_SET}`;
       if (currentMode === 'reorder') {
-        endpoint = "/api/grammar";
+        query = `/api/grammar?lesson=${lesson}`;
       }
 
-      const res = await fetch(`${apiUrl}${endpoint}?lesson=${lesson}`, {
+      const res = await fetch(`${apiUrl}${query}`, {
         headers: getAuthHeaders()
       });
       
@@ -182,7 +207,22 @@ export default function LearnPage() {
           // ★ここでランダム化を発動！蛆（強調）！
           const shuffled = shuffleArray(expandedGrammar);
           // 10問に制限
-          setGrammarData(shuffled.slice(0, QUESTIONS_PER_SET));
+          const selected = shuffled.slice(0, QUESTIONS_PER_SET);
+          // 例文をサーバーでまとめて単語ごとに区切ってもらう（失敗したら1文字ずつのまま）
+          try {
+            const segRes = await fetch(`${apiUrl}/api/segment`, {
+              method: 'POST',
+              headers: getAuthHeaders(),
+              body: JSON.stringify({ sentences: selected.map((g) => g.example_cn), keep_punctuation: true })
+            });
+            if (segRes.ok) {
+              const seg: { tokens: string[][] } = await segRes.json();
+              selected.forEach((g, i) => { g.tokens = seg.tokens[i]; });
+            }
+          } catch (e) {
+            console.error('例文の分割に失敗:', e);
+          }
+          setGrammarData(selected);
           setWords([]);
         } else {
           // ★ここでランダム化を発動！蛆（強調）！
@@ -193,6 +233,7 @@ export default function LearnPage() {
         }
         // 手書きモードの結果をリセット
         setHandwritingResults([]);
+        reviewedCountRef.current = 0;
         setShowResultScreen(false);
         setCurrentIndex(0); // 1問目から
         setSelectedLesson(lesson);
@@ -302,6 +343,9 @@ export default function LearnPage() {
                         key={lessonNum}
                         onClick={() => setLessonInput(lessonNum.toString())}
                         className={`${styles.lessonButton} ${lessonInput === lessonNum.toString() ? styles.lessonButtonActive : ''}`}
+                        title={lessonCounts[lessonNum]?.word_count != null
+                          ? `単語 ${lessonCounts[lessonNum].word_count}個 / 文法 ${lessonCounts[lessonNum].grammar_count}個`
+                          : undefined}
                       >
                         {lessonNum}
                       </button>
@@ -428,6 +472,7 @@ export default function LearnPage() {
                     answerText={(currentWord as Grammar).example_cn || ""}
                     description={(currentWord as Grammar).description || ""}
                     title={(currentWord as Grammar).title || ""}
+                    tokens={(currentWord as Grammar).tokens}
                     onCorrect={handleNext}
                   />
                 </div>
@@ -517,8 +562,11 @@ export default function LearnPage() {
   );
 }
 
-// 🧩 並べ替えクイズコンポーネント（例文を1文字ずつバラバラにする）
-function ReorderQuiz({ questionText, answerText, description, title, onCorrect }: { questionText: string, answerText: string, description: string, title: string, onCorrect: () => void }) {
+// 🧩 並べ替えクイズコンポーネント（例文を単語ごと、なければ1文字ずつバラバラにする）
+function ReorderQuiz({ questionText, answerText, description, title, tokens, onCorrect }: { questionText: string, answerText: string, description: string, title: string, tokens?: string[], onCorrect: () => void }) {
+  // サーバーで区切った単語があればそれを、なければ1文字ずつ（中国語はスペースがないから）
+  const splitAnswer = () => (tokens && tokens.length > 0 ? [...tokens] : answerText.split('').filter(c => c.trim() !== ''));
+
   // 1. 例文を1文字ずつバラバラにする（最初はシャッフル済み）
   const [shuffledChars, setShuffledChars] = useState<string[]>([]);
   const [selectedChars, setSelectedChars] = useState<string[]>([]);
@@ -527,8 +575,7 @@ function ReorderQuiz({ questionText, answerText, description, title, onCorrect }
   // 初期化：答えが変わったらリセット（1回だけ実行）
   useEffect(() => {
     if (!answerText || initialized) return;
-    // 中国語はスペースがないから1文字ずつ分割
-    const chars = answerText.split('').filter(c => c.trim() !== ''); 
+    const chars = splitAnswer();
     // シャッフル（ランダム順にする）
     const shuffled = [...chars].sort(() => Math.random() - 0.5);
     
@@ -565,7 +612,7 @@ function ReorderQuiz({ questionText, answerText, description, title, onCorrect }
   // リセットボタン
   const handleReset = () => {
     if (!answerText) return;
-    const chars = answerText.split('').filter(c => c.trim() !== '');
+    const chars = splitAnswer();
     setShuffledChars(chars.sort(() => Math.random() - 0.5));
     setSelectedChars([]);
   };
@@ -3,6 +3,7 @@
 import { useState, useRef, useEffect } from 'react';
 import CanvasDraw from 'react-canvas-draw';
 import { getApiUrl, getAuthHeaders } from '@/lib/api';
+import { waitForScoreResult } from '@/lib/scoreStream';
 import styles from './HandwritingMode.module.css';
 
 interface Question {
@@ -52,8 +53,12 @@ export default function HandwritingMode({ question, onComplete, backgroundMode =
         pollResultInBackground(data.task_id);
         // すぐに次の問題へ進む
         onComplete({ task_id: data.task_id, status: 'processing' });
+      } else if (data.status === 'completed') {
+        // 似た画像を採点済みならその場で結果が返ってくる
+        setResult(data);
+        setSubmitting(false);
       } else {
-        // 通常モード：結果をポーリングして表示
+        // 通常モード：結果を待って表示
         pollResult(data.task_id);
       }
     } catch (error) {
@@ -68,74 +73,28 @@ export default function HandwritingMode({ question, onComplete, backgroundMode =
     }
   };
   
-  // 裏で結果をポーリング（結果を保存するが画面には表示しない）
+  // 裏で結果を待つ（結果を保存するが画面には表示しない）
+  // 結果はSSEでプッシュされてくる（届かない時はロングポーリング）
   const pollResultInBackground = async (tid: string) => {
-    const apiUrl = getApiUrl();
-    const maxAttempts = 30;
-    let attempts = 0;
-
-    const interval = setInterval(async () => {
-      attempts++;
-      try {
-        const response = await fetch(`${apiUrl}/api/score/result/${tid}`, {
-          headers: getAuthHeaders()
-        });
-        const data = await response.json();
-
-        if (data.status === 'completed') {
-          clearInterval(interval);
-          // 結果を保存（リザルト画面で表示される）
-          // 注意：onCompleteは呼ばない（既に次の問題へ進んでいるため）
-          // 代わりに、結果を保存するためにonCompleteを呼ぶ（ただし、次の問題へは進まない）
-          onComplete(data);
-        } else if (data.status === 'error' || attempts >= maxAttempts) {
-          clearInterval(interval);
-          const errorResult = { error: '採点に失敗しました', is_correct: false, status: 'error' };
-          // エラー結果も保存
-          onComplete(errorResult);
-        }
-      } catch (error) {
-        console.error('結果取得エラー:', error);
-        if (attempts >= maxAttempts) {
-          clearInterval(interval);
-          const errorResult = { error: '採点に失敗しました', is_correct: false };
-          onComplete(errorResult);
-        }
-      }
-    }, 1000);
+    const data = await waitForScoreResult(tid);
+    if (data.status === 'completed') {
+      // 結果を保存（リザルト画面で表示される）
+      // 注意：既に次の問題へ進んでいるので、onCompleteは結果の保存のためだけに呼ぶ
+      onComplete(data);
+    } else {
+      // エラー結果も保存
+      onComplete({ error: '採点に失敗しました', is_correct: false, status: 'error' });
+    }
   };
 
   const pollResult = async (tid: string) => {
-    const apiUrl = getApiUrl();
-    const maxAttempts = 30;
-    let attempts = 0;
-
-    const interval = setInterval(async () => {
-      attempts++;
-      try {
-        const response = await fetch(`${apiUrl}/api/score/result/${tid}`, {
-          headers: getAuthHeaders()
-        });
-        const data = await response.json();
-
-        if (data.status === 'completed') {
-          clearInterval(interval);
-          setResult(data);
-          setSubmitting(false);
-        } else if (data.status === 'error' || attempts >= maxAttempts) {
-          clearInterval(interval);
-          setSubmitting(false);
-          const errorResult = { error: '採点に失敗しました', is_correct: false };
-          setResult(errorResult);
-        }
-      } catch (error) {
-        console.error('結果取得エラー:', error);
-        if (attempts >= maxAttempts) {
-          clearInterval(interval);
-          setSubmitting(false);
-        }
-      }
-    }, 1000);
+    const data = await waitForScoreResult(tid);
+    if (data.status === 'completed') {
+      setResult(data);
+    } else {
+      setResult({ error: '採点に失敗しました', is_correct: false });
+    }
+    setSubmitting(false);
   };
 
   const handleClear = () => {
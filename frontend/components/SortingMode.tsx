@@ -2,6 +2,7 @@
 
 import { useState } from 'react';
 import { getApiUrl, getAuthHeaders } from '@/lib/api';
+import { useAuth } from '@/contexts/AuthContext';
 import styles from './SortingMode.module.css';
 
 interface Question {
@@ -18,6 +19,7 @@ interface SortingModeProps {
 }
 
 export default function SortingMode({ question, onComplete }: SortingModeProps) {
+  const { user } = useAuth();
   const [selectedWords, setSelectedWords] = useState<string[]>([]);
   const [remainingWords, setRemainingWords] = useState<string[]>(
     question.words ? [...question.words] : []
@@ -48,6 +50,7 @@ export default function SortingMode({ question, onComplete }: SortingModeProps)
           words: selectedWords,
           question_id: question.id,
           expected_order: question.expected_order || [],
+          language: user?.language,
         }),
       });
 
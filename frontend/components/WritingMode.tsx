@@ -1,7 +1,9 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { getApiUrl } from '@/lib/api';
+import { getApiUrl, getAuthHeaders } from '@/lib/api';
+import { useAuth } from '@/contexts/AuthContext';
+import { waitForScoreResult } from '@/lib/scoreStream';
 import styles from './WritingMode.module.css';
 
 interface Question {
@@ -16,6 +18,7 @@ interface WritingModeProps {
 }
 
 export default function WritingMode({ question, onComplete }: WritingModeProps) {
+  const { user } = useAuth();
   const [text, setText] = useState('');
   const [submitting, setSubmitting] = useState(false);
   const [result, setResult] = useState<any>(null);
@@ -29,20 +32,26 @@ export default function WritingMode({ question, onComplete }: WritingModeProps)
       const apiUrl = getApiUrl();
       const response = await fetch(`${apiUrl}/api/score/writing`, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
+        headers: getAuthHeaders(),
         body: JSON.stringify({
           text: text,
           question_id: question.id,
           expected_answer: question.expected_answer,
+          language: user?.language,
         }),
       });
 
       const data = await response.json();
       setTaskId(data.task_id);
       
-      // 結果をポーリング
+      // キャッシュ済みの回答ならその場で結果が返ってくる
+      if (data.status === 'completed') {
+        setResult(data.result || data);
+        setSubmitting(false);
+        return;
+      }
+      
+      // 結果を待つ（SSEでプッシュ、届かない時はロングポーリング）
       pollResult(data.task_id);
     } catch (error) {
       console.error('送信エラー:', error);
@@ -51,33 +60,13 @@ export default function WritingMode({ question, onComplete }: WritingModeProps)
   };
 
   const pollResult = async (tid: string) => {
-    const apiUrl = getApiUrl();
-    const maxAttempts = 30;
-    let attempts = 0;
-
-    const interval = setInterval(async () => {
-      attempts++;
-      try {
-        const response = await fetch(`${apiUrl}/api/score/result/${tid}`);
-        const data = await response.json();
-
-        if (data.status === 'completed') {
-          clearInterval(interval);
-          setResult(data.result || data);
-          setSubmitting(false);
-        } else if (data.status === 'error' || attempts >= maxAttempts) {
-          clearInterval(interval);
-          setSubmitting(false);
-          setResult({ error: '採点に失敗しました' });
-        }
-      } catch (error) {
-        console.error('結果取得エラー:', error);
-        if (attempts >= maxAttempts) {
-          clearInterval(interval);
-          setSubmitting(false);
-        }
-      }
-    }, 1000);
+    const data = await waitForScoreResult(tid);
+    if (data.status === 'completed') {
+      setResult(data.result || data);
+    } else {
+      setResult({ error: '採点に失敗しました' });
+    }
+    setSubmitting(false);
   };
 
   return (
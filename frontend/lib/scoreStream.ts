@@ -0,0 +1,114 @@
+import { getApiUrl, getAuthHeaders, getAuthToken } from '@/lib/api';
+
+/**
+ * 採点結果の受け取り口
+ * SSE（/api/score/stream）で1本の接続に全タスクの結果をまとめて受け取る
+ * SSEが使えない・届かない時はロングポーリング（/api/score/result/{id}?wait=）にフォールバック
+ */
+
+const TERMINAL_STATUSES = ['completed', 'error'];
+const LONG_POLL_WAIT_SECONDS = 25; // サーバー側で待ってもらう時間
+const SSE_GRACE_MS = 10000; // SSEで届かなければこの時間後にロングポーリングで確認
+const DEFAULT_TIMEOUT_MS = 60000; // これを過ぎたら採点失敗扱い
+
+type Resolver = (result: any) => void;
+
+let eventSource: EventSource | null = null;
+let eventSourceToken: string | null = null;
+let streamReady = false;
+const pending = new Map<string, Resolver[]>(); // task_id -> 結果待ちのコールバック
+const arrived = new Map<string, any>(); // 待ち登録より先に届いた結果
+
+function deliver(result: any) {
+  const taskId = result?.task_id;
+  if (!taskId) return;
+  const resolvers = pending.get(taskId);
+  if (resolvers) {
+    pending.delete(taskId);
+    resolvers.forEach((resolve) => resolve(result));
+  } else {
+    // POSTのレスポンスより先に結果が届くこともある
+    arrived.set(taskId, result);
+    setTimeout(() => arrived.delete(taskId), DEFAULT_TIMEOUT_MS);
+  }
+}
+
+function ensureStream() {
+  if (typeof window === 'undefined' || typeof EventSource === 'undefined') return;
+  const token = getAuthToken();
+  if (!token) return;
+  if (eventSource && eventSourceToken === token) return;
+
+  eventSource?.close();
+  streamReady = false;
+  eventSourceToken = token;
+  eventSource = new EventSource(`${getApiUrl()}/api/score/stream?token=${encodeURIComponent(token)}`);
+  eventSource.addEventListener('ready', () => {
+    streamReady = true;
+  });
+  eventSource.addEventListener('result', (event) => {
+    try {
+      deliver(JSON.parse((event as MessageEvent).data));
+    } catch (error) {
+      console.error('採点結果の解析エラー:', error);
+    }
+  });
+  eventSource.onerror = () => {
+    // ブラウザが自動で再接続する。その間はロングポーリングで拾う
+    streamReady = false;
+  };
+}
+
+async function longPoll(taskId: string, deadline: number): Promise<any> {
+  const apiUrl = getApiUrl();
+  while (Date.now() < deadline) {
+    const wait = Math.min(LONG_POLL_WAIT_SECONDS, Math.max(1, Math.floor((deadline - Date.now()) / 1000)));
+    try {
+      const response = await fetch(`${apiUrl}/api/score/result/${taskId}?wait=${wait}`, {
+        headers: getAuthHeaders(),
+      });
+      const data = await response.json();
+      if (TERMINAL_STATUSES.includes(data.status)) {
+        return data;
+      }
+    } catch (error) {
+      console.error('結果取得エラー:', error);
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  }
+  return { status: 'error', error: '採点に失敗しました', is_correct: false };
+}
+
+/**
+ * task_id の採点結果が出るまで待つ（completed / error のどちらかで解決する）
+ */
+export function waitForScoreResult(taskId: string, timeoutMs: number = DEFAULT_TIMEOUT_MS): Promise<any> {
+  ensureStream();
+
+  const early = arrived.get(taskId);
+  if (early) {
+    arrived.delete(taskId);
+    return Promise.resolve(early);
+  }
+
+  const deadline = Date.now() + timeoutMs;
+  return new Promise((resolve) => {
+    let settled = false;
+    const finish = (result: any) => {
+      if (settled) return;
+      settled = true;
+      pending.delete(taskId);
+      resolve(result);
+    };
+
+    pending.set(taskId, [...(pending.get(taskId) || []), finish]);
+
+    // SSEが繋がっていればしばらく待ち、届かなければロングポーリングで確認
+    const fallbackDelay = streamReady ? SSE_GRACE_MS : 0;
+    setTimeout(() => {
+      if (!settled) {
+        longPoll(taskId, deadline).then(finish);
+      }
+    }, fallbackDelay);
+  });
+}